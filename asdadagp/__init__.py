@@ -6,17 +6,30 @@ from .const import PKG_NAME
 _LOGGER = getLogger(PKG_NAME)
 
 # Constants
-from .decoder import asdadagp_decode, tokens2guitarpro
+from .augment import Variant, augment
+from .batch import encode_directory
+from .decoder import (
+    IncrementalDecoder,
+    asdadagp_decode,
+    ids2guitarpro,
+    tokens2guitarpro,
+)
 
 # Main functions
-from .encoder import asdadagp_encode, guitarpro2tokens
+from .encoder import asdadagp_encode, guitarpro2ids, guitarpro2tokens, iter_tokens
+from .midi import tokens2midi
 from .processor import (
+    TokenDocument,
     get_string_tunings,
+    index_measures,
     measures_playing_order,
     pre_decoding_processing,
+    read_token_header,
     tokens_to_measures,
     tracks_check,
 )
+from .validate import validate_tokens
+from .vocab import Vocabulary
 
 __all__ = [
     # Version and logging
@@ -26,12 +39,25 @@ __all__ = [
     # Main functions
     "asdadagp_encode",
     "guitarpro2tokens",
+    "iter_tokens",
+    "encode_directory",
+    "augment",
+    "Variant",
     "asdadagp_decode",
     "tokens2guitarpro",
+    "IncrementalDecoder",
+    "tokens2midi",
+    "guitarpro2ids",
+    "ids2guitarpro",
+    "validate_tokens",
+    "Vocabulary",
     # Processor functions
     "tracks_check",
     "get_string_tunings",
+    "read_token_header",
+    "TokenDocument",
     "tokens_to_measures",
+    "index_measures",
     "measures_playing_order",
     "pre_decoding_processing",
 ]
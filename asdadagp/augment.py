@@ -0,0 +1,113 @@
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import guitarpro as gp
+
+from .encoder import (
+    BodyTokenWriter,
+    get_head_tokens,
+    iter_measure_events,
+    prepare_song,
+)
+from .utils import get_instrument_token_prefix, guitar_downtunage
+
+
+@dataclass(frozen=True)
+class Variant:
+    """
+    One token variant of a song, see `augment`.
+    """
+
+    # append the string's tuning to note tokens
+    note_tuning: bool = False
+    # semitones added to the tuning of every string, frets are unchanged
+    transpose: int = 0
+    # frets added to every note (as if the capo was moved up), must be >= 0
+    capo: int = 0
+    # indices of the tracks to keep, None keeps all
+    tracks: Optional[Tuple[int, ...]] = None
+
+
+def transpose_strings(strings: Sequence[gp.GuitarString], semitones: int) -> List[str]:
+    """
+    Names of the strings once each is tuned `semitones` up (down if negative).
+
+    :param strings: the strings of a track
+    :param semitones: the transposition
+    :return: the string names, e.g. ["D4", "A3", ...] for E standard transposed by -2
+    """
+    return [str(gp.GuitarString(s.number, s.value + semitones)) for s in strings]
+
+
+def augment(
+    song: gp.Song,
+    artist: str,
+    variants: Sequence[Variant],
+    verbose: bool = False,
+    start_measure: Optional[int] = None,
+    end_measure: Optional[int] = None,
+) -> List[List[str]]:
+    """
+    Encodes several variants of a song at once.
+
+    The song's tracks are checked and its events are built once, then each measure's events are
+    written out for every variant. Each variant's tokens are the same as encoding a copy of the song
+    changed accordingly (tracks retuned, capo moved, other tracks deleted) with `guitarpro2tokens`.
+
+    :param song: the parsed Guitar Pro song (sfx tracks are removed from it, like guitarpro2tokens does)
+    :param artist: the artist token
+    :param variants: the variants to encode
+    :param verbose: log debug information
+    :param start_measure: only encode measures[start_measure:end_measure]
+    :param end_measure: only encode measures[start_measure:end_measure]
+    :return: the tokens of each variant, in the order of `variants`
+    """
+    setup = prepare_song(song, verbose, start_measure, end_measure)
+    contexts = setup.track_contexts
+    has_guitar = any(not context.is_percussion for context in contexts)
+
+    outputs = []
+    writers = []
+    for variant in variants:
+        if variant.capo < 0:
+            raise ValueError("capo must be >= 0, got %s" % variant.capo)
+        strings = transpose_strings(song.tracks[0].strings, variant.transpose)
+        # same as the encoder: the downtune of the (identical) guitar tracks, 0 without any
+        pitch_shift = guitar_downtunage(strings) if has_guitar else setup.pitch_shift
+
+        prefixes = None
+        if variant.tracks is not None:
+            kept = sorted(set(variant.tracks))
+            if not kept or not all(0 <= t < len(song.tracks) for t in kept):
+                raise ValueError(
+                    "Invalid tracks %s, the song has %s tracks"
+                    % (variant.tracks, len(song.tracks))
+                )
+            # the prefixes the tracks would have in a song with only these tracks
+            kept_by_group = {"clean": [song.tracks[t] for t in kept]}
+            prefixes = {
+                t: get_instrument_token_prefix(song.tracks[t], kept_by_group)
+                for t in kept
+            }
+
+        fret_offsets = None
+        if variant.capo:
+            fret_offsets = [
+                0 if context.is_percussion else variant.capo for context in contexts
+            ]
+
+        outputs.append(
+            get_head_tokens(
+                artist, pitch_shift, setup.tempo, strings, variant.note_tuning
+            )
+        )
+        writers.append(
+            BodyTokenWriter(variant.note_tuning, strings, prefixes, fret_offsets)
+        )
+
+    for events in iter_measure_events(song, setup, verbose):
+        for writer, tokens in zip(writers, outputs):
+            tokens.extend(writer.measure_tokens(events))
+    for writer, tokens in zip(writers, outputs):
+        tokens.extend(writer.end_tokens())
+    return outputs
@@ -0,0 +1,399 @@
+import glob
+import json
+import multiprocessing
+import os
+import signal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from .cache import DEFAULT_MAX_BYTES, open_cache
+from .decoder import asdadagp_decode
+from .encoder import asdadagp_encode
+from .validate import validate_tokens
+
+GP_EXTENSIONS = (".gp3", ".gp4", ".gp5", ".gpx")
+
+
+def find_files(source: str, extensions: Tuple[str, ...]) -> Tuple[str, List[str]]:
+    """
+    Finds the files with one of the given extensions.
+
+    :param source: a directory (searched recursively) or a glob pattern such as "corpus/**/*.gp5".
+    :param extensions: lower case file extensions, e.g. (".gp4", ".gp5")
+    :return: a tuple of
+        - the base directory that output paths are made relative to,
+        - the sorted list of matching files.
+    """
+    if os.path.isdir(source):
+        base = source
+        files = []
+        for root, _, names in os.walk(source):
+            for name in names:
+                if name.lower().endswith(extensions):
+                    files.append(os.path.join(root, name))
+    else:
+        files = [
+            f
+            for f in glob.glob(source, recursive=True)
+            if os.path.isfile(f) and f.lower().endswith(extensions)
+        ]
+        if files:
+            base = os.path.commonpath([os.path.dirname(f) for f in files])
+        else:
+            base = os.path.dirname(source)
+    return base, sorted(files)
+
+
+def find_gp_files(source: str) -> Tuple[str, List[str]]:
+    """
+    Finds the Guitar Pro files to encode.
+
+    :param source: a directory (searched recursively) or a glob pattern such as "corpus/**/*.gp5".
+    :return: a tuple of
+        - the base directory that output paths are made relative to,
+        - the sorted list of matching Guitar Pro files.
+    """
+    return find_files(source, GP_EXTENSIONS)
+
+
+def output_path_for(
+    input_file: str, base: str, output_dir: str, extension: str = ".txt"
+) -> str:
+    """
+    Maps an input Guitar Pro file to its token file, keeping the directory layout below `base`.
+
+    :param input_file: path of the Guitar Pro file
+    :param base: directory the input paths are relative to
+    :param output_dir: directory the token files are written to
+    :param extension: extension of the output file
+    :return: path of the token file, e.g. "out/album/song.gp5" -> "out/album/song.txt"
+    """
+    relative = os.path.relpath(input_file, base)
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + extension)
+
+
+# (input_file, output_file, note_tuning, artist_token, cache_dir, cache_max_bytes,
+#  start_measure, end_measure)
+EncodeJob = Tuple[
+    str, str, bool, str, Optional[str], Optional[int], Optional[int], Optional[int]
+]
+
+
+def _encode_one(job: EncodeJob) -> Dict[str, Optional[str]]:
+    # Runs in a worker process: parse, tokenize and write a single file.
+    # Errors are returned instead of raised so one bad file doesn't stop the pool.
+    (
+        input_file,
+        output_file,
+        note_tuning,
+        artist_token,
+        cache_dir,
+        cache_max_bytes,
+        start_measure,
+        end_measure,
+    ) = job
+    try:
+        os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+        cache = open_cache(cache_dir, cache_max_bytes) if cache_dir else None
+        asdadagp_encode(
+            input_file,
+            output_file,
+            note_tuning,
+            artist_token,
+            cache=cache,
+            verbose=False,
+            start_measure=start_measure,
+            end_measure=end_measure,
+        )
+    except Exception as e:
+        return {
+            "input": input_file,
+            "output": None,
+            "error": f"{type(e).__name__}: {e}",
+        }
+    return {"input": input_file, "output": output_file, "error": None}
+
+
+def encode_files(
+    jobs: List[EncodeJob],
+    workers: Optional[int] = None,
+    chunksize: int = 16,
+    ordered: bool = True,
+    maxtasksperchild: Optional[int] = 500,
+) -> Iterable[Dict[str, Optional[str]]]:
+    """
+    Encodes (input_file, output_file, note_tuning, artist_token, cache_dir, cache_max_bytes,
+    start_measure, end_measure) jobs in a process pool.
+
+    :param jobs: list of encoding jobs
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param chunksize: number of jobs sent to a worker at a time
+    :param ordered: yield results in job order, otherwise as soon as they finish
+    :param maxtasksperchild: restart a worker after this many jobs to release memory (None keeps workers alive)
+    :return: an iterator of per-file results with "input", "output" and "error" keys
+    """
+    if workers == 1:
+        # no pool, useful for debugging
+        for job in jobs:
+            yield _encode_one(job)
+        return
+    with multiprocessing.Pool(
+        processes=workers, maxtasksperchild=maxtasksperchild
+    ) as pool:
+        imap = pool.imap if ordered else pool.imap_unordered
+        for result in imap(_encode_one, jobs, chunksize=chunksize):
+            yield result
+
+
+def encode_directory(
+    source: str,
+    output_dir: str,
+    note_tuning: bool = False,
+    artist_token: str = "Unknown",
+    workers: Optional[int] = None,
+    chunksize: int = 16,
+    ordered: bool = True,
+    maxtasksperchild: Optional[int] = 500,
+    summary_file: Optional[str] = None,
+    cache_dir: Optional[str] = None,
+    cache_max_bytes: Optional[int] = DEFAULT_MAX_BYTES,
+    start_measure: Optional[int] = None,
+    end_measure: Optional[int] = None,
+) -> Dict:
+    """
+    Encodes every Guitar Pro file in a directory (or matching a glob) into token files.
+
+    Each input is written to `output_dir` with the same relative path and a .txt extension.
+    Inputs that only differ by their extension (e.g. song.gp4 and song.gp5) would write the same
+    token file: only the first one in sorted order is encoded, the others are reported as failed.
+
+    :param source: a directory (searched recursively) or a glob pattern
+    :param output_dir: directory the token files are written to
+    :param note_tuning: if True, append tuning to note tokens
+    :param artist_token: first-line artist token for every file
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param chunksize: number of files sent to a worker at a time
+    :param ordered: report results in input order, otherwise as soon as they finish
+    :param maxtasksperchild: restart a worker after this many files (None keeps workers alive)
+    :param summary_file: if given, the summary is also written there as JSON
+    :param cache_dir: if given, an EncodeCache directory shared by the workers
+    :param cache_max_bytes: size limit of the cache, None for no limit
+    :param start_measure: only encode measures[start_measure:end_measure] of every file,
+        a file with fewer measures fails
+    :param end_measure: see start_measure
+    :return: a summary dict with "total", "succeeded", "failed" and the per-file "files" results
+    """
+    base, files = find_gp_files(source)
+    jobs = []
+    # inputs whose token file comes from an earlier input, e.g. song.gp5 after song.gp4
+    collisions = []
+    written_by = {}
+    for f in files:
+        output_file = output_path_for(f, base, output_dir)
+        key = os.path.normcase(output_file)
+        if key in written_by:
+            collisions.append(
+                {
+                    "input": f,
+                    "output": None,
+                    "error": f"{output_file} is already written from {written_by[key]}",
+                }
+            )
+            continue
+        written_by[key] = f
+        jobs.append(
+            (
+                f,
+                output_file,
+                note_tuning,
+                artist_token,
+                cache_dir,
+                cache_max_bytes,
+                start_measure,
+                end_measure,
+            )
+        )
+    results = list(
+        encode_files(
+            jobs,
+            workers=workers,
+            chunksize=chunksize,
+            ordered=ordered,
+            maxtasksperchild=maxtasksperchild,
+        )
+    )
+    results += collisions
+    failed = sum(1 for r in results if r["error"])
+    summary = {
+        "total": len(results),
+        "succeeded": len(results) - failed,
+        "failed": failed,
+        "files": results,
+    }
+    if summary_file:
+        with open(summary_file, "w") as f:
+            json.dump(summary, f, indent=2)
+    return summary
+
+
+class DecodeTimeout(Exception):
+    """Raised in a worker when decoding a file takes longer than its timeout."""
+
+
+def _raise_timeout(signum, frame):
+    raise DecodeTimeout("decoding took too long")
+
+
+def _first_error_index(input_file: str) -> Optional[int]:
+    # the index of the first invalid token, to locate the failure in a generated sample
+    try:
+        with open(input_file, "r") as f:
+            errors = validate_tokens(f.read().split("\n"), max_errors=1)
+    except Exception:
+        return None
+    return errors[0].index if errors else None
+
+
+# (input_file, output_file, timeout in seconds or None)
+DecodeJob = Tuple[str, str, Optional[int]]
+
+
+def _decode_one(job: DecodeJob) -> Dict:
+    # Runs in a worker process: decode a single token file.
+    # Errors are returned instead of raised so one bad file doesn't stop the pool, and SIGALRM
+    # interrupts a file that doesn't finish in time (where the platform has it).
+    input_file, output_file, timeout = job
+    use_alarm = bool(timeout) and hasattr(signal, "SIGALRM")
+    root, extension = os.path.splitext(output_file)
+    # written next to the output then renamed, a file cut short is never taken as decoded
+    partial_file = root + ".part" + extension
+    error = None
+    if use_alarm:
+        previous_handler = signal.signal(signal.SIGALRM, _raise_timeout)
+        signal.alarm(timeout)
+    try:
+        os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+        asdadagp_decode(input_file, partial_file)
+        os.replace(partial_file, output_file)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+            signal.signal(signal.SIGALRM, previous_handler)
+    if error is None:
+        return {
+            "input": input_file,
+            "output": output_file,
+            "error": None,
+            "token_index": None,
+        }
+    if os.path.exists(partial_file):
+        os.remove(partial_file)
+    return {
+        "input": input_file,
+        "output": None,
+        "error": error,
+        "token_index": _first_error_index(input_file),
+    }
+
+
+def is_decoded(input_file: str, output_file: str) -> bool:
+    """True if `output_file` exists and is newer than `input_file`."""
+    try:
+        return os.path.getmtime(output_file) >= os.path.getmtime(input_file)
+    except OSError:
+        return False
+
+
+def decode_files(
+    jobs: List[DecodeJob],
+    workers: Optional[int] = None,
+    chunksize: int = 4,
+    ordered: bool = True,
+    maxtasksperchild: Optional[int] = 200,
+) -> Iterable[Dict]:
+    """
+    Decodes (input_file, output_file, timeout) jobs in a process pool.
+
+    :param jobs: list of decoding jobs
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param chunksize: number of jobs sent to a worker at a time
+    :param ordered: yield results in job order, otherwise as soon as they finish
+    :param maxtasksperchild: restart a worker after this many jobs to release memory (None keeps workers alive)
+    :return: an iterator of per-file results with "input", "output", "error" and "token_index" keys
+    """
+    if workers == 1:
+        # no pool, useful for debugging
+        for job in jobs:
+            yield _decode_one(job)
+        return
+    with multiprocessing.Pool(
+        processes=workers, maxtasksperchild=maxtasksperchild
+    ) as pool:
+        imap = pool.imap if ordered else pool.imap_unordered
+        for result in imap(_decode_one, jobs, chunksize=chunksize):
+            yield result
+
+
+def decode_directory(
+    source: str,
+    output_dir: str,
+    extension: str = ".gp5",
+    workers: Optional[int] = None,
+    chunksize: int = 4,
+    ordered: bool = True,
+    maxtasksperchild: Optional[int] = 200,
+    timeout: Optional[int] = 60,
+    overwrite: bool = False,
+    summary_file: Optional[str] = None,
+) -> Dict:
+    """
+    Decodes every token file in a directory (or matching a glob).
+
+    Each input is written to `output_dir` with the same relative path and the given extension.
+    Files already decoded (an output newer than the input) are skipped, so an interrupted run can
+    be started again.
+
+    :param source: a directory (searched recursively for .txt files) or a glob pattern
+    :param output_dir: directory the decoded files are written to
+    :param extension: ".gp5", or ".mid" to write MIDI files
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param chunksize: number of files sent to a worker at a time
+    :param ordered: report results in input order, otherwise as soon as they finish
+    :param maxtasksperchild: restart a worker after this many files (None keeps workers alive)
+    :param timeout: seconds a file may take to decode, None for no limit
+    :param overwrite: decode the files that are already decoded too
+    :param summary_file: if given, the summary is also written there as JSON
+    :return: a summary dict with "total", "succeeded", "failed", "skipped" and the per-file
+        "files" results of the decoded files
+    """
+    base, files = find_files(source, (".txt",))
+    jobs = []
+    skipped = 0
+    for f in files:
+        output_file = output_path_for(f, base, output_dir, extension)
+        if not overwrite and is_decoded(f, output_file):
+            skipped += 1
+        else:
+            jobs.append((f, output_file, timeout))
+    results = list(
+        decode_files(
+            jobs,
+            workers=workers,
+            chunksize=chunksize,
+            ordered=ordered,
+            maxtasksperchild=maxtasksperchild,
+        )
+    )
+    failed = sum(1 for r in results if r["error"])
+    summary = {
+        "total": len(files),
+        "succeeded": len(results) - failed,
+        "failed": failed,
+        "skipped": skipped,
+        "files": results,
+    }
+    if summary_file:
+        with open(summary_file, "w") as f:
+            json.dump(summary, f, indent=2)
+    return summary
@@ -0,0 +1,171 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+from ._version import __version__
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024  # 1 GiB
+
+# the modules that make the tokens, a change to any of them gives new cache keys
+TOKENIZER_MODULES = ("encoder.py", "utils.py", "token_splitter.py", "const.py")
+
+
+@lru_cache(maxsize=None)
+def tokenizer_fingerprint() -> str:
+    """
+    Identifies the tokenizer: a hash of the package version and the source of `TOKENIZER_MODULES`.
+
+    :return: hex sha256 digest
+    """
+    h = hashlib.sha256(__version__.encode("utf-8"))
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    for name in TOKENIZER_MODULES:
+        h.update(b"\0" + name.encode("utf-8") + b"\0")
+        try:
+            with open(os.path.join(package_dir, name), "rb") as f:
+                h.update(f.read())
+        except OSError:
+            # installed without sources, only the version tells tokenizers apart
+            pass
+    return h.hexdigest()
+
+
+def cache_key(
+    gp_bytes: bytes,
+    note_tuning: bool,
+    artist_token: str,
+    start_measure: Optional[int] = None,
+    end_measure: Optional[int] = None,
+) -> str:
+    """
+    Computes the cache key of an encoding: everything the token output depends on, including the
+    tokenizer itself (see `tokenizer_fingerprint`).
+
+    :param gp_bytes: content of the Guitar Pro file
+    :param note_tuning: the `note_tuning` option of the encoder
+    :param artist_token: the artist token written as the first token
+    :param start_measure: the `start_measure` option of the encoder
+    :param end_measure: the `end_measure` option of the encoder
+    :return: hex sha256 digest
+    """
+    h = hashlib.sha256(gp_bytes)
+    h.update(b"\0")
+    h.update(
+        f"{int(note_tuning)}\0{artist_token}\0{tokenizer_fingerprint()}".encode("utf-8")
+    )
+    if start_measure is not None or end_measure is not None:
+        h.update(f"\0{start_measure}:{end_measure}".encode("utf-8"))
+    return h.hexdigest()
+
+
+class EncodeCache:
+    """
+    On-disk cache of token files, keyed by `cache_key`.
+
+    Entries are stored as `<directory>/<key[:2]>/<key>.txt`. When the total size goes over
+    `max_bytes`, the least recently used entries are removed (a hit refreshes the entry's mtime).
+    Entries are written to a temporary file and renamed, so several processes can share a directory:
+    the directory is the only state, each eviction reads the sizes and mtimes of all the entries on
+    disk, so the size bound holds for the entries of every process.
+    """
+
+    def __init__(self, directory: str, max_bytes: Optional[int] = DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key + ".txt")
+
+    def _scan(self) -> List[Tuple[int, str, int]]:
+        # (mtime in ns, key, size) of the entries on disk, least recently used first
+        found = []
+        if os.path.isdir(self.directory):
+            for shard in os.scandir(self.directory):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(".txt"):
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            # evicted by another process
+                            continue
+                        found.append((stat.st_mtime_ns, entry.name[:-4], stat.st_size))
+        found.sort()
+        return found
+
+    def get(self, key: str, output_file: str) -> bool:
+        """
+        Copies the cached token file for `key` to `output_file`.
+
+        :return: True on a hit, False if the key is not cached
+        """
+        path = self.path(key)
+        try:
+            shutil.copyfile(path, output_file)
+            os.utime(path)
+        except FileNotFoundError:
+            # never cached, or evicted by another process
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def put(self, key: str, token_file: str) -> None:
+        """
+        Stores a copy of `token_file` under `key`, then evicts old entries if the cache is too big.
+        """
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        try:
+            shutil.copyfile(token_file, tmp)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        self.evict()
+
+    def evict(self) -> None:
+        """Removes the least recently used entries until the cache fits in `max_bytes`."""
+        if self.max_bytes is None:
+            return
+        entries = self._scan()
+        total = sum(size for _, _, size in entries)
+        for _, key, size in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                # evicted by another process
+                pass
+            total -= size
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(size for _, _, size in self._scan())
+
+
+_OPEN_CACHES = {}
+
+
+def open_cache(
+    directory: str, max_bytes: Optional[int] = DEFAULT_MAX_BYTES
+) -> EncodeCache:
+    """
+    Returns the EncodeCache for `directory`, reusing the one already opened in this process.
+
+    :param directory: cache directory
+    :param max_bytes: size limit of the cache, None for no limit
+    """
+    key = (os.path.abspath(directory), max_bytes)
+    if key not in _OPEN_CACHES:
+        _OPEN_CACHES[key] = EncodeCache(directory, max_bytes)
+    return _OPEN_CACHES[key]
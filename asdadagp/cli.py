@@ -7,12 +7,19 @@ and back to Guitar Pro format, specifically designed for acoustic solo guitar mu
 """
 
 import argparse
+import json
+import logging
 import sys
 from pathlib import Path
 
+from .batch import decode_directory, encode_directory
+from .cache import EncodeCache
+from .const import PKG_NAME
 from .decoder import asdadagp_decode
+from .dedup import DEFAULT_BANDS, DEFAULT_THRESHOLD, find_duplicates
 from .encoder import asdadagp_encode
-from .processor import get_string_tunings, tracks_check
+from .processor import TokenDocument, get_string_tunings, tracks_check
+from .validate import validate_tokens
 
 
 def validate_file_path(file_path: str, must_exist: bool = True) -> str:
@@ -25,6 +32,27 @@ def validate_file_path(file_path: str, must_exist: bool = True) -> str:
     return str(path)
 
 
+def configure_logging(verbose: bool):
+    """Send the package's log records to stderr, including debug records with --verbose."""
+    logger = logging.getLogger(PKG_NAME)
+    handler = logging.StreamHandler(sys.stderr)
+    handler.setFormatter(logging.Formatter("%(levelname)s %(name)s: %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG if verbose else logging.WARNING)
+
+
+def cache_from_args(args):
+    """Open the encode cache given by --cache-dir/--cache-size-mb, if any."""
+    if not args.cache_dir:
+        return None
+    return EncodeCache(args.cache_dir, cache_max_bytes_from_args(args))
+
+
+def cache_max_bytes_from_args(args):
+    """Cache size limit in bytes, None when --cache-size-mb is 0 (no limit)."""
+    return args.cache_size_mb * 1024 * 1024 if args.cache_size_mb else None
+
+
 def encode_command(args):
     """Encode a Guitar Pro file to tokens."""
     try:
@@ -38,7 +66,16 @@ def encode_command(args):
         print(f"Encoding {input_file} to {output_file}")
         print(f"Artist token: {args.artist}")
 
-        asdadagp_encode(input_file, output_file, args.tuning, args.artist)
+        asdadagp_encode(
+            input_file,
+            output_file,
+            args.tuning,
+            args.artist,
+            cache=cache_from_args(args),
+            verbose=args.verbose,
+            start_measure=args.start_measure,
+            end_measure=args.end_measure,
+        )
 
         print(f"Successfully encoded to {output_file}")
 
@@ -47,6 +84,80 @@ def encode_command(args):
         sys.exit(1)
 
 
+def encode_dir_command(args):
+    """Encode every Guitar Pro file in a directory (or glob) to tokens."""
+    try:
+        output_dir = args.output_dir
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        summary_file = args.summary or str(Path(output_dir) / "summary.json")
+
+        print(f"Encoding {args.source} to {output_dir}")
+
+        summary = encode_directory(
+            args.source,
+            output_dir,
+            note_tuning=args.tuning,
+            artist_token=args.artist,
+            workers=args.workers,
+            chunksize=args.chunksize,
+            ordered=not args.unordered,
+            maxtasksperchild=args.maxtasksperchild or None,
+            summary_file=summary_file,
+            cache_dir=args.cache_dir,
+            cache_max_bytes=cache_max_bytes_from_args(args),
+            start_measure=args.start_measure,
+            end_measure=args.end_measure,
+        )
+
+        for result in summary["files"]:
+            if result["error"]:
+                print(f"Failed: {result['input']}: {result['error']}", file=sys.stderr)
+        print(
+            f"Encoded {summary['succeeded']}/{summary['total']} files "
+            f"({summary['failed']} failed). Summary written to {summary_file}"
+        )
+
+    except Exception as e:
+        print(f"Error during encoding: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+def dedup_command(args):
+    """Find near-duplicate songs among token files."""
+    try:
+        print(f"Signing {args.source} into {args.db}")
+
+        summary = find_duplicates(
+            args.source,
+            args.db,
+            bands=args.bands,
+            threshold=args.threshold,
+            workers=args.workers,
+        )
+
+        for failure in summary["failed"]:
+            print(f"Failed: {failure['file']}: {failure['error']}", file=sys.stderr)
+        print(
+            f"Signed {summary['added']} new and {summary['updated']} changed files "
+            f"({summary['unchanged']} unchanged, {summary['empty']} without measures, "
+            f"{len(summary['failed'])} failed)"
+        )
+
+        clusters = summary["clusters"]
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"clusters": clusters}, f, indent=2)
+            print(f"{len(clusters)} clusters written to {args.output}")
+        else:
+            for cluster in clusters:
+                print("\t".join(cluster))
+            print(f"{len(clusters)} clusters of near-duplicates")
+
+    except Exception as e:
+        print(f"Error during deduplication: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
 def decode_command(args):
     """Decode tokens back to a Guitar Pro file."""
     try:
@@ -59,7 +170,7 @@ def decode_command(args):
 
         print(f"Decoding {input_file} to {output_file}")
 
-        asdadagp_decode(input_file, output_file)
+        asdadagp_decode(input_file, output_file, verbose=args.verbose)
 
         print(f"Successfully decoded to {output_file}")
 
@@ -68,14 +179,79 @@ def decode_command(args):
         sys.exit(1)
 
 
+def decode_dir_command(args):
+    """Decode every token file in a directory (or glob)."""
+    try:
+        output_dir = args.output_dir
+        Path(output_dir).mkdir(parents=True, exist_ok=True)
+        summary_file = args.summary or str(Path(output_dir) / "summary.json")
+
+        print(f"Decoding {args.source} to {output_dir}")
+
+        summary = decode_directory(
+            args.source,
+            output_dir,
+            extension="." + args.format,
+            workers=args.workers,
+            chunksize=args.chunksize,
+            ordered=not args.unordered,
+            maxtasksperchild=args.maxtasksperchild or None,
+            timeout=args.timeout or None,
+            overwrite=args.overwrite,
+            summary_file=summary_file,
+        )
+
+        for result in summary["files"]:
+            if result["error"]:
+                location = ""
+                if result["token_index"] is not None:
+                    location = f" (token {result['token_index']})"
+                print(
+                    f"Failed: {result['input']}{location}: {result['error']}",
+                    file=sys.stderr,
+                )
+        print(
+            f"Decoded {summary['succeeded']}/{summary['total']} files "
+            f"({summary['failed']} failed, {summary['skipped']} already decoded). "
+            f"Summary written to {summary_file}"
+        )
+
+    except Exception as e:
+        print(f"Error during decoding: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+def validate_command(args):
+    """Check that token files can be decoded."""
+    try:
+        invalid = 0
+        for input_file in args.input_files:
+            input_file = validate_file_path(input_file)
+            with open(input_file, "r") as f:
+                tokens = f.read().split("\n")
+            errors = validate_tokens(tokens, max_errors=args.max_errors or None)
+            if errors:
+                invalid += 1
+                for error in errors:
+                    print(f"{input_file}: {error}")
+            elif args.verbose:
+                print(f"{input_file}: OK")
+        print(f"{len(args.input_files) - invalid}/{len(args.input_files)} files valid")
+
+    except Exception as e:
+        print(f"Error during validation: {e}", file=sys.stderr)
+        sys.exit(1)
+    if invalid:
+        sys.exit(1)
+
+
 def process_command(args):
     """Process tokens with various options."""
     try:
         input_file = validate_file_path(args.input_file)
 
         # Read tokens from file
-        with open(input_file, "r") as f:
-            tokens = f.read().split("\n")
+        tokens = TokenDocument.from_file(input_file)
 
         print(f"Processing tokens from {input_file}")
 
@@ -90,7 +266,7 @@ def process_command(args):
             token_measures = tokens_to_measures(processed_tokens)
             measures = []
             for tm in token_measures:
-                measures.append(tm.tokens)
+                measures.append(list(tm.tokens))
 
             # Get the actual playing order considering repeats and alternatives
             playing_order = measures_playing_order(token_measures)
@@ -195,10 +371,28 @@ def main():
 Examples:
   # Encode a Guitar Pro file to tokens
   asdadagp encode input.gp5 output.txt --artist "John Doe"
+
+  # Encode only measures 120 to 179
+  asdadagp encode input.gp5 output.txt --start-measure 120 --end-measure 180
   
+  # Encode a whole directory of Guitar Pro files with 8 processes
+  asdadagp encode-dir corpus/ tokens/ --workers 8
+
+  # Find near-duplicate token files, signatures are kept in signatures.sqlite
+  asdadagp dedup tokens/ --db signatures.sqlite --output clusters.json
+
   # Decode tokens back to Guitar Pro
   asdadagp decode input.txt output.gp5
+
+  # Decode tokens straight to MIDI to listen to them
+  asdadagp decode input.txt output.mid
+
+  # Decode a directory of generated samples, at most 30 seconds per file
+  asdadagp decode-dir samples/ decoded/ --timeout 30
   
+  # Check generated token files before decoding them
+  asdadagp validate samples/*.txt
+
   # Process tokens with track merging
   asdadagp process input.txt --merge-tracks --output processed.txt
   
@@ -212,9 +406,19 @@ Examples:
 
     subparsers = parser.add_subparsers(dest="command", help="Available commands")
 
+    # Options shared by every command
+    common_parser = argparse.ArgumentParser(add_help=False)
+    common_parser.add_argument(
+        "--verbose",
+        "-v",
+        default=False,
+        action="store_true",
+        help="Log debug information about the conversion to stderr",
+    )
+
     # Encode command
     encode_parser = subparsers.add_parser(
-        "encode", help="Encode Guitar Pro file to tokens"
+        "encode", parents=[common_parser], help="Encode Guitar Pro file to tokens"
     )
     encode_parser.add_argument(
         "input_file", help="Input Guitar Pro file (.gp3, .gp4, .gp5, .gpx)"
@@ -232,19 +436,225 @@ Examples:
         action="store_true",
         help="Append tuning to note tokens, otherwise tunings are in the header only",
     )
+    encode_parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Reuse token files of unchanged inputs from this cache directory",
+    )
+    encode_parser.add_argument(
+        "--cache-size-mb",
+        type=int,
+        default=1024,
+        help="Evict least recently used cache entries above this size (0: no limit)",
+    )
+    encode_parser.add_argument(
+        "--start-measure",
+        type=int,
+        default=None,
+        help="Index of the first measure to encode (0-based, default: the first measure)",
+    )
+    encode_parser.add_argument(
+        "--end-measure",
+        type=int,
+        default=None,
+        help="Index after the last measure to encode (default: the end of the song)",
+    )
     encode_parser.set_defaults(func=encode_command)
 
+    # Encode directory command
+    encode_dir_parser = subparsers.add_parser(
+        "encode-dir",
+        parents=[common_parser],
+        help="Encode a directory or glob of Guitar Pro files to tokens",
+    )
+    encode_dir_parser.add_argument(
+        "source",
+        help='Input directory (searched recursively) or glob, e.g. "gp/**/*.gp5"',
+    )
+    encode_dir_parser.add_argument(
+        "output_dir", help="Output directory for token files"
+    )
+    encode_dir_parser.add_argument(
+        "--artist",
+        required=False,
+        default="Unknown",
+        help="Artist name for the token files",
+    )
+    encode_dir_parser.add_argument(
+        "--tuning",
+        default=False,
+        action="store_true",
+        help="Append tuning to note tokens, otherwise tunings are in the header only",
+    )
+    encode_dir_parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: number of CPUs, 1 disables the pool)",
+    )
+    encode_dir_parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=16,
+        help="Number of files sent to a worker at a time",
+    )
+    encode_dir_parser.add_argument(
+        "--unordered",
+        default=False,
+        action="store_true",
+        help="Collect results as soon as they finish instead of in input order",
+    )
+    encode_dir_parser.add_argument(
+        "--maxtasksperchild",
+        type=int,
+        default=500,
+        help="Restart each worker after this many files (0 keeps workers alive)",
+    )
+    encode_dir_parser.add_argument(
+        "--summary",
+        default=None,
+        help="Path of the JSON summary (default: OUTPUT_DIR/summary.json)",
+    )
+    encode_dir_parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help="Reuse token files of unchanged inputs from this cache directory",
+    )
+    encode_dir_parser.add_argument(
+        "--cache-size-mb",
+        type=int,
+        default=1024,
+        help="Evict least recently used cache entries above this size (0: no limit)",
+    )
+    encode_dir_parser.add_argument(
+        "--start-measure",
+        type=int,
+        default=None,
+        help="Index of the first measure to encode (0-based, default: the first measure)",
+    )
+    encode_dir_parser.add_argument(
+        "--end-measure",
+        type=int,
+        default=None,
+        help="Index after the last measure to encode (default: the end of each song)",
+    )
+    encode_dir_parser.set_defaults(func=encode_dir_command)
+
+    # Dedup command
+    dedup_parser = subparsers.add_parser(
+        "dedup",
+        parents=[common_parser],
+        help="Find near-duplicate songs in a directory or glob of token files",
+    )
+    dedup_parser.add_argument(
+        "source",
+        help='Input directory (searched recursively for .txt) or glob, e.g. "tokens/**/*.txt"',
+    )
+    dedup_parser.add_argument(
+        "--db",
+        default="signatures.sqlite",
+        help="Database of song signatures, only new or changed files are signed again",
+    )
+    dedup_parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Minimum estimated similarity (Jaccard of measure shingles) of near-duplicates",
+    )
+    dedup_parser.add_argument(
+        "--bands",
+        type=int,
+        default=DEFAULT_BANDS,
+        help="Number of LSH bands, more bands find less similar candidates",
+    )
+    dedup_parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: number of CPUs, 1 disables the pool)",
+    )
+    dedup_parser.add_argument(
+        "--output",
+        default=None,
+        help="Write the clusters to this JSON file instead of stdout",
+    )
+    dedup_parser.set_defaults(func=dedup_command)
+
     # Decode command
     decode_parser = subparsers.add_parser(
-        "decode", help="Decode tokens to Guitar Pro file"
+        "decode", parents=[common_parser], help="Decode tokens to Guitar Pro file"
     )
     decode_parser.add_argument("input_file", help="Input token file")
-    decode_parser.add_argument("output_file", help="Output Guitar Pro file")
+    decode_parser.add_argument(
+        "output_file", help="Output Guitar Pro file, or MIDI file (.mid/.midi)"
+    )
     decode_parser.set_defaults(func=decode_command)
 
+    # Decode directory command
+    decode_dir_parser = subparsers.add_parser(
+        "decode-dir",
+        parents=[common_parser],
+        help="Decode a directory or glob of token files",
+    )
+    decode_dir_parser.add_argument(
+        "source",
+        help='Input directory (searched recursively for .txt) or glob, e.g. "samples/**/*.txt"',
+    )
+    decode_dir_parser.add_argument(
+        "output_dir", help="Output directory for the decoded files"
+    )
+    decode_dir_parser.add_argument(
+        "--format",
+        choices=["gp5", "mid"],
+        default="gp5",
+        help="Write Guitar Pro 5 files or MIDI files",
+    )
+    decode_dir_parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes (default: number of CPUs, 1 disables the pool)",
+    )
+    decode_dir_parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=4,
+        help="Number of files sent to a worker at a time",
+    )
+    decode_dir_parser.add_argument(
+        "--unordered",
+        default=False,
+        action="store_true",
+        help="Collect results as soon as they finish instead of in input order",
+    )
+    decode_dir_parser.add_argument(
+        "--maxtasksperchild",
+        type=int,
+        default=200,
+        help="Restart each worker after this many files (0 keeps workers alive)",
+    )
+    decode_dir_parser.add_argument(
+        "--timeout",
+        type=int,
+        default=60,
+        help="Give up on a file after this many seconds (0: no limit)",
+    )
+    decode_dir_parser.add_argument(
+        "--overwrite",
+        default=False,
+        action="store_true",
+        help="Decode files again even if their output is newer than the tokens",
+    )
+    decode_dir_parser.add_argument(
+        "--summary",
+        default=None,
+        help="Path of the JSON summary (default: OUTPUT_DIR/summary.json)",
+    )
+    decode_dir_parser.set_defaults(func=decode_dir_command)
+
     # Process command
     process_parser = subparsers.add_parser(
-        "process", help="Process tokens with various options"
+        "process", parents=[common_parser], help="Process tokens with various options"
     )
     process_parser.add_argument("input_file", help="Input tokens txt file")
     process_parser.add_argument("output_file", help="Output json/txt file")
@@ -266,8 +676,25 @@ Examples:
 
     process_parser.set_defaults(func=process_command)
 
+    # Validate command
+    validate_parser = subparsers.add_parser(
+        "validate",
+        parents=[common_parser],
+        help="Check that token files can be decoded, without decoding them",
+    )
+    validate_parser.add_argument("input_files", nargs="+", help="Input token files")
+    validate_parser.add_argument(
+        "--max-errors",
+        type=int,
+        default=0,
+        help="Report at most this many errors per file (0: all)",
+    )
+    validate_parser.set_defaults(func=validate_command)
+
     # Info command
-    info_parser = subparsers.add_parser("info", help="Display information about a file")
+    info_parser = subparsers.add_parser(
+        "info", parents=[common_parser], help="Display information about a file"
+    )
     info_parser.add_argument("input_file", help="Input file (Guitar Pro or token file)")
     info_parser.set_defaults(func=info_command)
 
@@ -277,6 +704,8 @@ Examples:
         parser.print_help()
         sys.exit(1)
 
+    configure_logging(args.verbose)
+
     args.func(args)
 
 
@@ -1,104 +1,388 @@
+import copy
+import logging
 import math
 import os
 from fractions import Fraction
+from functools import lru_cache
 
 import guitarpro
 import guitarpro as gp
 
 from .utils import (
     convert_strings_for_pygp,
-    convert_to_nearest_supported_time,
+    duration_from_time,
     tokens_to_beat_effect,
     tokens_to_note_effect,
 )
 
 SCRIPTS_PATH = os.path.dirname(os.path.abspath(__file__))
 
+# the instrument prefixes of note tokens, in track order
+INSTRUMENTS = ("clean0", "clean1")
 
-from typing import List, Union
 
-from .processor import pre_decoding_processing
+from itertools import islice
+from typing import Iterable, List, Tuple, Union
 
+from .processor import complete_string_tunings
 
-# Given a list of tokens, constructs a guitarpro song object
-def tokens2guitarpro(
-    all_tokens: List[str], verbose: bool = False, tunings: Union[None, List[str]] = None
-):
-    # Interpret a token list back into a GP song file
-    ## TODO: some kinda validation/flexibility for weird files the net generates?
-    ## For now let's just support valid dataset files
-    head = all_tokens[:4]
-    body = all_tokens[4:]
-    artist_token = head[0]
-    assert head[1].split(":")[0] == "downtune"
-    assert head[2].split(":")[0] == "tempo"
-    assert head[3] == "start"
-    initial_tempo = int(head[2].split(":")[1])
-    pitch_shift = int(head[1].split(":")[1])
-    verbose and print(artist_token, initial_tempo, pitch_shift)
+_LOGGER = logging.getLogger(__name__)
 
-    ###########
-    ## Instruments / Strings / Droptuning
-    ## Check which instruments we got
 
-    instrument_check = {"clean0": False, "clean1": False}
-    for token in body:
-        tokensplit = token.split(":")
-        if len(tokensplit) > 1 and tokensplit[1] == "note":
-            instrument = tokensplit[0]
-            assert instrument in instrument_check.keys(), (
-                "Unknown instrument %s" % instrument
-            )
-            instrument_check[instrument] = True
-    verbose and print(instrument_check)
+@lru_cache(maxsize=1)
+def _blank_template() -> gp.Song:
+    # parsed once per process, only ever handed out as copies
+    return gp.parse(os.path.join(SCRIPTS_PATH, "blank.gp5"))
 
-    instrument_stringinfo = {
-        "clean0": False,
-        "clean1": False,
-    }
 
-    for instrument in instrument_stringinfo:
-        if not instrument_check[instrument]:
-            # this instrument doesn't exist in the score
-            continue
+def new_blank_song() -> gp.Song:
+    """
+    A new empty song with the settings of blank.gp5, the base of every decoded song.
 
-        else:
-            # everything else
-            ## Guitars / Pads / Leads info
-            # Check which strings we got
-            # "g6_standard", "g7_standard", "g6_drop", "g7_drop"
-            # Treat all like guitar
-
-            strings = 6
-            drop_tuning = False
-
-            # Note: Strings are 1-indexed
-            string_count = {1: 0, 2: 0, 3: 0, 4: 0, 5: 0, 6: 0, 7: 0}
-            for token in body:
-                t = token.split(":")
-                if len(t) > 1 and t[1] == "note" and t[0] == instrument:
-                    string = int(t[2][1:])  # ex "s4"
-                    fret = int(t[3][1:])  # ex "f5"
-                    if fret == -1 or fret == -2:
-                        if string == 6 or string == 7:
-                            drop_tuning = True
-                        else:
-                            assert False, "Drop tuning only allowed on string 6 and 7"
-                    string_count[string] += 1
-            # print(string_count)
-            if string_count[7] > 0:
-                # it's a 7 string, it has the low string (strings 1,2,3,4,5,6,7)
-                strings = 7
-            else:
-                # it's a 6 string (strings 1,2,3,4,5,6)
-                strings = 6
-            instrument_stringinfo[instrument] = {
-                "drop_tuning": drop_tuning,
-                "strings": strings,
-            }
+    The template is parsed on the first call and deep-copied after that, which is several times
+    faster than parsing it for every decoded song.
+    """
+    song = copy.deepcopy(_blank_template())
+    song.tracks = []
+    song.measureHeaders = []
+    return song
+
+
+# A body token classified by the decoder. kind is one of "new_measure", "end", "measure", "note",
+# "rest", "nfx", "bfx", "param", "wait" or "other" (ignored). Fields that don't apply to the kind
+# are None: only notes and rests have an instrument, only notes have string/fret,
+# value is the type of a measure token (e.g. "repeat_open"), the ticks of a wait or the string tuning
+# of a note token that has one.
+class TokenRecord:
+    __slots__ = ("token", "kind", "instrument", "string", "fret", "value")
 
-    verbose and print(instrument_stringinfo)
+    def __init__(
+        self, token, kind, instrument=None, string=None, fret=None, value=None
+    ):
+        self.token = token
+        self.kind = kind
+        self.instrument = instrument
+        self.string = string
+        self.fret = fret
+        self.value = value
 
+    def __repr__(self):
+        fields = ", ".join(
+            "%s=%r" % (name, getattr(self, name))
+            for name in self.__slots__
+            if getattr(self, name) is not None
+        )
+        return "TokenRecord(%s)" % fields
+
+
+def parse_token(token: str) -> TokenRecord:
+    """
+    Splits a body token once into a TokenRecord.
+
+    Note and rest tokens are read as written by the encoder or by the processor: "note" and "rest"
+    without a track prefix are on "clean0", and a field after the fret is the string tuning.
+
+    :param token: e.g. "clean0:note:s4:f5", "note:s4:f5:D3", "wait:480", "measure:repeat_close:2"
+    :return: the classified token
+    """
+    if token == "new_measure" or token == "end":
+        return TokenRecord(token, token)
+    t = token.split(":")
+    if t[0] == "note" or t[0] == "rest":
+        # add track prefix if the token preprocessing removed them
+        t.insert(0, "clean0")
+    if t[0] == "measure":
+        return TokenRecord(token, "measure", value=t[1] if len(t) > 1 else None)
+    if len(t) > 1 and t[1] == "note":
+        # ex "clean0:note:s4:f5", frets can be -1/-2 on drop tuned strings
+        return TokenRecord(
+            token,
+            "note",
+            t[0],
+            string=int(t[2][1:]),
+            fret=int(t[3][1:]),
+            value=t[4] if len(t) > 4 else None,
+        )
+    if len(t) > 1 and t[1] == "rest":
+        return TokenRecord(token, "rest", t[0])
+    if t[0] == "nfx" or t[0] == "bfx" or t[0] == "param":
+        return TokenRecord(token, t[0])
+    if t[0] == "wait":
+        return TokenRecord(token, "wait", value=int(t[1]))
+    return TokenRecord(token, "other")
+
+
+def split_head(tokens: List[str]) -> Tuple[List[str], Union[None, List[str]], int]:
+    """
+    Finds where the head ends: at index 3 when the string tunings are in the note tokens,
+    at index 9 after the 6 string tunings otherwise.
+
+    :return: a tuple of
+        - the 4 head tokens (see `read_head`)
+        - the string tunings of the head, None if they are in the note tokens
+        - the index of the first body token
+    """
+    if len(tokens) > 3 and tokens[3] == "start":
+        return tokens[:4], None, 4
+    if len(tokens) > 9 and tokens[9] == "start":
+        return tokens[:3] + ["start"], tokens[3:9], 10
+    raise ValueError("No 'start' token at index 3 or 9 of the head")
+
+
+def read_head(head: List[str]):
+    """
+    Reads the 4 head tokens: artist, "downtune:N", "tempo:N", "start".
+
+    :return: a tuple of the artist, the pitch shift (downtune) and the initial tempo
+    """
+    assert head[1].split(":")[0] == "downtune"
+    assert head[2].split(":")[0] == "tempo"
+    assert head[3] == "start"
+    return head[0], int(head[1].split(":")[1]), int(head[2].split(":")[1])
+
+
+class MeasureReader:
+    """
+    Reads body tokens (after "start") one at a time into measures, the first step of decoding.
+
+    `feed` returns each measure as soon as it is complete, when the next "new_measure" or the
+    "end" token arrives. A measure is a dict with the "clock" at its start and its "end_clock",
+    its "measure_tokens" and the "trackbeats" of each instrument:
+    {clock: {"bfx": [...], "notes": [{"record", "nfx"}]}}.
+    Tokens are read with or without "cleanX:" prefixes and note tunings, see `parse_token`.
+    """
+
+    def __init__(self, verbose: bool = False):
+        self.verbose = verbose
+        # which instruments have notes
+        self.instrument_check = {instrument: False for instrument in INSTRUMENTS}
+        # Note: Strings are 1-indexed
+        self.string_count = {
+            instrument: {1: 0, 2: 0, 3: 0, 4: 0, 5: 0, 6: 0, 7: 0}
+            for instrument in INSTRUMENTS
+        }
+        self.drop_tuning = {instrument: False for instrument in INSTRUMENTS}
+        # set by the "end" token, later tokens are ignored
+        self.finished = False
+
+        self.this_measure = {}
+        self.clock = 960  # increments whenever we see a wait
+        # clock starts at 960 for some reason??? 1-indexed quarter notes i guess
+
+        self.current_note = None
+        self.current_beat = None
+        self.current_effect = None
+        self.orphaned_nfx = []
+        self.orphaned_bfx = []
+
+        # If notes appear that have no duration (they are not followed by wait token before the end of the measure)
+        # use this value for their duration:
+        self.last_reported_duration = 480
+        # clocktime of the last beat we iterated over
+        self.last_reported_beat_clock = 480
+
+        # a song repeats the same tokens over and over, each one is only parsed once
+        self.records = {}
+        # the tuning of each string, from the first note token that has one
+        self.note_tunings = {}
+
+    def feed(self, token: str):
+        """
+        Reads the next token.
+
+        :return: the measure that this token completed, None if there is none
+        """
+        if self.finished:
+            return None
+        record = self.records.get(token)
+        if record is None:
+            record = self.records[token] = parse_token(token)
+            if record.value is not None and record.kind == "note":
+                self.note_tunings.setdefault(record.string, record.value)
+        kind = record.kind
+        completed = None
+        # Check if this measure has ended
+        if (kind == "end" or kind == "new_measure") and len(self.this_measure):
+            # End of measure. Wrap it up
+            completed = self.this_measure
+            # If there was a previous measure with notes, and it ended with notes and no wait token
+            # We could do nothing and drop those notes, or we could give them an arbitary duration
+            # ..by moving the clock forward here by some arbitrary amount
+            if self.last_reported_beat_clock == self.clock:
+                if self.last_reported_duration == 0:
+                    # defeats the purpose to move it ahead by zero
+                    # this is a failsafe, just in case the calculation failed in a corner case
+                    self.last_reported_duration = 480
+                # move the clock ahead
+                self.clock += self.last_reported_duration
+            completed["end_clock"] = self.clock
+        # Ok now deal with the next token
+        if kind == "end":
+            # End of the song
+            self.finished = True
+        elif kind == "new_measure":
+            # starting a new measure
+            self.this_measure = {
+                "trackbeats": {},
+                "measure_tokens": [],
+                "clock": self.clock,
+            }
+            # reset
+            self.current_note = None
+            self.current_beat = None
+            self.current_effect = None
+            self.orphaned_nfx = []
+            self.orphaned_bfx = []
+        elif kind == "measure":
+            # measure token
+            # these are supposed to only be at the very beginning
+            # (but if they appear somewhere in the middle of the measure that might be ok?)
+            # Measure tokens are of the format measure:type[:params]
+            # Per measure there can only be one of each type of measure token
+            # Check if that type already exists
+            passed = True
+            for mt in self.this_measure["measure_tokens"]:
+                if mt.value == record.value:
+                    # this type is already here, ignore it
+                    self.verbose and _LOGGER.debug(
+                        "Measure Token contradiction %s %s", mt.token, token
+                    )
+                    passed = False
+            if passed:
+                # No contradictions, add the token
+                self.this_measure["measure_tokens"].append(record)
+        elif kind == "note" or kind == "rest":
+            self._read_note(record)
+        elif kind == "nfx":
+            self.current_effect = {"token": token, "params": []}
+            if self.current_note:
+                # great we know what note this effect belongs to
+                self.current_note["nfx"].append(self.current_effect)
+            else:
+                # uhh this token is out of place.
+                # we could just skip it
+                # OR we could attach to the next note like so:
+                self.orphaned_nfx.append(self.current_effect)
+        elif kind == "bfx":
+            self.current_effect = {"token": token, "params": []}
+            if self.current_beat:
+                # great we know what beat this effect belongs to
+                # Now we are no longer attached to a particular note
+                # actually I guess that is optional. A beat effect could appear between a note and notefx i guess.
+                self.current_beat["bfx"].append(self.current_effect)
+            else:
+                # uhh this token is out of place.
+                # we could skip it
+                # OR we could attach to the next beat like so:
+                self.orphaned_bfx.append(self.current_effect)
+        elif kind == "param":
+            if self.current_effect:
+                # great we know what effect this param belongs to
+                self.current_effect["params"].append(token)
+            else:
+                # uhh this token is out of place. skip it
+                self.verbose and _LOGGER.warning(
+                    "Param token doesn't belong to an effect: %s", token
+                )
+        elif kind == "wait":
+            # wait token can come any time inside a measure
+            # it resets the beat/note, and we may move to a new beat/note
+            self.current_beat = None
+            self.current_note = None
+            self.current_effect = None
+            self.clock += record.value  # move the clock upward
+        return completed
+
+    def _read_note(self, record: TokenRecord):
+        # we have encountered a new note or rest token
+        # (technically a rest can't co-exist with a note in the same instrument_beat.. but hmm)
+        instrument = record.instrument
+        if record.kind == "note":
+            assert instrument in self.instrument_check, (
+                "Unknown instrument %s" % instrument
+            )
+            self.instrument_check[instrument] = True
+            if record.fret == -1 or record.fret == -2:
+                if record.string == 6 or record.string == 7:
+                    self.drop_tuning[instrument] = True
+                else:
+                    assert False, "Drop tuning only allowed on string 6 and 7"
+            self.string_count[instrument][record.string] += 1
+
+        self.current_note = {"record": record, "nfx": []}
+        self.current_effect = None
+
+        # Experimental: If there were orphaned nfx, attach them now
+        if len(self.orphaned_nfx):
+            self.current_note["nfx"] = self.orphaned_nfx
+        self.orphaned_nfx = []
+
+        clock = self.clock
+        trackbeats = self.this_measure["trackbeats"]
+        if not instrument in trackbeats:
+            # first time this instrument appeared in this measure
+            trackbeats[instrument] = {}
+
+        if not clock in trackbeats[instrument]:
+            # first time this instrument appeared in this measure at this clocktime
+            # that means it's a new beat
+            self.current_beat = {"bfx": [], "notes": []}
+            trackbeats[instrument][clock] = self.current_beat
+            # Experimental: If there were orphaned bfx, attach them now
+            if len(self.orphaned_bfx):
+                self.current_beat["bfx"] = self.orphaned_bfx
+            self.orphaned_bfx = []
+
+        # add the note to the beat
+        trackbeats[instrument][clock]["notes"].append(self.current_note)
+
+        # calculate the latest time difference between beats
+        if clock - self.last_reported_beat_clock == 0:
+            # same beat, no time difference occured, skip for now
+            pass
+        else:
+            # a time difference occured!
+            # the last duration is this beat's clock minus the last beat's clock
+            # warning: this definition of duration is inter-instrument (time since the last beat of any instrument)
+            self.last_reported_duration = clock - self.last_reported_beat_clock
+        # remember this beat's clocktime for later
+        self.last_reported_beat_clock = clock
+
+    def instrument_stringinfo(self):
+        """
+        The "strings" count and "drop_tuning" of each instrument with notes (False otherwise),
+        from the notes read so far.
+        """
+        ## Guitars / Pads / Leads info
+        # "g6_standard", "g7_standard", "g6_drop", "g7_drop"
+        # Treat all like guitar
+        stringinfo = {}
+        for instrument, present in self.instrument_check.items():
+            if not present:
+                # this instrument doesn't exist in the score
+                stringinfo[instrument] = False
+                continue
+            stringinfo[instrument] = {
+                "drop_tuning": self.drop_tuning[instrument],
+                # a 7 string has the low string (strings 1,2,3,4,5,6,7), otherwise it's a 6 string
+                "strings": 7 if self.string_count[instrument][7] > 0 else 6,
+            }
+        return stringinfo
+
+
+def read_measures(body: Iterable[str], verbose: bool = False):
+    """
+    Reads the body tokens (after "start") into measures, see `MeasureReader`.
+
+    :param body: the body tokens, with or without "cleanX:" prefixes and note tunings
+    :param verbose: log debug information
+    :return: a tuple of
+        - the measures, see `MeasureReader`
+        - the final clock, the end of the last measure
+        - whether each instrument has notes, {"clean0": True, "clean1": False}
+        - the "strings" count and "drop_tuning" of each instrument with notes (False otherwise)
+        - the tuning of each string found in the note tokens, {string: tuning}
+    """
     ##########
     ## READ MEASURES
 
@@ -110,173 +394,155 @@ def tokens2guitarpro(
     ## Each track is a list of beats with a clock time
     ## Each beat has beat effects (bfx) and a list of notes
     ## Each note has note effects (nfx) and a note token
-
+    ## Meanwhile check which instruments we got, and their strings / drop tuning
+    reader = MeasureReader(verbose)
+    feed = reader.feed
     all_measures = []
-    this_measure = {}
+    for token in body:
+        measure = feed(token)
+        if measure is not None:
+            all_measures.append(measure)
+        if reader.finished:
+            break
 
-    clock = 960  # increments whenever we see a wait
-    # clock starts at 960 for some reason??? 1-indexed quarter notes i guess
+    instrument_stringinfo = reader.instrument_stringinfo()
+    verbose and _LOGGER.debug("Instruments: %s", reader.instrument_check)
+    verbose and _LOGGER.debug("Instrument strings: %s", instrument_stringinfo)
+    verbose and _LOGGER.debug("Final clock: %s", reader.clock)
+    verbose and _LOGGER.debug("First measure: %s", all_measures[0])
+    return (
+        all_measures,
+        reader.clock,
+        reader.instrument_check,
+        instrument_stringinfo,
+        reader.note_tunings,
+    )
+
+
+def note_string_tunings(note_tunings, pitch_shift=0) -> Union[None, List[str]]:
+    """
+    The string tunings from the tunings of the note tokens (see `read_measures`), the same as
+    `read_token_header` reads them. None if no note token had a tuning.
+    """
+    if not note_tunings:
+        return None
+    return complete_string_tunings(note_tunings, pitch_shift)
+
+
+def track_strings(stringinfo, tunings=None, pitch_shift=0) -> List[gp.GuitarString]:
+    """
+    The strings of a decoded track.
+
+    :param stringinfo: the "strings" count and "drop_tuning" of the instrument, see `read_measures`
+    :param tunings: the string tunings of the song (e.g. from `pre_decoding_processing`),
+        E standard (or drop D) by default
+    :param pitch_shift: the downtune of the head
+    """
+    drop = stringinfo["drop_tuning"]
+    n_strings = stringinfo["strings"]
+    if tunings:
+        strings = tunings
+    else:
+        if n_strings == 6:
+            if drop:
+                strings = ["E5", "B4", "G4", "D4", "A3", "D3"]
+            else:
+                strings = ["E5", "B4", "G4", "D4", "A3", "E3"]
+        elif n_strings == 7:
+            if drop:
+                strings = ["E5", "B4", "G4", "D4", "A3", "D3", "A2"]
+            else:
+                strings = ["E5", "B4", "G4", "D4", "A3", "E3", "B2"]
+    return convert_strings_for_pygp(strings, pitch_shift)
 
-    current_note = None
-    current_beat = None
-    current_effect = None
-    orphaned_nfx = []
-    orphaned_bfx = []
 
-    # If notes appear that have no duration (they are not followed by wait token before the end of the measure)
-    # use this value for their duration:
-    last_reported_duration = 480
-    # clocktime of the last beat we iterated over
-    last_reported_beat_clock = 480
+def string_fret_offsets(instrument: str, stringinfo) -> Tuple[Tuple[int, int], ...]:
+    """
+    How the strings of an instrument's note tokens map to the decoded track.
 
-    for i, token in enumerate(body):
-        # Check if this measure has ended
-        if token in ["end", "new_measure"] and len(this_measure):
-            # End of measure. Wrap it up
-            # move the old measure to all_measures
-            all_measures.append(this_measure)
-            # If there was a previous measure with notes, and it ended with notes and no wait token
-            # We could do nothing and drop those notes, or we could give them an arbitary duration
-            # ..by moving the clock forward here by some arbitrary amount
-            if last_reported_beat_clock == clock:
-                if last_reported_duration == 0:
-                    # defeats the purpose to move it ahead by zero
-                    # this is a failsafe, just in case the calculation failed in a corner case
-                    last_reported_duration = 480
-                # move the clock ahead
-                clock += last_reported_duration
-        # Ok now deal with the next token
-        if token == "end":
-            # End of the song
-            break
-        if token == "new_measure":
-            # starting a new measure
-            this_measure = {"trackbeats": {}, "measure_tokens": [], "clock": clock}
-            # reset
-            current_note = None
-            current_beat = None
-            current_effect = None
-            orphaned_nfx = []
-            orphaned_bfx = []
-        else:
-            # In the middle of a measure
-            # this_measure["tokens"].append(token)
-            t = token.split(":")
-            if t[0] == "measure":
-                # measure token
-                # these are supposed to only be at the very beginning
-                # (but if they appear somewhere in the middle of the measure that might be ok?)
-                # Measure tokens are of the format measure:type[:params]
-                # Per measure there can only be one of each type of measure token
-                # Check if that type already exists
-                passed = True
-                for mt in this_measure["measure_tokens"]:
-                    if mt.split(":")[1] == t[1]:
-                        # this type is already here, ignore it
-                        verbose and print("Measure Token contradiction", mt, token)
-                        passed = False
-                if passed:
-                    # No contradictions, add the token
-                    this_measure["measure_tokens"].append(token)
-            elif len(t) > 1 and (t[1] == "note" or t[1] == "rest"):
-                # we have encountered a new note or rest token
-                # (technically a rest can't co-exist with a note in the same instrument_beat.. but hmm)
-                instrument = t[0]
-
-                current_note = {"token": token, "nfx": []}
-                current_effect = None
-
-                # Experimental: If there were orphaned nfx, attach them now
-                if len(orphaned_nfx):
-                    current_note["nfx"] = orphaned_nfx
-                orphaned_nfx = []
-
-                if not instrument in this_measure["trackbeats"]:
-                    # first time this instrument appeared in this measure
-                    this_measure["trackbeats"][instrument] = {}
-
-                if not clock in this_measure["trackbeats"][instrument]:
-                    # first time this instrument appeared in this measure at this clocktime
-                    # that means it's a new beat
-                    current_beat = {"bfx": [], "notes": []}
-                    this_measure["trackbeats"][instrument][clock] = current_beat
-                    # Experimental: If there were orphaned bfx, attach them now
-                    if len(orphaned_bfx):
-                        current_beat["bfx"] = orphaned_bfx
-                    orphaned_bfx = []
-
-                # add the note to the beat
-                this_measure["trackbeats"][instrument][clock]["notes"].append(
-                    current_note
-                )
+    :param instrument: the instrument of the note tokens, e.g. "clean0"
+    :param stringinfo: the "strings" count and "drop_tuning" of the instrument, see `read_measures`
+    :return: the (string, fret offset) of the track for each token string, indexed by the token
+        string (0 to 7): drop tuned strings are 2 frets up, 4 and 5 string basses start on string 2
+        in the tokens
+    """
+    drop = stringinfo["drop_tuning"]
+    drop_strings = (5, 6) if instrument == "bass" else (6, 7)
+    shift = 1 if instrument == "bass" and stringinfo["strings"] < 6 else 0
+    return tuple(
+        (string - shift, 2 if drop and string in drop_strings else 0)
+        for string in range(8)
+    )
 
-                # calculate the latest time difference between beats
-                if clock - last_reported_beat_clock == 0:
-                    # same beat, no time difference occured, skip for now
-                    pass
-                else:
-                    # a time difference occured!
-                    # the last duration is this beat's clock minus the last beat's clock
-                    # warning: this definition of duration is inter-instrument (time since the last beat of any instrument)
-                    last_reported_duration = clock - last_reported_beat_clock
-                # remember this beat's clocktime for later
-                last_reported_beat_clock = clock
-
-            elif t[0] == "nfx":
-                current_effect = {"token": token, "params": []}
-                if current_note:
-                    # great we know what note this effect belongs to
-                    current_note["nfx"].append(current_effect)
-                else:
-                    # uhh this token is out of place.
-                    # we could just skip it
-                    # verbose and print("warning: nfx token doesn't belong to a note", token)
-                    # OR we could attach to the next note like so:
-                    orphaned_nfx.append(current_effect)
-            elif t[0] == "bfx":
-                current_effect = {"token": token, "params": []}
-                if current_beat:
-                    # great we know what beat this effect belongs to
-                    # Now we are no longer attached to a particular note
-                    # actually I guess that is optional. A beat effect could appear between a note and notefx i guess.
-                    # current_note = None
-                    current_beat["bfx"].append(current_effect)
-                else:
-                    # uhh this token is out of place.
-                    # verbose and print("warning: bfx token doesn't belong to a beat", token)
-                    # we could skip it
-                    # OR we could attach to the next beat like so:
-                    orphaned_bfx.append(current_effect)
-            elif t[0] == "param":
-                if current_effect:
-                    # great we know what effect this param belongs to
-                    current_effect["params"].append(token)
-                else:
-                    # uhh this token is out of place. skip it
-                    verbose and print(
-                        "warning: param token doesn't belong to an effect", token
-                    )
-            elif t[0] == "wait":
-                # wait token can come any time inside a measure
-                # it resets the beat/note, and we may move to a new beat/note
-                current_beat = None
-                current_note = None
-                current_effect = None
-                time = int(t[1])
-                clock += time  # move the clock upward
-
-    final_clock = clock
-    verbose and print("Final clock:", final_clock)
-    verbose and print("=======\nFirst measure")
-    verbose and print(all_measures[0])
 
+# Given a list of tokens, constructs a guitarpro song object
+# The tokens can be as written by the encoder (string tunings in the head or in the note tokens)
+# or by pre_decoding_processing, they are normalized while they are read.
+# tunings overrides the string tunings of the tokens, E standard if they have none.
+def tokens2guitarpro(
+    all_tokens: List[str], verbose: bool = False, tunings: Union[None, List[str]] = None
+):
+    # Interpret a token list back into a GP song file
+    ## TODO: some kinda validation/flexibility for weird files the net generates?
+    ## For now let's just support valid dataset files
+    head, head_tunings, body_start = split_head(all_tokens)
+    artist_token, pitch_shift, initial_tempo = read_head(head)
+    verbose and _LOGGER.debug(
+        "Artist: %s, tempo: %s, pitch shift: %s",
+        artist_token,
+        initial_tempo,
+        pitch_shift,
+    )
+
+    (
+        all_measures,
+        final_clock,
+        instrument_check,
+        instrument_stringinfo,
+        note_tunings,
+    ) = read_measures(islice(all_tokens, body_start, None), verbose)
+    if not tunings:
+        tunings = head_tunings or note_string_tunings(note_tunings, pitch_shift)
+    return build_song(
+        all_measures,
+        final_clock,
+        instrument_check,
+        instrument_stringinfo,
+        initial_tempo,
+        pitch_shift,
+        tunings,
+        verbose,
+    )
+
+
+def build_song(
+    all_measures: List[dict],
+    final_clock: int,
+    instrument_check: dict,
+    instrument_stringinfo: dict,
+    initial_tempo: int,
+    pitch_shift: int,
+    tunings: Union[None, List[str]] = None,
+    verbose: bool = False,
+) -> gp.Song:
+    """
+    Writes measures read by `read_measures` (or a `MeasureReader`) into a new song.
+
+    :param all_measures: the measures
+    :param final_clock: the end of the last measure
+    :param instrument_check: whether each instrument has notes
+    :param instrument_stringinfo: the "strings" count and "drop_tuning" of each instrument with notes
+    :param initial_tempo: the tempo of the head
+    :param pitch_shift: the downtune of the head
+    :param tunings: the string tunings of the song, E standard (or drop D) by default
+    :param verbose: log debug information
+    """
     ###########
     ## NEW GP FILE
     # CREATE a new GP5 file from BLANKGP5
 
     ## LOAD the BLANK GP5 SCORE
-    blankgp5 = gp.parse(os.path.join(SCRIPTS_PATH, "blank.gp5"))
-    blankgp5.tracks = []
+    blankgp5 = new_blank_song()
     blankgp5.tempo = initial_tempo
 
     # Determine the order the tracks will come in
@@ -284,7 +550,12 @@ def tokens2guitarpro(
     for i in instrument_check:
         if instrument_check[i]:
             track_numbering.append(i)
-    verbose and print(track_numbering)
+    verbose and _LOGGER.debug("Track numbering: %s", track_numbering)
+    # looked up for every note
+    string_maps = {
+        instrument: string_fret_offsets(instrument, instrument_stringinfo[instrument])
+        for instrument in track_numbering
+    }
 
     #############
     # Creating the GP Instrument Tracks
@@ -302,10 +573,10 @@ def tokens2guitarpro(
     # 0      4047    Acoustic Grand Piano
     # 52     2546    Choir Aahs
     # 81     2009    Lead 2 (sawtooth)
-    verbose and print("pitch_shift", pitch_shift)
+    verbose and _LOGGER.debug("pitch_shift %s", pitch_shift)
     blankgp5.tracks = []
     for i, instrument in enumerate(track_numbering):
-        verbose and print(i, instrument)
+        verbose and _LOGGER.debug("Track %s: %s", i, instrument)
         new_track = gp.Track(blankgp5)
         new_track.number = i + 1  # track numbers are 1-indexed
         new_track.offset = 0
@@ -327,22 +598,9 @@ def tokens2guitarpro(
         else:
             assert False, "Unsupported instrument"
         # Now set the strings
-        drop = instrument_stringinfo[instrument]["drop_tuning"]
-        n_strings = instrument_stringinfo[instrument]["strings"]
-        if tunings:
-            strings = tunings
-        else:
-            if n_strings == 6:
-                if drop:
-                    strings = ["E5", "B4", "G4", "D4", "A3", "D3"]
-                else:
-                    strings = ["E5", "B4", "G4", "D4", "A3", "E3"]
-            elif n_strings == 7:
-                if drop:
-                    strings = ["E5", "B4", "G4", "D4", "A3", "D3", "A2"]
-                else:
-                    strings = ["E5", "B4", "G4", "D4", "A3", "E3", "B2"]
-        new_track.strings = convert_strings_for_pygp(strings, pitch_shift)
+        new_track.strings = track_strings(
+            instrument_stringinfo[instrument], tunings, pitch_shift
+        )
 
         blankgp5.tracks.append(new_track)
 
@@ -374,22 +632,20 @@ def tokens2guitarpro(
         header.start = measure["clock"]
         # use the measure tokens to change the parameters of the header
         for measure_token in measure["measure_tokens"]:
-            mt = measure_token.split(":")
-            if mt[0] == "measure":
-                # all measure tokens begin like this
-                # If contradicting measure tokens exist, the later one will overwrite the previous one
-                if mt[1] == "triplet_feel":
-                    header.tripletFeel = gp.TripletFeel(int(mt[2]))
-                elif mt[1] == "repeat_open":
-                    header.isRepeatOpen = True
-                elif mt[1] == "repeat_alternative":
-                    header.repeatAlternative = int(mt[2])
-                elif mt[1] == "repeat_close":
-                    header.repeatClose = int(mt[2])
-                elif mt[1] == "direction":
-                    header.direction = int(mt[2])
-                elif mt[1] == "from_direction":
-                    header.fromDirection = int(mt[2])
+            # If contradicting measure tokens exist, the later one will overwrite the previous one
+            mt = measure_token.token.split(":")
+            if mt[1] == "triplet_feel":
+                header.tripletFeel = gp.TripletFeel(int(mt[2]))
+            elif mt[1] == "repeat_open":
+                header.isRepeatOpen = True
+            elif mt[1] == "repeat_alternative":
+                header.repeatAlternative = int(mt[2])
+            elif mt[1] == "repeat_close":
+                header.repeatClose = int(mt[2])
+            elif mt[1] == "direction":
+                header.direction = int(mt[2])
+            elif mt[1] == "from_direction":
+                header.fromDirection = int(mt[2])
         # Get the measure length
         measure_duration = end_measure_clock - measure_clock
 
@@ -438,17 +694,16 @@ def tokens2guitarpro(
         header.timeSignature = guitarpro.models.TimeSignature(
             numerator=n, denominator=d
         )
-        print("measure_clock", measure_clock, end_measure_clock, final_clock)
-        print(
-            "Measure:",
+        verbose and _LOGGER.debug(
+            "Measure: %s TS: %s/%s measure_clock %s end_measure_clock %s final_clock %s "
+            "measure_duration %s thirtysecondths %s",
             m,
-            "TS:",
             n,
-            "/",
-            d,
-            "measure_duration",
+            d.value,
+            measure_clock,
+            end_measure_clock,
+            final_clock,
             measure_duration,
-            "thirtysecondths",
             thirtysecondths,
         )
         # header.tempo = tempo # don't use mesaureHeader.tempo it's fucked
@@ -467,6 +722,7 @@ def tokens2guitarpro(
                 # this instrument is present in this measure
                 beats = measure["trackbeats"][instrument]
                 clocks = list(beats.keys())
+                string_map = string_maps.get(instrument, ())
                 # print("beats", beats)
 
                 # Check if the first beat is also the measure start
@@ -474,9 +730,11 @@ def tokens2guitarpro(
                     # The first beat is not the measure start
                     # So we need to insert the initial rest
                     initial_rest = {
-                        "notes": [{"token": instrument + ":rest"}],
+                        "notes": [{"record": parse_token(instrument + ":rest")}],
                         "bfx": [],
                     }
+                    # (on a copy, the measures can be written again)
+                    beats = dict(beats)
                     beats[gp_measure.start] = initial_rest
                     clocks.insert(0, gp_measure.start)
                     # okay continue as usual
@@ -502,20 +760,16 @@ def tokens2guitarpro(
                         # raise Exception("beat duration zero")
                         continue
                     else:
-                        try:
-                            # Handy function for converting clock duration to its equivalent notelength/dotted/tuplet
-                            # This function might fail if the model generates a weird time combination
-                            gp_beat.duration = gp.models.Duration.fromTime(duration)
-                            # print(duration, m, len(all_measures), b, len(clocks))
-                        except:
-                            # It's anweird duration
-                            # Instead round it to the nearest supported time
-                            new_time = convert_to_nearest_supported_time(duration)
-                            gp_beat.duration = gp.models.Duration.fromTime(new_time)
-
-                            verbose and print(
-                                "Duration Conversion Measure %s, Track %s: %s => %s"
-                                % (m, t, duration, new_time)
+                        # clock duration to its equivalent notelength/dotted/tuplet,
+                        # weird durations (the model may generate them) are rounded to the nearest supported time
+                        gp_beat.duration, new_time = duration_from_time(duration)
+                        if new_time is not None:
+                            verbose and _LOGGER.debug(
+                                "Duration Conversion Measure %s, Track %s: %s => %s",
+                                m,
+                                t,
+                                duration,
+                                new_time,
                             )
                             # todo:
                             # Instead of rounding, maybe it's better to split it into multiple beats to additively reach the duration
@@ -528,44 +782,32 @@ def tokens2guitarpro(
 
                     gp_beat.start = clock
                     ## NOTES
+                    # bit s is set once a note is on (gp) string s
+                    occupied = 0
                     for n, note in enumerate(beat["notes"]):
                         # print(instrument, note)
                         # Could be note or rest
-                        note_info = note["token"].split(":")
-                        assert note_info[0] == instrument
-                        if note_info[1] == "rest":
+                        record = note["record"]
+                        assert record.instrument == instrument
+                        if record.kind == "rest":
                             # rest
                             # do nothing. at the end of the beat we'll figure out what type of beat it was (normal, rest)
                             continue
-                        elif note_info[1] == "note":
+                        elif record.kind == "note":
                             if instrument != "drums":
                                 # a non-drum note
-                                string = int(note_info[2][1:])  # s4
-                                fret = int(note_info[3][1:])  # f0, f20, f-2, etc
-
-                                # get information about the instrument tuning type
-                                stringinfo = instrument_stringinfo[instrument]
-                                # if this is on a drop string the fret value has to be +2
-                                if stringinfo["drop_tuning"]:
-                                    if instrument == "bass":
-                                        if string == 5 or string == 6:
-                                            fret += 2
-                                    else:
-                                        if string == 6 or string == 7:
-                                            fret += 2
-                                # 4 and 5 string basses start on string2 in token format, bring it back to string1 for GP
-                                if instrument == "bass" and stringinfo["strings"] < 6:
-                                    string -= 1
-
-                                ## TODO: PLEASE DOUBLE CHECK NO TWO NOTES ON SAME STRING.
-                                ignore = False
-                                for notes2 in gp_beat.notes:
-                                    if notes2.string == string:
-                                        # note already on string. ignore this note
-                                        ignore = True
-                                        break
-                                if ignore:
+                                string = record.string
+                                fret = record.fret
+                                # drop strings get +2 frets, 4 and 5 string basses are renumbered
+                                if 0 <= string < len(string_map):
+                                    string, offset = string_map[string]
+                                    fret += offset
+
+                                # no two notes on the same string, the first one is kept
+                                bit = 1 << string if string >= 0 else 0
+                                if occupied & bit:
                                     continue
+                                occupied |= bit
                             # create the guitarpro note object
                             gp_note = guitarpro.models.Note(gp_beat)
                             gp_note.string = string
@@ -589,23 +831,128 @@ def tokens2guitarpro(
                 pass
             track.measures.append(gp_measure)  # append it to gp_measure
 
-    verbose and print("Measures:", (len(blankgp5.measureHeaders)))
-    verbose and print("Measures:", (len(blankgp5.tracks[0].measures)))
+    verbose and _LOGGER.debug("Measure headers: %s", len(blankgp5.measureHeaders))
+    verbose and _LOGGER.debug("Measures: %s", len(blankgp5.tracks[0].measures))
     #########
     ### DONE
     # print(blankgp5.tracks[8].measures[0].voices[0].beats[0].notes[2])
     return blankgp5
 
 
+class IncrementalDecoder:
+    """
+    Decodes tokens one at a time, as a sampler generates them.
+
+    Tokens are given as in a token file: the head (artist, downtune, tempo, the 6 string tunings
+    unless the notes carry them, start) then the body, with or without "cleanX:" prefixes.
+    `feed` returns each measure (see `MeasureReader`) as soon as the next "new_measure" completes
+    it, and `song` writes the measures completed so far, so a generation can be previewed or
+    rejected early without decoding its prefix again at every step.
+
+    The drop tuning and string count of a track are decided by all of its notes, so `song` can
+    change earlier measures when a drop tuned fret or a 7th string shows up later.
+    """
+
+    def __init__(self, verbose: bool = False):
+        self.verbose = verbose
+        self.head = []
+        self.artist = None
+        self.pitch_shift = None
+        self.tempo = None
+        # True if the string tunings are in the note tokens, None until the head is read
+        self.note_tuning = None
+        self.head_tunings = None
+        self.reader = MeasureReader(verbose)
+        self.measures = []
+
+    @property
+    def finished(self) -> bool:
+        return self.reader.finished
+
+    @property
+    def clock(self) -> int:
+        return self.reader.clock
+
+    @property
+    def tunings(self) -> Union[None, List[str]]:
+        """The string tunings of the head, or of the notes read so far."""
+        if self.head_tunings is not None:
+            return self.head_tunings
+        return note_string_tunings(self.reader.note_tunings, self.pitch_shift)
+
+    def feed(self, token: str):
+        """
+        Reads the next token.
+
+        :return: the measure that this token completed, None if there is none
+        """
+        if self.note_tuning is None:
+            return self._feed_head(token)
+        measure = self.reader.feed(token)
+        if measure is not None:
+            self.measures.append(measure)
+        return measure
+
+    def _feed_head(self, token: str):
+        self.head.append(token)
+        if token == "start" and len(self.head) in (4, 10):
+            head, self.head_tunings, _ = split_head(self.head)
+            self.note_tuning = self.head_tunings is None
+            self.artist, self.pitch_shift, self.tempo = read_head(head)
+        elif len(self.head) >= 10:
+            raise ValueError("No 'start' token at index 3 or 9 of the head")
+        return None
+
+    def close(self):
+        """
+        Ends the song (as an "end" token would) if it isn't finished.
+
+        :return: the measure this completed, None if there is none
+        """
+        if self.finished or self.note_tuning is None:
+            return None
+        return self.feed("end")
+
+    def song(self) -> gp.Song:
+        """
+        A new song of the measures completed so far, as `tokens2guitarpro` would decode them
+        (the artist of the head is `self.artist`, it isn't set on the song).
+        """
+        if self.note_tuning is None:
+            raise ValueError("The head hasn't been read yet")
+        final_clock = self.measures[-1]["end_clock"] if self.measures else self.clock
+        return build_song(
+            self.measures,
+            final_clock,
+            self.reader.instrument_check,
+            self.reader.instrument_stringinfo(),
+            self.tempo,
+            self.pitch_shift,
+            self.tunings,
+            self.verbose,
+        )
+
+
+# Given token ids of `vocab` (see guitarpro2ids), constructs a guitarpro song object
+def ids2guitarpro(ids, vocab, verbose: bool = False):
+    return tokens2guitarpro(vocab.decode(ids), verbose=verbose)
+
+
 # tokens --> guitarpro
-def asdadagp_decode(input_file, output_file):
-    text_file = open(input_file, "r")
-    tokens = text_file.read().split("\n")
+def asdadagp_decode(input_file, output_file, verbose: bool = False):
+    with open(input_file, "r") as text_file:
+        tokens = text_file.read().split("\n")
+
+    if output_file.lower().endswith((".mid", ".midi")):
+        from .midi import tokens2midi
 
-    processed_tokens, tunings = pre_decoding_processing(tokens)
+        # straight to MIDI, without a Guitar Pro song
+        with open(output_file, "wb") as f:
+            f.write(tokens2midi(tokens, verbose=verbose))
+        return
 
-    # Convert the tokens to a song
-    song = tokens2guitarpro(tokens, verbose=True, tunings=tunings)
+    # Convert the tokens to a song, they are normalized while they are read
+    song = tokens2guitarpro(tokens, verbose=verbose)
     # Appears at the top of the GP score
     song.artist = tokens[0]
     song.album = "Generated by DadaGP"
@@ -0,0 +1,363 @@
+import hashlib
+import multiprocessing
+import os
+import random
+import sqlite3
+from array import array
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .batch import find_files
+from .processor import split_tokens_to_measures
+
+# MinHash permutations are h(x) = (a * x + b) mod p, the values kept are the low 32 bits
+_PRIME = (1 << 61) - 1
+_MASK32 = (1 << 32) - 1
+_MASK64 = (1 << 64) - 1
+
+DEFAULT_NUM_PERM = 128
+DEFAULT_SHINGLE_SIZE = 2
+DEFAULT_SEED = 1
+DEFAULT_BANDS = 16
+DEFAULT_THRESHOLD = 0.8
+
+
+def measure_hashes(tokens: List[str]) -> List[int]:
+    """
+    Hashes each measure of a token list (the head before the first "new_measure" is left out).
+
+    :param tokens: tokens written by the encoder
+    :return: a stable 64-bit hash per measure
+    """
+    if tokens and tokens[-1] == "end":
+        tokens = tokens[:-1]
+    hashes = []
+    for measure in split_tokens_to_measures(tokens)[1:]:
+        digest = hashlib.blake2b(
+            "\n".join(measure).encode("utf-8"), digest_size=8
+        ).digest()
+        hashes.append(int.from_bytes(digest, "little"))
+    return hashes
+
+
+def shingles(hashes: Sequence[int], size: int = DEFAULT_SHINGLE_SIZE) -> set:
+    """
+    The set of runs of `size` consecutive measure hashes, each hashed to one int.
+
+    A song shorter than `size` measures gives a single shingle of all its measures, a song without
+    measures gives no shingles.
+    """
+    result = set()
+    if not hashes:
+        return result
+    for i in range(max(1, len(hashes) - size + 1)):
+        h = 0
+        for x in hashes[i : i + size]:
+            h = ((h * 1000003) ^ x) & _MASK64
+        result.add(h)
+    return result
+
+
+@lru_cache(maxsize=None)
+def _permutations(num_perm: int, seed: int) -> Tuple[Tuple[int, int], ...]:
+    rng = random.Random(seed)
+    return tuple(
+        (rng.randrange(1, _PRIME), rng.randrange(0, _PRIME)) for _ in range(num_perm)
+    )
+
+
+def minhash(
+    values: Iterable[int], num_perm: int = DEFAULT_NUM_PERM, seed: int = DEFAULT_SEED
+) -> array:
+    """
+    MinHash signature of a set of ints.
+
+    :param values: the set, e.g. `shingles(measure_hashes(tokens))`
+    :param num_perm: number of hash functions, the length of the signature
+    :param seed: seed of the hash functions, signatures are only comparable with the same seed
+    :return: an `array('I')` of `num_perm` values, all 0xFFFFFFFF for an empty set (such
+        signatures are left out by `find_duplicate_clusters`)
+    """
+    values = [v % _PRIME for v in values]
+    if not values:
+        return array("I", [_MASK32] * num_perm)
+    return array(
+        "I",
+        (
+            min((a * v + b) % _PRIME for v in values) & _MASK32
+            for a, b in _permutations(num_perm, seed)
+        ),
+    )
+
+
+def song_signature(
+    tokens: List[str],
+    num_perm: int = DEFAULT_NUM_PERM,
+    shingle_size: int = DEFAULT_SHINGLE_SIZE,
+    seed: int = DEFAULT_SEED,
+) -> array:
+    """MinHash signature of a song's measure shingles."""
+    return minhash(shingles(measure_hashes(tokens), shingle_size), num_perm, seed)
+
+
+def similarity(signature1: Sequence[int], signature2: Sequence[int]) -> float:
+    """Estimated Jaccard similarity of two songs: the fraction of equal signature values."""
+    same = sum(1 for x, y in zip(signature1, signature2) if x == y)
+    return same / len(signature1)
+
+
+# (token_file, num_perm, shingle_size, seed)
+SignatureJob = Tuple[str, int, int, int]
+
+
+def _signature_one(job: SignatureJob):
+    # Runs in a worker process. Errors are returned so one bad file doesn't stop the pool.
+    path, num_perm, shingle_size, seed = job
+    try:
+        stat = os.stat(path)
+        with open(path, "r") as f:
+            tokens = f.read().split("\n")
+        values = shingles(measure_hashes(tokens), shingle_size)
+        # songs without measures are stored without a signature, they match nothing
+        signature = minhash(values, num_perm, seed).tobytes() if values else None
+    except Exception as e:
+        return path, None, None, None, f"{type(e).__name__}: {e}"
+    return path, stat.st_mtime, stat.st_size, signature, None
+
+
+class SignatureStore:
+    """
+    Signatures of token files, persisted in an sqlite database.
+
+    `update` only reads the files that are new or changed (by mtime and size) since they were last
+    signed, so a corpus can be extended without hashing it again. Files without measures are kept
+    without a signature and left out of `signatures`. The MinHash parameters are stored
+    with the signatures, opening the database with different ones raises a ValueError.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        num_perm: int = DEFAULT_NUM_PERM,
+        shingle_size: int = DEFAULT_SHINGLE_SIZE,
+        seed: int = DEFAULT_SEED,
+    ):
+        self.path = path
+        self.params = {"num_perm": num_perm, "shingle_size": shingle_size, "seed": seed}
+        self.db = sqlite3.connect(path)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)"
+            )
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS signatures "
+                "(path TEXT PRIMARY KEY, mtime REAL, size INTEGER, signature BLOB)"
+            )
+            stored = dict(self.db.execute("SELECT key, value FROM meta"))
+            if stored and stored != self.params:
+                raise ValueError(
+                    f"{path} has signatures made with {stored}, not {self.params}"
+                )
+            self.db.executemany(
+                "INSERT OR IGNORE INTO meta VALUES (?, ?)", self.params.items()
+            )
+
+    def __enter__(self) -> "SignatureStore":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.db.close()
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM signatures").fetchone()[0]
+
+    def update(
+        self,
+        files: List[str],
+        workers: Optional[int] = None,
+        chunksize: int = 64,
+        prune: bool = False,
+    ) -> Dict:
+        """
+        Signs the new and changed token files.
+
+        :param files: token files of the corpus
+        :param workers: number of worker processes, defaults to the number of CPUs (1 disables the pool)
+        :param chunksize: number of files sent to a worker at a time
+        :param prune: also forget the stored files that are not in `files`
+        :return: a summary dict with the "added", "updated", "unchanged", "removed" counts,
+            the number of "empty" files (without measures) and the "failed" files with their errors
+        """
+        known = {
+            path: (mtime, size)
+            for path, mtime, size in self.db.execute(
+                "SELECT path, mtime, size FROM signatures"
+            )
+        }
+        todo = []
+        unchanged = 0
+        for path in files:
+            stat = os.stat(path)
+            if known.get(path) == (stat.st_mtime, stat.st_size):
+                unchanged += 1
+            else:
+                todo.append(
+                    (
+                        path,
+                        self.params["num_perm"],
+                        self.params["shingle_size"],
+                        self.params["seed"],
+                    )
+                )
+
+        if workers == 1 or len(todo) <= 1:
+            results = map(_signature_one, todo)
+            pool = None
+        else:
+            pool = multiprocessing.Pool(processes=workers)
+            results = pool.imap_unordered(_signature_one, todo, chunksize=chunksize)
+
+        summary = {
+            "added": 0,
+            "updated": 0,
+            "unchanged": unchanged,
+            "removed": 0,
+            "empty": 0,
+        }
+        failed = []
+        try:
+            with self.db:
+                for path, mtime, size, signature, error in results:
+                    if error:
+                        failed.append({"file": path, "error": error})
+                        continue
+                    summary["updated" if path in known else "added"] += 1
+                    if signature is None:
+                        summary["empty"] += 1
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO signatures VALUES (?, ?, ?, ?)",
+                        (path, mtime, size, signature),
+                    )
+                if prune:
+                    stale = set(known) - set(files)
+                    self.db.executemany(
+                        "DELETE FROM signatures WHERE path = ?",
+                        ((path,) for path in stale),
+                    )
+                    summary["removed"] = len(stale)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        summary["failed"] = failed
+        return summary
+
+    def signatures(self) -> Iterator[Tuple[str, array]]:
+        """Yields (path, signature) for every stored file with a signature."""
+        for path, blob in self.db.execute(
+            "SELECT path, signature FROM signatures WHERE signature IS NOT NULL"
+        ):
+            signature = array("I")
+            signature.frombytes(blob)
+            yield path, signature
+
+
+def find_duplicate_clusters(
+    signatures: Iterable[Tuple[str, array]],
+    bands: int = DEFAULT_BANDS,
+    threshold: float = DEFAULT_THRESHOLD,
+    max_bucket_comparisons: int = 32,
+) -> List[List[str]]:
+    """
+    Groups near-duplicate songs with locality sensitive hashing.
+
+    Each signature is cut into `bands` bands. Songs with an identical band are candidates, and a
+    candidate pair is linked when its estimated similarity is at least `threshold`. A song is compared
+    with at most `max_bucket_comparisons` songs per band, so the time grows linearly with the corpus.
+
+    :param signatures: (path, signature) pairs, e.g. `SignatureStore.signatures()`, the signatures
+        of empty sets are skipped
+    :param bands: number of bands, must divide the signature length
+    :param threshold: minimum estimated Jaccard similarity of near-duplicates
+    :param max_bucket_comparisons: comparisons per song and band
+    :return: the clusters of two or more paths (connected linked songs), largest first
+    """
+    paths = []
+    sigs = []
+    parent = []
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    buckets = {}
+    i = 0
+    for path, signature in signatures:
+        if all(v == _MASK32 for v in signature):
+            # a song without shingles, it would match every other one
+            continue
+        if len(signature) % bands:
+            raise ValueError(
+                "%s bands don't divide signatures of length %s"
+                % (bands, len(signature))
+            )
+        rows = len(signature) // bands
+        paths.append(path)
+        sigs.append(signature)
+        parent.append(i)
+        for band in range(bands):
+            key = (band, signature[band * rows : (band + 1) * rows].tobytes())
+            members = buckets.setdefault(key, [])
+            for j in members[:max_bucket_comparisons]:
+                root_i, root_j = find(i), find(j)
+                if root_i != root_j and similarity(signature, sigs[j]) >= threshold:
+                    parent[root_i] = root_j
+            members.append(i)
+        i += 1
+
+    clusters = {}
+    for i in range(len(paths)):
+        clusters.setdefault(find(i), []).append(paths[i])
+    result = [sorted(c) for c in clusters.values() if len(c) > 1]
+    result.sort(key=lambda c: (-len(c), c[0]))
+    return result
+
+
+def find_duplicates(
+    source: str,
+    db_path: str,
+    bands: int = DEFAULT_BANDS,
+    threshold: float = DEFAULT_THRESHOLD,
+    workers: Optional[int] = None,
+    num_perm: int = DEFAULT_NUM_PERM,
+    shingle_size: int = DEFAULT_SHINGLE_SIZE,
+) -> Dict:
+    """
+    Finds near-duplicates among the token files of a directory (or glob).
+
+    The signatures are kept in `db_path`, so running it again only signs the new or changed files.
+
+    :param source: a directory (searched recursively for .txt token files) or a glob pattern
+    :param db_path: sqlite database of the signatures, created if needed
+    :param bands: number of LSH bands
+    :param threshold: minimum estimated Jaccard similarity of near-duplicates
+    :param workers: number of worker processes used to sign files
+    :param num_perm: MinHash signature length
+    :param shingle_size: number of consecutive measures per shingle
+    :return: the update summary of the store with the "clusters" of near-duplicate files
+    """
+    _, files = find_files(source, (".txt",))
+    with SignatureStore(db_path, num_perm, shingle_size) as store:
+        summary = store.update(files, workers=workers)
+        wanted = set(files)
+        summary["clusters"] = find_duplicate_clusters(
+            ((path, sig) for path, sig in store.signatures() if path in wanted),
+            bands=bands,
+            threshold=threshold,
+        )
+    return summary
@@ -1,28 +1,75 @@
+import heapq
+import io
+import logging
+import os
+from typing import Optional, Union
+
 import guitarpro as gp
 
+from .cache import EncodeCache, cache_key, open_cache
 from .const import instrument_groups
-from .token_splitter import split_rare_token
+from .token_splitter import split_rare_token, split_tokens
 from .utils import beat_effect_list  # is_good_guitar_tuning,
 from .utils import (
+    EncoderEvent,
+    MeasureOccupancy,
+    TrackContext,
     convert_spn_to_common,
-    get_fret,
+    event_order_key,
     get_instrument_group,
     get_instrument_token_prefix,
     get_measure_tokens,
+    get_tempo_at_measure,
     get_tuning_type,
     guitar_downtunage,
     note_effect_list,
-    oops_theres_a_conflicting_beatfx,
-    oops_theres_a_note_here,
     roundtempo,
 )
 
+_LOGGER = logging.getLogger(__name__)
 
-# Takes a GP file, converts to token format
-def guitarpro2tokens(song, artist, verbose=False, note_tuning=False):
+
+# What the encoder works out from the tracks before reading any beat
+class SongSetup:
+    __slots__ = (
+        "track_contexts",
+        "pitch_shift",
+        "strings",
+        "tempo",
+        "measures",
+        "first_measure",
+        "last_measure",
+    )
+
+    def __init__(
+        self,
+        track_contexts,
+        pitch_shift,
+        strings,
+        tempo,
+        measures,
+        first_measure,
+        last_measure,
+    ):
+        # TrackContext of every (kept) track
+        self.track_contexts = track_contexts
+        self.pitch_shift = pitch_shift
+        # tuning of strings 1..n (the same for every track)
+        self.strings = strings
+        # tempo at the start of the first measure
+        self.tempo = tempo
+        # measures of the first track, measures[first_measure:last_measure] are encoded
+        self.measures = measures
+        self.first_measure = first_measure
+        self.last_measure = last_measure
+
+
+# Checks the tracks of a song (and removes the sfx tracks) before it is encoded
+# start_measure/end_measure: only encode measures[start_measure:end_measure] (0-based, end excluded)
+def prepare_song(song, verbose=False, start_measure=None, end_measure=None):
     # - Map every track in song to an instrument group
     # - Remove SoundFX tracks
-    # - Throw error if any track has an instrument change event in mixTable
+    # - Throw error if any track has an instrument change event in mixTable (in any measure, even outside the range)
     # - Throw error if song has more than 3 distorted guitars, 2 clean guitars, or 1 bass
     # - Non-guitar instruments will become either piano (leads) or choir (pads) and treated like a guitar track.
     # - Multiple drums tracks get combined into one track. Same for leads/pads.
@@ -47,21 +94,16 @@ def guitarpro2tokens(song, artist, verbose=False, note_tuning=False):
         "remove": [],
     }
 
-    for i, track in enumerate(song.tracks):
+    # one pass over the tracks: group them and drop the sfx tracks
+    kept_tracks = []
+    for track in song.tracks:
         group = get_instrument_group(track)
         tracks_by_group[group].append(track)
-
-    # remove sfx tracks
-    while True:
-        removed = False
-        for i, track in enumerate(song.tracks):
-            if get_instrument_group(track) == "remove":
-                del song.tracks[i]
-                removed = True
-                break
-        if removed:
-            continue
-        break
+        if group != "remove":
+            kept_tracks.append(track)
+    song.tracks[:] = kept_tracks
+    if not song.tracks:
+        raise ValueError("Error: The song has no guitar tracks")
 
     # max_bass = 1
     max_clean = 3
@@ -80,17 +122,7 @@ def guitarpro2tokens(song, artist, verbose=False, note_tuning=False):
         n_clean,
     )
 
-    verbose and print(tracks_by_group)
-
-    # Throw error if there is an instrument change
-    for t, track in enumerate(song.tracks):
-        for m, measure in enumerate(track.measures):
-            for v, voice in enumerate(measure.voices):
-                for b, beat in enumerate(voice.beats):
-                    if beat.effect.mixTableChange:
-                        assert (
-                            beat.effect.mixTableChange.instrument == None
-                        ), "Instrument Change Not Supported"
+    verbose and _LOGGER.debug("Tracks by group: %s", tracks_by_group)
 
     #############################################
     # TUNING SHIFT
@@ -145,7 +177,7 @@ def guitarpro2tokens(song, artist, verbose=False, note_tuning=False):
             downtunages.append(guitar_downtunage(strings))
         tuning_types[t] = get_tuning_type(group_name, strings)
 
-    verbose and print("Downtuning scheme:", downtunages)
+    verbose and _LOGGER.debug("Downtuning scheme: %s", downtunages)
     allthesame = all([x % 12 == downtunages[0] % 12 for x in downtunages])
     # for example, (-3, -3, -3) are all the same downtune
     # also, (-3, -3, -15) is all the same downtune. That third instrument will end up changing octave to meet the others.
@@ -163,8 +195,37 @@ def guitarpro2tokens(song, artist, verbose=False, note_tuning=False):
         pitch_shift = 0
     else:
         pitch_shift = downtunages[0]
-    verbose and print("Pitch Shift:", pitch_shift)
-    verbose and print(tuning_types)
+    verbose and _LOGGER.debug("Pitch Shift: %s", pitch_shift)
+    verbose and _LOGGER.debug("Tuning types: %s", tuning_types)
+
+    # Tuning, capo and instrument prefix of every track, reused for all of its notes
+    track_contexts = [
+        TrackContext(track, get_instrument_token_prefix(track, tracks_by_group))
+        for track in song.tracks
+    ]
+
+    # Measure range
+    measures = song.tracks[0].measures
+    first_measure = 0 if start_measure is None else start_measure
+    last_measure = len(measures) if end_measure is None else end_measure
+    has_range = start_measure is not None or end_measure is not None
+    if has_range and not 0 <= first_measure < last_measure <= len(measures):
+        raise ValueError(
+            "Invalid measure range %s:%s, the song has %s measures"
+            % (start_measure, end_measure, len(measures))
+        )
+
+    # Instrument changes (in a beat's mixTableChange) are not supported.
+    # Checked over the whole song before anything is encoded, after the cheaper track checks
+    for track in song.tracks:
+        for measure in track.measures:
+            for voice in measure.voices:
+                for beat in voice.beats:
+                    mix_table_change = beat.effect.mixTableChange
+                    if mix_table_change:
+                        assert (
+                            mix_table_change.instrument == None
+                        ), "Instrument Change Not Supported"
 
     #############################################
     # CONDITIONING
@@ -173,31 +234,41 @@ def guitarpro2tokens(song, artist, verbose=False, note_tuning=False):
     # song.tempo is the initial tempo
     # Note: please ignore measure.tempo, it's wrong and seems to be a bug in guitarpro
     # tempo may change later in the song in a beatEffect
-    tempo_token = "tempo:%s" % roundtempo(song.tempo)
+    # (when starting later in the song, the head has the tempo of the tempo changes before the first measure)
+    if first_measure > 0:
+        tempo = get_tempo_at_measure(song, first_measure)
+    else:
+        tempo = song.tempo
+
+    return SongSetup(
+        track_contexts,
+        pitch_shift,
+        ref_strings,
+        tempo,
+        measures,
+        first_measure,
+        last_measure,
+    )
 
+
+# The head tokens: artist, downtune, tempo, the strings (unless they come with every note) and start
+def get_head_tokens(artist, pitch_shift, tempo, strings, note_tuning=False):
     downtune_token = "downtune:%s" % pitch_shift
+    tempo_token = "tempo:%s" % roundtempo(tempo)
 
     # head_tokens = [artist, downtune_token, tempo_token, "start"]
     head_tokens = [artist, downtune_token, tempo_token]
     if not note_tuning:
-        head_tokens.extend(ref_strings)
+        head_tokens.extend(strings)
     head_tokens.append("start")
+    return head_tokens
 
-    tunings = ["Order of strings: (1,2,3,4,5,6)"]
-
-    scientific_pitch_tuning = f"spn_tuning:{strings}"
-    tunings.append(scientific_pitch_tuning)
-
-    common_tuning = f"tuning:{convert_spn_to_common(strings)}"
-    tunings.append(common_tuning)
-
-    verbose and print("=========\nHead tokens")
-    verbose and print(f"{head_tokens}, \n{tunings}")
 
+# Yields the events of each measure of measures[setup.first_measure:setup.last_measure], in token order
+def iter_measure_events(song, setup, verbose=False):
     ######################################################
-    ## BUILD THE LIST OF EVENTS
+    ## BUILD THE EVENTS OF EACH MEASURE (BodyTokenWriter converts them into body tokens)
 
-    events_all = []  # a list of measures. each measure is a list of events.
     # there's four types of events: measure, note, rest, beatfx
     # measure event tokens always come at the beginning of the measure before the notes
     # notefx tokens always come immediately after the note
@@ -205,26 +276,40 @@ def guitarpro2tokens(song, artist, verbose=False, note_tuning=False):
     # the order of beats matters
     # but the order of notes/tracks within a beat doesn't matter (this can be changed for dataset augmentation)
 
+    # Events that start at or after the next measure's start (a beat that overflows its measure)
+    # are held back and merged with the next measure's events,
+    # so the order is the same as sorting the events of the whole song at once.
+    pending = []
+
+    measures = setup.measures
+    first_measure = setup.first_measure
+    last_measure = setup.last_measure
+    track_contexts = setup.track_contexts
+
     # measures (im representing measures as the top of the hierarchy so that autoregression always moves forward in time)
-    for m, _ in enumerate(song.tracks[0].measures):
-        measure = song.tracks[0].measures[m]
-        events_this_measure = []  # just this measures' events
+    # when starting later in the song, the measure before the range is read for the events that
+    # overflow into the first measure (an overflow of more than one measure is lost)
+    for m in range(max(first_measure - 1, 0), last_measure):
+        measure = measures[m]
+        # just this measures' events, indexed by start/instrument/string for the conflict checks
+        events_this_measure = MeasureOccupancy()
         # Measure event is always the first event in the list:
         # (hack: setting track to -1 ensures the measure tokens will come before the note tokens when sorting0
-        event = {
-            "type": "measure",
-            "track": -1,
-            "start": measure.start,
-            "tokens": get_measure_tokens(measure),
-        }
+        event = EncoderEvent(
+            "measure", -1, measure.start, tokens=get_measure_tokens(measure)
+        )
+        events_this_measure.new_stream()
         events_this_measure.append(event)
         # tracks in measures
         for t, track in enumerate(song.tracks):
-            instrument_prefix = get_instrument_token_prefix(track, tracks_by_group)
+            context = track_contexts[t]
+            instrument_prefix = context.instrument_prefix
             measure = track.measures[m]
             # voices in tracks (i guess tracks have 2 voices? i will just combine them into one voice)
             for v, voice in enumerate(measure.voices):
                 # print(m, t, v)
+                # each voice is a stream of events in time order
+                events_this_measure.new_stream()
                 for b, beat in enumerate(voice.beats):
                     # in the latest version of pyguitarpro (September 25 2020)
                     # duration.time may be int or Fraction
@@ -235,6 +320,7 @@ def guitarpro2tokens(song, artist, verbose=False, note_tuning=False):
                     # beat_start = convert_to_nearest_supported_time(beat.start - measure.start) + measure.start
                     beat_duration = beat.duration.time
                     beat_start = beat.start
+                    # (instrument changes were rejected by prepare_song)
                     # print(beat_start, beat.start)
                     if beat.status.name == "empty":
                         # there's supposedly nothing in this measure for this voice/track
@@ -254,47 +340,34 @@ def guitarpro2tokens(song, artist, verbose=False, note_tuning=False):
                             # elif(note.type==1):
                             #   a rest note? ˙hmm
                             notefx.extend(note_effect_list(note.effect))
-                            if track.isPercussionTrack:
+                            if context.is_percussion:
                                 # Need to verify how percussion behaves on strings/values
                                 string = note.string
                                 fret = note.value
                             else:
-                                # strings are 1-indexed. They start from string 1 and go to string 6 or 7
-                                # GP's string value is OK to copy over into our representation
-                                # UNLESS it's a 4 or 5 string bass, which I want to start from string 2
-                                # the reason for this is that 6 string bass adds in the high C string which we want as string 1
-                                if (
-                                    instrument_prefix == "bass"
-                                    and len(track.strings) < 6
-                                ):
-                                    string = note.string + 1
-                                else:
-                                    string = note.string
-                                fret = get_fret(note, track, pitch_shift)
+                                # 4 or 5 string basses start from string 2 (see TrackContext)
+                                string = note.string + context.string_offset
+                                fret = context.fret(note)
                             # Tricky calculation to get the fret number
                             # note.velocity=95 -- maybe ignore velocity for now
-                            event = {
-                                "type": "note",
-                                "track": t,
-                                "instrument_prefix": instrument_prefix,
-                                "start": beat_start,
-                                "duration": beat_duration,
-                                "string": string,
-                                "fret": fret,
-                                "effects": notefx,
-                            }
+                            event = EncoderEvent(
+                                "note",
+                                t,
+                                beat_start,
+                                beat_duration,
+                                instrument_prefix,
+                                string=string,
+                                fret=fret,
+                                effects=notefx,
+                            )
                             # Test if there's already a note/rest in this spot
                             # This may happen when combining tracks into one track
                             # Or if the generator is so dumb that it puts two notes on the same string
                             # Note: If there was a rest here, remove it, replace it with a note.
-                            test = oops_theres_a_note_here(
-                                event, events_this_measure, verbose
-                            )
-                            if test:
-                                events_this_measure.append(event)
-                            else:
-                                verbose and print(
-                                    "Note insertion: Oops theres already a note here",
+                            test = events_this_measure.insert(event, verbose)
+                            if not test:
+                                verbose and _LOGGER.debug(
+                                    "Note insertion: Oops theres already a note here %s %s %s",
                                     m,
                                     beat_start,
                                     instrument_prefix,
@@ -302,25 +375,17 @@ def guitarpro2tokens(song, artist, verbose=False, note_tuning=False):
                     elif beat.status.name == "rest":
                         # print(beat.status.name)
                         # a rest
-                        event = {
-                            "type": "rest",
-                            "track": t,
-                            "duration": beat_duration,
-                            "instrument_prefix": instrument_prefix,
-                            "start": beat_start,
-                        }
+                        event = EncoderEvent(
+                            "rest", t, beat_start, beat_duration, instrument_prefix
+                        )
                         # Test if there's already a note/rest in this spot
                         # This may happen when combining tracks into one track
                         # Or if the generator is so dumb that it puts two notes on the same string
                         # print("rest",event)
-                        test = oops_theres_a_note_here(
-                            event, events_this_measure, verbose
-                        )
-                        if test:
-                            events_this_measure.append(event)
-                        else:
-                            verbose and print(
-                                "Rest insertion: Oops theres already a note here",
+                        test = events_this_measure.insert(event, verbose)
+                        if not test:
+                            verbose and _LOGGER.debug(
+                                "Rest insertion: Oops theres already a note here %s %s %s",
                                 m,
                                 beat_start,
                                 instrument_prefix,
@@ -328,160 +393,272 @@ def guitarpro2tokens(song, artist, verbose=False, note_tuning=False):
                     ## Beat Effects come after the notes/rests
                     beatfx = beat_effect_list(beat.effect)
                     if len(beatfx):
-                        event = {
-                            "type": "beatfx",
-                            "effects": beatfx,
-                            "duration": beat_duration,
-                            "instrument_prefix": instrument_prefix,
-                            "start": beat_start,
-                            "track": t,
-                        }
-                        # Test if there's already a beatfx in this spot that conflicts (contradicting value)
-                        # This may happen when combining tracks into one track
-                        # Or if the generator is too dumb and puts two opposing beatfx's on same the same beat
-                        test = oops_theres_a_conflicting_beatfx(
-                            event, events_this_measure
+                        event = EncoderEvent(
+                            "beatfx",
+                            t,
+                            beat_start,
+                            beat_duration,
+                            instrument_prefix,
+                            effects=beatfx,
                         )
-                        if test:
-                            verbose and print(
-                                "Oops theres already a beatfx here",
-                                m,
-                                beat_start,
-                                instrument_prefix,
-                            )
-                        else:
-                            # Add the BeatFX event
-                            events_this_measure.append(event)
                         # Check if this was an empty measure. An empty measure with a beatfx should get a rest.
                         # This will happen in the case of a tempo change on an empty measure
+                        # (the rest goes in before the beatfx, to keep the voice's events in order)
                         if beat.status.name == "empty":
-                            event = {
-                                "type": "rest",
-                                "track": t,
-                                "duration": beat_duration,
-                                "instrument_prefix": instrument_prefix,
-                                "start": beat_start,
-                            }
+                            rest_event = EncoderEvent(
+                                "rest", t, beat_start, beat_duration, instrument_prefix
+                            )
                             # Test if there's already a note/rest in this spot
                             # This may happen when combining tracks into one track
                             # Or if the generator is so dumb that it puts two notes on the same string
                             # print("rest",event)
-                            test = oops_theres_a_note_here(
-                                event, events_this_measure, verbose
-                            )
-                            if test:
-                                # Add the "fake" rest which the beat effect attaches to
-                                events_this_measure.append(event)
-                            else:
-                                verbose and print(
-                                    "Rest insertion: Oops theres already a note here",
+                            # Add the "fake" rest which the beat effect attaches to
+                            test = events_this_measure.insert(rest_event, verbose)
+                            if not test:
+                                verbose and _LOGGER.debug(
+                                    "Rest insertion: Oops theres already a note here %s %s %s",
                                     m,
                                     beat_start,
                                     instrument_prefix,
                                 )
-        events_all.extend(events_this_measure)
-
-    verbose and print("=========\nFirst 5 events:")
-    verbose and print(events_all[:5])
-
-    #############################################
-    ## CONVERT LIST OF EVENTS INTO LIST OF BODY TOKENS
-
-    # body_tokens remove start/durations from notes/rests and introduce waits between them
-    # also note_effects immediately proceed their notes
-    body_tokens = []
-    t = 0
-
-    # sort by start time
-    # Measure tokens first
-    # Then note/rest/notefx/beatfx tokens sorted by track number
-    # Notefx tokens come right after note tokens
-    # Beatfx tokens come right after all note/notefx tokens for that beat
-    events_sorted = sorted(
-        events_all,
-        key=lambda x: (
-            x["start"] * 1000 + x["track"] * 10 + int(x["type"] == "beatfx")
-        ),
-    )
-    for e in events_sorted:
-        e = e.copy()
-
-        # test if we moved ahead in time. Whether it's a new measure/note/rest anything. If so, emit a wait token
-        if e["start"] > t:
-            if t > 0:
-                # ignore the first wait
-                # yes. calculate how much time we advanced
-                wait_time = e["start"] - t
-                # append the WAIT token for amount of time advancement
-                body_tokens.append("wait:%s" % wait_time)
-                # remember old start value
-            t = e["start"]
-        if e["type"] == "measure":
-            # w_events.append(e)
-            # since the first measure start on beat 1 (960 ticks), this also removes the unnecesary wait960
-            t = e["start"]
-            body_tokens.extend(e["tokens"])
-        if e["type"] == "note" or e["type"] == "rest":
-            effects = []
-            if e["type"] == "note":
-                tuning_for_string = strings[
-                    e["string"] - 1
-                ]  # Assuming 1-based index                # note has effects. append them after the note
-                effects = e["effects"]
-                # del e["start"]
-                del e["effects"]
-                # append the NOTE  token
+                        # Note: oops_theres_a_conflicting_beatfx used to be called here, but it compares
+                        # the event type to ["beatfx"] (a list) so it never finds a conflict and every beatfx is kept.
+                        # We keep that behaviour and skip the scan over the whole measure.
+                        # Add the BeatFX event
+                        events_this_measure.append(event)
+        if m == first_measure:
+            verbose and _LOGGER.debug(
+                "First 5 events: %s", events_this_measure.events_in_order()[:5]
+            )
+
+        #############################################
+        ## PUT THIS MEASURE'S EVENTS IN TOKEN ORDER
+
+        # merge the streams by start time
+        # Measure tokens first
+        # Then note/rest/notefx/beatfx tokens sorted by track number
+        # Notefx tokens come right after note tokens
+        # Beatfx tokens come right after all note/notefx tokens for that beat
+        # Each stream is already in this order, and merge keeps equal events in stream order
+        # (like a stable sort would)
+        ready = heapq.merge(
+            pending, *events_this_measure.streams_in_order(), key=event_order_key
+        )
+        if m < last_measure - 1:
+            next_start = measures[m + 1].start
+        else:
+            next_start = None
+        pending = []
+        events = []
+        for event in ready:
+            if next_start is not None and event.start >= next_start:
+                # this belongs after the next measure's tokens
+                pending.append(event)
+            else:
+                events.append(event)
+        if m >= first_measure:
+            yield events
+
+
+# Converts the events of each measure into body tokens.
+# Body tokens remove start/durations from notes/rests and introduce waits between them,
+# also note_effects immediately proceed their notes.
+# The clock and the last event are kept from one measure to the next.
+# - note_tuning: append the tuning of the string to note tokens (strings: tuning of strings 1..n)
+# - prefixes: instrument prefix of each track to write (track index -> prefix), None writes every track
+# - fret_offsets: added to the frets of each track (track index -> offset), None leaves the frets as they are
+class BodyTokenWriter:
+    def __init__(self, note_tuning, strings, prefixes=None, fret_offsets=None):
+        self.note_tuning = note_tuning
+        self.strings = strings
+        self.prefixes = prefixes
+        self.fret_offsets = fret_offsets
+        self.clock = 0
+        self.e = None  # the last event that was converted to tokens
+
+    def measure_tokens(self, events):
+        note_tuning = self.note_tuning
+        strings = self.strings
+        prefixes = self.prefixes
+        fret_offsets = self.fret_offsets
+        clock = self.clock
+        e = self.e
+        body_tokens = []
+        for event in events:
+            if prefixes is None:
+                instrument_prefix = event.instrument_prefix
+            elif event.track in prefixes:
+                instrument_prefix = prefixes[event.track]
+            elif event.type == "measure":
+                instrument_prefix = None
+            else:
+                # this track is left out
+                continue
+            # (events are read as they are, they are not copied or modified)
+            e = event
+
+            # test if we moved ahead in time. Whether it's a new measure/note/rest anything. If so, emit a wait token
+            if e.start > clock:
+                if clock > 0:
+                    # ignore the first wait
+                    # yes. calculate how much time we advanced
+                    wait_time = e.start - clock
+                    # append the WAIT token for amount of time advancement
+                    body_tokens.append("wait:%s" % wait_time)
+                    # remember old start value
+                clock = e.start
+            if e.type == "measure":
                 # w_events.append(e)
-                note_token = (
-                    f"{e['instrument_prefix']}:note:s{e['string']}:f{e['fret']}"
-                )
-                if note_tuning:
-                    note_token += f":{tuning_for_string}"
-                body_tokens.append(note_token)
-                # body_tokens.append(
-                #     f"{e['instrument_prefix']}:note:s{e['string']}:f{e['fret']}:{tuning_for_string}"
-                # )
-
-                if len(effects) > 0:
-                    # append the NOTE EFFECTS
-                    body_tokens.extend(effects)
+                # since the first measure start on beat 1 (960 ticks), this also removes the unnecesary wait960
+                clock = e.start
+                body_tokens.extend(e.tokens)
+            if e.type == "note" or e.type == "rest":
+                effects = []
+                if e.type == "note":
+                    tuning_for_string = strings[
+                        e.string - 1
+                    ]  # Assuming 1-based index                # note has effects. append them after the note
+                    effects = e.effects
+                    # append the NOTE  token
+                    # w_events.append(e)
+                    fret = e.fret
+                    if fret_offsets is not None:
+                        fret += fret_offsets[e.track]
+                    note_token = f"{instrument_prefix}:note:s{e.string}:f{fret}"
+                    if note_tuning:
+                        note_token += f":{tuning_for_string}"
+                    body_tokens.append(note_token)
+                    # body_tokens.append(
+                    #     f"{e['instrument_prefix']}:note:s{e['string']}:f{e['fret']}:{tuning_for_string}"
+                    # )
+
+                    if len(effects) > 0:
+                        # append the NOTE EFFECTS
+                        body_tokens.extend(effects)
+                        pass
+                elif e.type == "rest":
+                    # append the REST
+                    # w_events.append(e)
+                    body_tokens.append("%s:rest" % (instrument_prefix))
                     pass
-            elif e["type"] == "rest":
-                # append the REST
+            if e.type == "beatfx":
+                # append the BEAT EFFECTS after the notes/rests of that beat
                 # w_events.append(e)
-                body_tokens.append("%s:rest" % (e["instrument_prefix"]))
+                body_tokens.extend(e.effects)
                 pass
-        if e["type"] == "beatfx":
-            # append the BEAT EFFECTS after the notes/rests of that beat
-            # w_events.append(e)
-            body_tokens.extend(e["effects"])
-            pass
-    # If the last event has duration information, this becomes the last "wait" token
-    if "duration" in e:
-        body_tokens.append("wait:%s" % e["duration"])
-
-    # DadaGP v1.1 begin ===>
-    # Split some rare tokens into many tokens
-    body_tokens_v1_1 = []
-    for token in body_tokens:
-        body_tokens_v1_1.extend(split_rare_token(token))
-    # <=== DadaGP 1.1 end
-
-    end_tokens = ["end"]
-    all_tokens = head_tokens + body_tokens_v1_1 + end_tokens
-    verbose and print("=========\nFirst 20 tokens:")
-    verbose and print(all_tokens[:20])
-    verbose and print("=========\nTotal tokens:", len(all_tokens))
+
+        self.clock = clock
+        self.e = e
+
+        # DadaGP v1.1 begin ===>
+        # Split some rare tokens into many tokens
+        return split_tokens(body_tokens)
+        # <=== DadaGP 1.1 end
+
+    # The tokens after the last measure
+    def end_tokens(self):
+        tokens = []
+        # If the last event has duration information, this becomes the last "wait" token
+        if self.e is not None and self.e.duration is not None:
+            tokens.extend(split_rare_token("wait:%s" % self.e.duration))
+        tokens.append("end")
+        return tokens
+
+
+# Takes a GP file, yields its tokens one measure at a time
+# Only the events of the current measure are held in memory
+# start_measure/end_measure: only encode measures[start_measure:end_measure] (0-based, end excluded)
+def iter_tokens(
+    song,
+    artist,
+    verbose=False,
+    note_tuning=False,
+    start_measure=None,
+    end_measure=None,
+):
+    setup = prepare_song(song, verbose, start_measure, end_measure)
+    strings = setup.strings
+
+    head_tokens = get_head_tokens(
+        artist, setup.pitch_shift, setup.tempo, strings, note_tuning
+    )
+
+    tunings = ["Order of strings: (1,2,3,4,5,6)"]
+
+    scientific_pitch_tuning = f"spn_tuning:{strings}"
+    tunings.append(scientific_pitch_tuning)
+
+    common_tuning = f"tuning:{convert_spn_to_common(strings)}"
+    tunings.append(common_tuning)
+
+    verbose and _LOGGER.debug("Head tokens: %s, %s", head_tokens, tunings)
+    yield from head_tokens
+
+    writer = BodyTokenWriter(note_tuning, strings)
+    for events in iter_measure_events(song, setup, verbose):
+        yield from writer.measure_tokens(events)
+    yield from writer.end_tokens()
+
+
+# Takes a GP file, converts to token format
+def guitarpro2tokens(
+    song, artist, verbose=False, note_tuning=False, start_measure=None, end_measure=None
+):
+    all_tokens = list(
+        iter_tokens(song, artist, verbose, note_tuning, start_measure, end_measure)
+    )
+    verbose and _LOGGER.debug("First 20 tokens: %s", all_tokens[:20])
+    verbose and _LOGGER.debug("Total tokens: %s", len(all_tokens))
     return all_tokens
 
 
+# Takes a GP file, converts to token ids of `vocab` (an array('H'), see Vocabulary.encode)
+def guitarpro2ids(song, vocab, artist, note_tuning=False, as_numpy=False):
+    return vocab.encode(iter_tokens(song, artist, False, note_tuning), as_numpy)
+
+
 def asdadagp_encode(
-    input_file, output_file, note_tuning: bool = False, artist_token: str = "Unknown"
+    input_file,
+    output_file,
+    note_tuning: bool = False,
+    artist_token: str = "Unknown",
+    cache: Union[None, str, EncodeCache] = None,
+    verbose: bool = False,
+    start_measure: Optional[int] = None,
+    end_measure: Optional[int] = None,
 ):
-    song = gp.parse(input_file)
+    # cache: an EncodeCache, or a cache directory. Unchanged files are copied from the cache instead of re-encoded
+    if cache is not None:
+        if isinstance(cache, str):
+            cache = open_cache(cache)
+        with open(input_file, "rb") as f:
+            gp_bytes = f.read()
+        key = cache_key(gp_bytes, note_tuning, artist_token, start_measure, end_measure)
+        if cache.get(key, output_file):
+            return
+        song = gp.parse(io.BytesIO(gp_bytes))
+    else:
+        song = gp.parse(input_file)
     # Convert the song to tokens
-    tokens = guitarpro2tokens(song, artist_token, verbose=True, note_tuning=note_tuning)
-    # Write the tokens to text file
-    f = open(output_file, "w")
-    f.write("\n".join(tokens))
-    f.close()
+    tokens = iter_tokens(
+        song,
+        artist_token,
+        verbose=verbose,
+        note_tuning=note_tuning,
+        start_measure=start_measure,
+        end_measure=end_measure,
+    )
+    # The head is checked before the first token comes out, so a bad song doesn't leave a file behind
+    first_token = next(tokens)
+    # Write the tokens to text file as they are produced
+    try:
+        with open(output_file, "w") as f:
+            f.write(first_token)
+            f.writelines("\n" + token for token in tokens)
+    except BaseException:
+        # don't leave a half written token file
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        raise
+    if cache is not None:
+        cache.put(key, output_file)
@@ -0,0 +1,226 @@
+import logging
+import struct
+from itertools import islice
+from typing import Dict, List, Tuple, Union
+
+from .decoder import (
+    note_string_tunings,
+    read_head,
+    read_measures,
+    split_head,
+    string_fret_offsets,
+    track_strings,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# the decoder's clock, 960 ticks per quarter note, is used as the MIDI time division
+TICKS_PER_QUARTER = 960
+# the clock of the first measure
+START_CLOCK = 960
+
+# General MIDI programs (0-indexed) of the decoded tracks, the same as the Guitar Pro tracks
+PROGRAMS = {"clean0": 27, "clean1": 26}  # Electric Guitar (clean), (jazz)
+
+DEFAULT_VELOCITY = 95
+NFX_VELOCITIES = {
+    "nfx:ghost_note": 64,
+    "nfx:accentuated_note": 110,
+    "nfx:heavy_accentuated_note": 127,
+}
+
+
+def _var_len(value: int) -> bytes:
+    # MIDI variable-length quantity, 7 bits per byte, most significant first
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(out))
+
+
+def _track_chunk(events: List[Tuple[int, int, bytes]]) -> bytes:
+    # events are (tick, order, message), order puts note offs before note ons at the same tick
+    events.sort(key=lambda e: (e[0], e[1]))
+    data = bytearray()
+    last_tick = 0
+    for tick, _, message in events:
+        # negative waits could move notes before the start
+        tick = max(tick, 0)
+        data += _var_len(tick - last_tick)
+        data += message
+        last_tick = tick
+    data += b"\x00\xff\x2f\x00"  # end of track
+    return b"MTrk" + struct.pack(">I", len(data)) + bytes(data)
+
+
+def _meta(kind: int, payload: bytes) -> bytes:
+    return bytes([0xFF, kind]) + _var_len(len(payload)) + payload
+
+
+def tokens2notes(
+    all_tokens: List[str], verbose: bool = False, tunings: Union[None, List[str]] = None
+) -> Tuple[List[Tuple[int, int]], Dict[str, List[List[int]]]]:
+    """
+    Computes the tempo changes and the notes that tokens play, without building a song.
+
+    Uses the decoder's measures (see `read_measures`): a beat lasts until the next beat of its
+    instrument in the measure, or the end of the measure.
+    Dead notes are left out, tied notes extend the note they are tied to.
+
+    :param all_tokens: tokens as given to `tokens2guitarpro`
+    :param verbose: log debug information
+    :param tunings: overrides the string tunings of the tokens, E standard if they have none
+    :return: a tuple of
+        - the (tick, bpm) tempo changes, starting with the head's tempo at tick 0
+        - the [start tick, end tick, pitch, velocity] notes of each instrument with notes
+    """
+    head, head_tunings, body_start = split_head(all_tokens)
+    _, pitch_shift, initial_tempo = read_head(head)
+    (
+        all_measures,
+        final_clock,
+        instrument_check,
+        instrument_stringinfo,
+        note_tunings,
+    ) = read_measures(islice(all_tokens, body_start, None), verbose)
+    if not tunings:
+        tunings = head_tunings or note_string_tunings(note_tunings, pitch_shift)
+    tempos = [(0, initial_tempo)]
+    notes = {}
+    strings = {}
+    string_maps = {}
+    for instrument, present in instrument_check.items():
+        if present:
+            notes[instrument] = []
+            string_maps[instrument] = string_fret_offsets(
+                instrument, instrument_stringinfo[instrument]
+            )
+            strings[instrument] = [
+                s.value
+                for s in track_strings(
+                    instrument_stringinfo[instrument], tunings, pitch_shift
+                )
+            ]
+
+    # the last note of each (instrument, string), for ties
+    ringing = {}
+    for m, measure in enumerate(all_measures):
+        if m < len(all_measures) - 1:
+            end_measure_clock = all_measures[m + 1]["clock"]
+        else:
+            end_measure_clock = final_clock
+        for instrument, beats in measure["trackbeats"].items():
+            if instrument not in notes:
+                # only rests
+                continue
+            clocks = list(beats.keys())
+            for b, clock in enumerate(clocks):
+                end = clocks[b + 1] if b < len(clocks) - 1 else end_measure_clock
+                if end <= clock:
+                    # zero duration beats are dropped by the decoder too
+                    continue
+                beat = beats[clock]
+                for bfx in beat["bfx"]:
+                    t = bfx["token"].split(":")
+                    if t[1] == "tempo_change" and len(t) > 2:
+                        tempos.append((clock - START_CLOCK, int(t[2])))
+
+                string_map = string_maps[instrument]
+                # bit s is set once a note is on string s
+                occupied = 0
+                for note in beat["notes"]:
+                    record = note["record"]
+                    if record.kind != "note":
+                        continue
+                    string = record.string
+                    fret = record.fret
+                    # if this is on a drop string the fret value has to be +2
+                    if 0 <= string < len(string_map):
+                        string, offset = string_map[string]
+                        fret += offset
+                    bit = 1 << string if string >= 0 else 0
+                    if occupied & bit:
+                        # note already on string. ignore this note
+                        continue
+                    occupied |= bit
+                    nfx = [effect["token"] for effect in note["nfx"]]
+                    if "nfx:dead" in nfx:
+                        continue
+                    previous = ringing.get((instrument, string))
+                    if "nfx:tie" in nfx and previous is not None:
+                        previous[1] = end - START_CLOCK
+                        continue
+                    if not 1 <= string <= len(strings[instrument]):
+                        _LOGGER.warning(
+                            "Measure %s: %s has no string %s", m, instrument, string
+                        )
+                        continue
+                    pitch = strings[instrument][string - 1] + fret
+                    if not 0 <= pitch <= 127:
+                        _LOGGER.warning("Measure %s: pitch %s out of range", m, pitch)
+                        continue
+                    velocity = DEFAULT_VELOCITY
+                    for effect in nfx:
+                        velocity = NFX_VELOCITIES.get(effect, velocity)
+                    new_note = [clock - START_CLOCK, end - START_CLOCK, pitch, velocity]
+                    notes[instrument].append(new_note)
+                    ringing[(instrument, string)] = new_note
+
+    verbose and _LOGGER.debug(
+        "Notes: %s, tempo changes: %s",
+        {instrument: len(n) for instrument, n in notes.items()},
+        len(tempos) - 1,
+    )
+    return tempos, notes
+
+
+def tokens2midi(
+    all_tokens: List[str], verbose: bool = False, tunings: Union[None, List[str]] = None
+) -> bytes:
+    """
+    Converts tokens to a Standard MIDI File (format 1), without building a Guitar Pro song.
+
+    The first MIDI track holds the tempo changes, then one track per instrument on its own channel.
+
+    :param all_tokens: tokens as given to `tokens2guitarpro`
+    :param verbose: log debug information
+    :param tunings: overrides the string tunings of the tokens, E standard if they have none
+    :return: the bytes of the .mid file
+    """
+    tempos, notes = tokens2notes(all_tokens, verbose, tunings)
+
+    tempo_events = []
+    for tick, bpm in tempos:
+        # the tempo meta event holds 3 bytes, slower tempos are clamped
+        microseconds = min(60000000 // max(bpm, 1), 0xFFFFFF)
+        tempo_events.append((tick, 0, _meta(0x51, microseconds.to_bytes(3, "big"))))
+    chunks = [_track_chunk(tempo_events)]
+
+    for channel, (instrument, instrument_notes) in enumerate(notes.items()):
+        events = [
+            (0, 0, _meta(0x03, instrument.encode("ascii"))),
+            (0, 1, bytes([0xC0 | channel, PROGRAMS.get(instrument, 25)])),
+        ]
+        # (tick, order, pitch, velocity) of the note ons (3) and offs (2)
+        changes = []
+        for start, end, pitch, velocity in instrument_notes:
+            changes.append((start, 3, pitch, velocity))
+            changes.append((end, 2, pitch, 0))
+        changes.sort()
+        # notes of the same pitch (on different strings) can overlap, the note off is only sent
+        # when the last of them ends so it doesn't cut the others short
+        sounding = {}
+        for tick, order, pitch, velocity in changes:
+            if order == 3:
+                sounding[pitch] = sounding.get(pitch, 0) + 1
+                events.append((tick, 3, bytes([0x90 | channel, pitch, velocity])))
+            else:
+                sounding[pitch] -= 1
+                if not sounding[pitch]:
+                    events.append((tick, 2, bytes([0x80 | channel, pitch, 0])))
+        chunks.append(_track_chunk(events))
+
+    header = b"MThd" + struct.pack(">IHHH", 6, 1, len(chunks), TICKS_PER_QUARTER)
+    return header + b"".join(chunks)
@@ -1,18 +1,79 @@
 import logging
 import re
+import sys
+from array import array
+from collections import abc
 from dataclasses import dataclass
-from typing import List, Tuple, Union
+from typing import Dict, List, Sequence, Tuple, Union
+
+import guitarpro as gp
 
 _LOGGER = logging.getLogger(__name__)
 
+# MIDI numbers of E standard ("E4", "B3", "G3", "D3", "A2", "E2"), before the downtune
+E_STANDARD = (64, 59, 55, 50, 45, 40)
+
+
+class MeasureView(abc.Sequence):
+    """
+    The tokens[start:end] of a token list, without copying them.
+
+    It compares equal to a list of the same tokens, slicing it gives another view.
+    """
+
+    __slots__ = ("source", "start", "end")
+
+    def __init__(self, source: Sequence, start: int, end: int):
+        self.source = source
+        self.start = start
+        self.end = end
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.end - self.start)
+            if step == 1:
+                return MeasureView(
+                    self.source, self.start + start, self.start + max(start, stop)
+                )
+            return [self.source[self.start + i] for i in range(start, stop, step)]
+        if index < 0:
+            index += self.end - self.start
+        if not 0 <= index < self.end - self.start:
+            raise IndexError("measure index out of range")
+        return self.source[self.start + index]
+
+    def __iter__(self):
+        source = self.source
+        for i in range(self.start, self.end):
+            yield source[i]
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, abc.Sequence) or isinstance(other, str):
+            return NotImplemented
+        return len(other) == self.end - self.start and all(
+            x == y for x, y in zip(self, other)
+        )
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return "MeasureView(%r)" % list(self)
+
 
 @dataclass
 class TokenMeasure:
     """
     Represents the information stored in a measure.
+
+    The tokens are usually a MeasureView of the token list the measure was read from.
     """
 
-    tokens: List[str]
+    __slots__ = ("tokens", "repeat_open", "repeat_close", "repeat_alternative")
+
+    tokens: Sequence[str]
     repeat_open: bool  # whether a repeat starts from this measure
     repeat_close: bool  # whether a repeat ends at this measure
     repeat_alternative: bool  # whether a repeat alternative starts from this measure
@@ -55,7 +116,7 @@ def measures_playing_order(
     :param tokens: return measure tokens instead of indices
 
     :return: a list of indices of measures in the playing order,
-        or a list of lists of tokens if `tokens` is True.
+        or a list of the measures' tokens (see `TokenMeasure`) if `tokens` is True.
     """
 
     opens, closes, alternatives = repeat_related_measure_indices(measures)
@@ -181,80 +242,295 @@ def split_tokens_to_measures(tokens: List[str]) -> List[List[str]]:
     return result
 
 
+# repeat flags of MeasureIndex
+REPEAT_OPEN = 1
+REPEAT_CLOSE = 2
+REPEAT_ALTERNATIVE = 4
+
+
+def _measure_token_flag(token: str) -> int:
+    if token == "measure:repeat_open":
+        return REPEAT_OPEN
+    if token.startswith("measure:repeat_close"):
+        return REPEAT_CLOSE
+    if token.startswith("measure:repeat_alternative"):
+        return REPEAT_ALTERNATIVE
+    return 0
+
+
+class MeasureIndex(abc.Sequence):
+    """
+    The position of each measure in a token list, see `index_measures`.
+
+    Item i is a TokenMeasure of measure i, made when it is accessed, whose tokens are a MeasureView
+    of the token list. Only a measure with "measure:" tokens after its first note (which the
+    encoder never writes) has its tokens copied.
+    """
+
+    __slots__ = ("tokens", "offsets", "flags", "copies")
+
+    def __init__(
+        self,
+        tokens: Sequence,
+        offsets: array,
+        flags: bytearray,
+        copies: Dict[int, List[str]],
+    ):
+        self.tokens = tokens
+        # start and end of the tokens of measure i at 2 * i and 2 * i + 1
+        self.offsets = offsets
+        # REPEAT_OPEN | REPEAT_CLOSE | REPEAT_ALTERNATIVE of each measure
+        self.flags = flags
+        # the tokens of the measures that aren't contiguous
+        self.copies = copies
+
+    def __len__(self) -> int:
+        return len(self.flags)
+
+    def measure_tokens(self, i: int) -> Sequence[str]:
+        """The tokens of measure i, without its "measure:" tokens."""
+        if i in self.copies:
+            return self.copies[i]
+        return MeasureView(self.tokens, self.offsets[2 * i], self.offsets[2 * i + 1])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("measure index out of range")
+        flag = self.flags[index]
+        return TokenMeasure(
+            self.measure_tokens(index),
+            bool(flag & REPEAT_OPEN),
+            bool(flag & REPEAT_CLOSE),
+            bool(flag & REPEAT_ALTERNATIVE),
+        )
+
+
+def index_measures(tokens: Sequence) -> MeasureIndex:
+    """
+    Finds the measures of a token list, like `tokens_to_measures`, without copying any token.
+
+    :param tokens: List of tokens from a tab (or a TokenDocument), the last token may be "end".
+    :return: the measure index, a sequence of TokenMeasure
+    """
+    n = len(tokens)
+    # the last token is "end"
+    if n and tokens[n - 1] == "end":
+        n -= 1
+    bounds = []
+    i = -1
+    while True:
+        try:
+            i = tokens.index("new_measure", i + 1, n)
+        except ValueError:
+            break
+        bounds.append(i)
+    bounds.append(n)
+
+    offsets = array("q")
+    flags = bytearray()
+    copies = {}
+    # The first group of tokens is the header
+    header_seen = False
+    start = 0
+    for end in bounds:
+        if end > start:
+            if not header_seen:
+                header_seen = True
+            else:
+                # measure tokens come first, then the music tokens
+                flag = 0
+                music_start = start
+                while music_start < end and tokens[music_start].startswith("measure:"):
+                    flag |= _measure_token_flag(tokens[music_start])
+                    music_start += 1
+                late = [
+                    j
+                    for j in range(music_start, end)
+                    if tokens[j].startswith("measure:")
+                ]
+                if late:
+                    for j in late:
+                        flag |= _measure_token_flag(tokens[j])
+                    copies[len(flags)] = [
+                        tokens[j]
+                        for j in range(music_start, end)
+                        if not tokens[j].startswith("measure:")
+                    ]
+                offsets.append(music_start)
+                offsets.append(end)
+                flags.append(flag)
+        # skip the "new_measure" token
+        start = end + 1
+    return MeasureIndex(tokens, offsets, flags, copies)
+
+
 def tokens_to_measures(tokens: List[str]) -> List[TokenMeasure]:
     """
     Converts a list of tokens into a list of TokenMeasure objects, each representing a measure.
 
-    :param tokens:
-    :type tokens:
-    :return:
+    The tokens of each measure are a MeasureView of `tokens` (see `index_measures`), they aren't copied.
+
     :param tokens: List of strings representing musical tokens from a tab, including measure headers (e.g., "measure:repeat_open") and musical notation tokens. The last token may be "end".
     :type tokens: List[str]
     :return: List of TokenMeasure objects, each representing a measure.
     :rtype: List[TokenMeasure]
     """
-    result = []
-    # the last token is "end"
-    if tokens[-1] == "end":
-        tokens = tokens[:-1]
-    token_measures = split_tokens_to_measures(tokens)
-    for i, measure in enumerate(token_measures):
-        # The first is the header
-        if i == 0:
-            continue
-
-        measure_headers = [t for t in measure if t.startswith("measure:")]
-        mus_tokens = [t for t in measure if not t.startswith("measure:")]
-
-        repeat_open = False
-        repeat_close = False
-        repeat_alt = False
-
-        for header in measure_headers:
-            if header == "measure:repeat_open":
-                repeat_open = True
-            if header.startswith("measure:repeat_close"):
-                repeat_close = True
-            if header.startswith("measure:repeat_alternative"):
-                repeat_alt = True
-
-        result.append(TokenMeasure(mus_tokens, repeat_open, repeat_close, repeat_alt))
+    return list(index_measures(tokens))
 
-    return result
 
+@dataclass(frozen=True)
+class TokenHeader:
+    """
+    The head of a token list, see `read_token_header`.
+    """
+
+    artist: str
+    downtune: int
+    tempo: int
+    tunings: Tuple[str, ...]  # of strings 1 to 6
+    body_start: int  # index of the first token after "start"
+    note_tuning: bool  # whether the note tokens end with their string's tuning
 
-def get_string_tunings(tokens: List[str]) -> List[str]:
+
+def _note_string_tuning(token: str) -> Union[None, Tuple[int, str]]:
+    # (string, tuning) of a note token with a tuning, e.g. "clean0:note:s2:f3:B3" or "note:s2:f3:B3"
+    fields = token.split(":")
+    i = 0 if fields[0] == "note" else 1
+    if len(fields) < i + 4 or fields[i] != "note":
+        return None
+    return int(fields[i + 1][1:]), fields[-1]
+
+
+def complete_string_tunings(string_tunings: Dict[int, str], downtune: int) -> List[str]:
     """
-    Extracts string tunings from the provided tokens.
+    The tunings of strings 1 to 6 from the tunings found in note tokens.
 
-    :param tokens: List of tokens from which to extract string tunings.
-    :return: tuning of the song / tab
+    Strings without any note get their E standard tuning, downtuned like the song, and a warning
+    is logged.
+
+    :param string_tunings: the tuning of each string that has a note, e.g. {1: "D4", 6: "D2"}
+    :param downtune: the downtune of the head
+    :return: the 6 string tunings, e.g. ["D4", "A3", "F3", "C3", "G2", "D2"]
+    """
+    tunings = []
+    for string in range(1, 7):
+        if string in string_tunings:
+            tunings.append(string_tunings[string])
+        else:
+            tunings.append(
+                str(gp.GuitarString(string, E_STANDARD[string - 1] + downtune))
+            )
+            _LOGGER.warning(
+                "No note on string %s, its tuning is set to %s", string, tunings[-1]
+            )
+    return tunings
+
+
+def read_token_header(tokens: List[str]) -> TokenHeader:
     """
-    if tokens[9] == "start":
+    Reads the head of a token list: artist, downtune, tempo, the string tunings and "start".
+
+    When the tunings are in the note tokens, the body is scanned only until a note has been seen on
+    each of the 6 strings. A string keeps the tuning of its first note, like the decoder's
+    `MeasureReader`. Strings without any note get their E standard tuning, downtuned like the
+    song, and a warning is logged.
+
+    :param tokens: List of tokens from the tab, as written by the encoder or by `tracks_check`.
+    :return: the parsed header
+    """
+    if len(tokens) > 9 and tokens[9] == "start":
+        body_start = 10
         note_tuning = False
-    elif tokens[3] == "start":
+    elif len(tokens) > 3 and tokens[3] == "start":
+        body_start = 4
         note_tuning = True
     else:
-        note_tuning = True
-        _LOGGER.warning("'start' token not found in expected positions.")
-
-    if note_tuning:
-        string_tuning_dict = {}
-        while len(string_tuning_dict) < 6:
-            for token in tokens:
-                if (token.startswith("clean") and "note" in token) or token.startswith(
-                    "note"
+        raise ValueError("'start' token not found at index 3 or 9.")
+    downtune = int(tokens[1].split(":")[1])
+    tempo = int(tokens[2].split(":")[1])
+
+    if not note_tuning:
+        # the 6 tokens before "start" are the string tunings
+        return TokenHeader(
+            tokens[0], downtune, tempo, tuple(tokens[3:9]), body_start, note_tuning
+        )
+
+    string_tuning_dict = {}
+    for i in range(body_start, len(tokens)):
+        token = tokens[i]
+        if token.startswith("note") or (token.startswith("clean") and "note" in token):
+            string_tuning = _note_string_tuning(token)
+            if string_tuning is not None:
+                string_tuning_dict.setdefault(*string_tuning)
+                if len(string_tuning_dict) >= 6 and all(
+                    s in string_tuning_dict for s in range(1, 7)
                 ):
-                    start = token.index("note") + len("note")
-                    guitar_string = int(token[start + 2])
-                    tuning = token.split(":")[-1]
-                    string_tuning_dict[guitar_string] = tuning
+                    break
+    tunings = complete_string_tunings(string_tuning_dict, downtune)
+    return TokenHeader(
+        tokens[0], downtune, tempo, tuple(tunings), body_start, note_tuning
+    )
 
-        return [string_tuning_dict[i] for i in range(1, 7)]
-    else:
-        return tokens[
-            3:9
-        ]  # Assuming the first 6 tokens after "start" are the string tunings
+
+class TokenDocument(abc.Sequence):
+    """
+    A token list with its header read once.
+
+    It is a sequence of the tokens, so it can be given to every function that takes tokens, and
+    the functions that need the header (`get_string_tunings`, `pre_decoding_processing`) reuse
+    the one read the first time.
+    """
+
+    __slots__ = ("tokens", "_header")
+
+    def __init__(self, tokens: List[str]):
+        self.tokens = tokens
+        self._header = None
+
+    @classmethod
+    def from_file(cls, path: str) -> "TokenDocument":
+        """Reads a token file, one token per line."""
+        with open(path, "r") as f:
+            return cls(f.read().split("\n"))
+
+    @property
+    def header(self) -> TokenHeader:
+        if self._header is None:
+            self._header = read_token_header(self.tokens)
+        return self._header
+
+    def __getitem__(self, index):
+        return self.tokens[index]
+
+    def __len__(self) -> int:
+        return len(self.tokens)
+
+    def __iter__(self):
+        return iter(self.tokens)
+
+    def index(self, value, start: int = 0, stop: int = sys.maxsize) -> int:
+        return self.tokens.index(value, start, stop)
+
+
+def token_header(tokens: Union[List[str], TokenDocument]) -> TokenHeader:
+    """The header of a token list, the cached one of a TokenDocument."""
+    if isinstance(tokens, TokenDocument):
+        return tokens.header
+    return read_token_header(tokens)
+
+
+def get_string_tunings(tokens: Union[List[str], TokenDocument]) -> List[str]:
+    """
+    Extracts string tunings from the provided tokens.
+
+    :param tokens: List of tokens from which to extract string tunings, or a TokenDocument.
+    :return: tuning of the song / tab
+    """
+    return list(token_header(tokens).tunings)
 
 
 def merge_tracks_and_prune(notes: List[str]) -> List[str]:
@@ -279,6 +555,7 @@ def sort_notes(pruned_notes: List[str]) -> List[str]:
     :param pruned_notes: List of notes that have been pruned of the "cleanX:" prefix.
     :return: List of notes sorted by the "s<number>:" prefix.
     """
+
     # Define a key function for sorting based on "s<number>:" in the token.
     def extract_s_number(s):
         match = re.search(r"s(\d+):", s)
@@ -330,29 +607,24 @@ def tracks_check(tokens: List[str], merge_track: bool = True) -> List[str]:
     return processed
 
 
-def pre_decoding_processing(tokens: List[str]) -> Tuple[List[str], List[str]]:
+def pre_decoding_processing(
+    tokens: Union[List[str], TokenDocument],
+) -> Tuple[List[str], List[str]]:
     """
     Pre-processes the tokens before decoding by separating head and body,
     normalizing note/rest prefixes, and handling tuning blocks.
 
-    :param tokens: List of tokens from the tab.
+    :param tokens: List of tokens from the tab, or a TokenDocument.
     :return: A tuple containing:
         - List of processed tokens with normalized prefixes and tuning handling.
         - List of string tunings extracted from the tokens.
     """
-    # Decide head/body without repeated slicing
-    if len(tokens) > 3 and tokens[3] == "start":
-        head = tokens[:4]
-        tune_in_token = True
-        start_idx = 4
-    else:
-        # Build head without append inside hot loop
-        head = tokens[:3] + ["start"]
-        tune_in_token = False
-        # Not include the string tunings if they are in the header
-        start_idx = 10
-
-    tunings = get_string_tunings(tokens)
+    header = token_header(tokens)
+    head = tokens[:3] + ["start"]
+    tune_in_token = header.note_tuning
+    # Not include the string tunings if they are in the header
+    start_idx = header.body_start
+    tunings = list(header.tunings)
 
     results: List[str] = []
     append = results.append
@@ -25,21 +25,16 @@
 # 1023 => [512,256,128,64,32,16,8,4,2,1]
 # 16384 => [16384]
 
-import math
+import logging
 
 from .const import wait_token_list2
 
+_LOGGER = logging.getLogger(__name__)
+
 
 def binarization(n):
-    l = []
-    for i in range(1, 20):
-        p = int(math.pow(2, i))
-        r = n % (p)
-        n -= r
-        if r > 0:
-            l.append(r)
-    l.reverse()
-    return l
+    # bits 0..18 of n, highest first (same as summing n % 2**i for i in 1..19)
+    return [1 << i for i in range(18, -1, -1) if n >> i & 1]
 
 
 # List of supported tokens
@@ -50,16 +45,30 @@ def binarization(n):
 #                     'wait:1024', 'wait:640', 'wait:1', 'wait:360', 'wait:192', 'wait:128', 'wait:120', 'wait:40',
 #                     'wait:60', 'wait:2', 'wait:8192', 'wait:4', 'wait:1440', 'wait:80', 'wait:180', 'wait:720',
 #                     'wait:160']
+COMMON_WAIT_TOKENS = frozenset(wait_token_list2)
+
+# Split of every uncommon wait amount below 2^15, filled in the first time an amount is seen
+WAIT_TABLE_SIZE = 1 << 15
+_wait_splits = [None] * WAIT_TABLE_SIZE
+
+
+def _split_wait_amount(n):
+    if 0 <= n < WAIT_TABLE_SIZE:
+        split = _wait_splits[n]
+        if split is None:
+            split = _wait_splits[n] = tuple("wait:%s" % b for b in binarization(n))
+        return split
+    return tuple("wait:%s" % b for b in binarization(n))
 
 
 def split_wait_token(token):
-    if token in wait_token_list2:
+    if token in COMMON_WAIT_TOKENS:
         # common wait tokens are not split
         return [token]
     else:
         # uncommon wait tokens are split
         n = int(token.split(":")[1])
-        return ["wait:%s" % b for b in binarization(n)]
+        return list(_split_wait_amount(n))
 
 
 # Bends/tremolo_bar tokens are split into variable parts [nfx:bend:type, dur, val:vib, dur, val:vib, dur, val:vib, ...]
@@ -109,28 +118,51 @@ def split_grace_token(token):
     return subtokens
 
 
+# Splitters of the rare nfx/bfx tokens, by their first two fields
+_FX_SPLITTERS = {
+    "nfx:trill": split_trill_token,
+    "nfx:grace": split_grace_token,
+    "nfx:bend": split_bend_token,
+    "bfx:tremolo_bar": split_bend_token,
+}
+
+
 # Splits some rare tokens into multiple smaller pieces
 # wait, nfx:trill, nfx:grace, nfx:bend, bfx:tremolo_bar
 # Takes a token (string)
 # returns a list of token strings
 # If input is not a rare token, returns the token inside a list of length 1 [token]
 def split_rare_token(token):
-    s = token.split(":")
+    kind, _, rest = token.partition(":")
     # WAIT
-    if s[0] == "wait":
+    if kind == "wait":
         return split_wait_token(token)
-    # TRILL
-    elif len(s) > 2 and s[0] + ":" + s[1] == "nfx:trill":
-        return split_trill_token(token)
-    # GRACE
-    elif len(s) > 2 and s[0] + ":" + s[1] == "nfx:grace":
-        return split_grace_token(token)
-    # BEND
-    elif len(s) > 2 and s[0] + ":" + s[1] in ["nfx:bend", "bfx:tremolo_bar"]:
-        return split_bend_token(token)
+    # TRILL, GRACE, BEND, TREMOLO BAR (only when there's a third field)
+    if kind == "nfx" or kind == "bfx":
+        name, sep, _ = rest.partition(":")
+        splitter = _FX_SPLITTERS.get(kind + ":" + name) if sep else None
+        if splitter is not None:
+            return splitter(token)
     return [token]
 
 
+# split_rare_token over a list of tokens, returns the new list of tokens
+def split_tokens(tokens):
+    common_waits = COMMON_WAIT_TOKENS
+    split = []
+    append = split.append
+    for token in tokens:
+        if token in common_waits:
+            append(token)
+        elif token.startswith("wait:"):
+            split.extend(_split_wait_amount(int(token.split(":")[1])))
+        elif token.startswith(("nfx:", "bfx:")):
+            split.extend(split_rare_token(token))
+        else:
+            append(token)
+    return split
+
+
 #
 ####
 #############
@@ -171,7 +203,7 @@ def unsplit_fx(fx, verbose=True):
             # ignore params for all other nfx
             return token
     else:
-        verbose and print("Unsplit_fx was given a non-fx token", s[0])
+        verbose and _LOGGER.debug("Unsplit_fx was given a non-fx token %s", s[0])
         assert False
 
 
@@ -315,17 +347,17 @@ def unsplit_bend_fx(fx_token, verbose=False):
                 position += duration
             elif param[0][:3] == "val":
                 if position > 12:
-                    verbose and print(
-                        "- Warning: invalid %s token. Position cannot be greater than 12"
-                        % fx_type,
+                    verbose and _LOGGER.warning(
+                        "Invalid %s token. Position cannot be greater than 12: %s",
+                        fx_type,
                         fx_token,
                     )
                     # ignore this bend point
                     continue
                 if position > 0 and num_bend_points == 0:
-                    verbose and print(
-                        "- Warning: invalid %s token. First position must be zero"
-                        % fx_type,
+                    verbose and _LOGGER.warning(
+                        "Invalid %s token. First position must be zero: %s",
+                        fx_type,
                         fx_token,
                     )
                     # ignore whatever duration token happened too early, set position to zero
@@ -345,9 +377,9 @@ def unsplit_bend_fx(fx_token, verbose=False):
 
     if len(params) % 3 != 0 or num_bend_points < 2:
         # some other error we didn't catch
-        verbose and print(
-            "- Warning: invalid %s token. Replacing with most common bend token "
-            % fx_type,
+        verbose and _LOGGER.warning(
+            "Invalid %s token. Replacing with most common bend token: %s",
+            fx_type,
             fx_token,
         )
         # Replace this with the most common
@@ -1,4 +1,6 @@
-from typing import List, Tuple
+import bisect
+import logging
+from typing import List, Tuple, Union
 
 import guitarpro
 import guitarpro as gp
@@ -6,6 +8,8 @@ import guitarpro as gp
 from .const import instrument_groups, supported_times
 from .token_splitter import unsplit_fx
 
+_LOGGER = logging.getLogger(__name__)
+
 
 def diff(number_list):
     nums = len(number_list)
@@ -63,6 +67,26 @@ def roundtempo(tempo):
     return round(tempo / 10) * 10
 
 
+# The tempo in effect at the start of measure m:
+# song.tempo, changed by the mixTableChange tempo of the beats of the earlier measures
+def get_tempo_at_measure(song, m):
+    tempo = song.tempo
+    last_change = -1
+    for track in song.tracks:
+        for measure in track.measures[:m]:
+            for voice in measure.voices:
+                for beat in voice.beats:
+                    mix_table_change = beat.effect.mixTableChange
+                    if (
+                        mix_table_change
+                        and mix_table_change.tempo
+                        and beat.start >= last_change
+                    ):
+                        tempo = mix_table_change.tempo.value
+                        last_change = beat.start
+    return tempo
+
+
 def convert_spn_to_common(spn_tuning):
     # Mapping of sharp to flat equivalents
     sharp_to_flat = {"A#": "Bb", "C#": "Db", "D#": "Eb", "F#": "F#", "G#": "Ab"}
@@ -93,7 +117,7 @@ def get_measure_tokens(measure):
         # sometimes this is a large value 16383 or 16384
         # For multiple endings for example endings 1-8
         # However pygp doesn't seem to support this
-        print(header.repeatAlternative)
+        _LOGGER.debug("Repeat alternative: %s", header.repeatAlternative)
         if header.repeatAlternative <= 255:
             measure_tokens.append(
                 "measure:repeat_alternative:%s" % header.repeatAlternative
@@ -120,8 +144,7 @@ def get_instrument_token_prefix(track, tracks_by_group):
             if track == test:
                 return "clean%s" % i
     else:
-        print(track)
-        assert False, "This track doesn't belong to a group"
+        assert False, "This track doesn't belong to a group: %s" % track.name
 
 
 # Given a NoteEffect object, returns a list of note effect tokens
@@ -243,6 +266,21 @@ def note_effect_list(effect):
     return effects
 
 
+# How many frets a note on this string is shifted down by a drop tuning
+# Drop tunings use frets -1 and -2
+def get_drop_shift(instrument_group, tuning, string):
+    if instrument_group == "bass":
+        if tuning == "b4_drop":
+            if string == 4:
+                return 2
+    else:
+        # everything else is treated like a guitar
+        if tuning == "g6_drop" or tuning == "g7_drop":
+            if string == 6 or string == 7:
+                return 2
+    return 0
+
+
 # Calculate the (E-standardized) fret number
 # Adjust by tuning and offset and pitch_shift
 # Drop tunings use frets -1 and -2
@@ -258,19 +296,40 @@ def get_fret(note, track, pitch_shift):
     instrument_group = get_instrument_group(track)
     strings = [str(s) for s in track.strings]
     tuning = get_tuning_type(instrument_group, strings)
-    drop_shift = 0
-    if instrument_group == "bass":
-        if tuning == "b4_drop":
-            if string == 4:
-                drop_shift = 2
-    else:
-        # everything else is treated like a guitar
-        if tuning == "g6_drop" or tuning == "g7_drop":
-            if string == 6 or string == 7:
-                drop_shift = 2
+    drop_shift = get_drop_shift(instrument_group, tuning, string)
     return note.value + track.offset - drop_shift
 
 
+# Everything the encoder needs to know about a track to write its notes.
+# Computed once per track, instead of once per note like get_fret does
+class TrackContext:
+    def __init__(self, track, instrument_prefix):
+        self.instrument_prefix = instrument_prefix
+        self.is_percussion = track.isPercussionTrack
+        self.instrument_group = get_instrument_group(track)
+        self.strings = [str(s) for s in track.strings]
+        self.tuning = get_tuning_type(self.instrument_group, self.strings)
+        # there is a capo on this fret
+        self.capo = track.offset
+        # drop_shift[string] for strings 1 to 7 (index 0 is unused, strings are 1-indexed)
+        self.drop_shift = [
+            get_drop_shift(self.instrument_group, self.tuning, string)
+            for string in range(max(8, len(self.strings) + 1))
+        ]
+        # strings are 1-indexed. They start from string 1 and go to string 6 or 7
+        # GP's string value is OK to copy over into our representation
+        # UNLESS it's a 4 or 5 string bass, which I want to start from string 2
+        # the reason for this is that 6 string bass adds in the high C string which we want as string 1
+        if instrument_prefix == "bass" and len(track.strings) < 6:
+            self.string_offset = 1
+        else:
+            self.string_offset = 0
+
+    # Same as get_fret(note, track, pitch_shift)
+    def fret(self, note):
+        return note.value + self.capo - self.drop_shift[note.string]
+
+
 # I'm trying to insert a new beatfx (event) into the current list of events for this measure.
 # Test if there are already beatfx of the same type.
 # Return a list of non-contradicting beatfx tokens
@@ -337,18 +396,20 @@ def oops_theres_a_note_here(new_event, events_this_measure, verbose=False):
                 # Found a note
                 if new_event["type"] == "rest":
                     # I was trying to insert a rest. Ignore my rest because there's already a note.
-                    verbose and print(
-                        "I was trying to insert a rest. Ignore my rest because there's already a note."
+                    verbose and _LOGGER.debug(
+                        "I was trying to insert a rest. Ignore my rest because there's already a note. %s %s",
+                        event,
+                        new_event,
                     )
-                    verbose and print(event, new_event)
                     return False
                 if new_event["type"] == "note":
                     if new_event["string"] == event["string"]:
                         # There's already a note on this string. Ignore my note.
-                        verbose and print(
-                            "There's already a note on this string. Ignore my note."
+                        verbose and _LOGGER.debug(
+                            "There's already a note on this string. Ignore my note. %s %s",
+                            event,
+                            new_event,
                         )
-                        verbose and print(event, new_event)
                         return False
                     else:
                         # Don't return true yet. There could still be a note on this string.
@@ -358,8 +419,8 @@ def oops_theres_a_note_here(new_event, events_this_measure, verbose=False):
                 if new_event["type"] == "note":
                     # I want to insert a note here.
                     # Remove the rest.
-                    verbose and print(
-                        " I want to insert a note here. Remove the rest"
+                    verbose and _LOGGER.debug(
+                        "I want to insert a note here. Remove the rest"
                     )  ####
                     # Will this really work I'm kind of scared
                     del events_this_measure[i]
@@ -372,10 +433,11 @@ def oops_theres_a_note_here(new_event, events_this_measure, verbose=False):
                 elif new_event["type"] == "rest":
                     # I watn to insert a rest, and there's already a rest here.
                     # Do nothing.
-                    verbose and print(
-                        "I wanted to insert a rest, but there's already a rest here. "
+                    verbose and _LOGGER.debug(
+                        "I wanted to insert a rest, but there's already a rest here. %s %s",
+                        event,
+                        new_event,
                     )
-                    verbose and print(event, new_event)
                     return False
         # okay now handle cases where a note was already playing on the same instrument
         elif (
@@ -387,7 +449,7 @@ def oops_theres_a_note_here(new_event, events_this_measure, verbose=False):
             if new_event["type"] == "rest":
                 # I'm trying to insert a rest, but notes are alread playing.
                 # Ignore my new rest.
-                verbose and print(
+                verbose and _LOGGER.debug(
                     "I was trying to insert a rest. There's already a note playing though."
                 )
                 return False
@@ -416,6 +478,166 @@ def oops_theres_a_note_here(new_event, events_this_measure, verbose=False):
     return True  # found no conflicts
 
 
+# An event of the encoder: a measure, note, rest or beatfx at a point in time.
+# A song has one per note/rest/beatfx, so these are slotted records instead of dicts.
+# Fields that don't apply to the type are None (a measure has no duration/instrument_prefix,
+# only notes have string/fret, notes and beatfx have effects, only measures have tokens)
+class EncoderEvent:
+    __slots__ = (
+        "type",
+        "track",
+        "start",
+        "duration",
+        "instrument_prefix",
+        "string",
+        "fret",
+        "effects",
+        "tokens",
+    )
+
+    def __init__(
+        self,
+        type,
+        track,
+        start,
+        duration=None,
+        instrument_prefix=None,
+        string=None,
+        fret=None,
+        effects=None,
+        tokens=None,
+    ):
+        self.type = type
+        self.track = track
+        self.start = start
+        self.duration = duration
+        self.instrument_prefix = instrument_prefix
+        self.string = string
+        self.fret = fret
+        self.effects = effects
+        self.tokens = tokens
+
+    def __repr__(self):
+        fields = ", ".join(
+            "%s=%r" % (name, getattr(self, name))
+            for name in self.__slots__
+            if getattr(self, name) is not None
+        )
+        return "EncoderEvent(%s)" % fields
+
+
+# Index of the note/rest events already placed in one measure.
+# Gives the same answers as oops_theres_a_note_here, without walking the whole measure for every event:
+#   - note_strings: (start, instrument_prefix) -> strings that already have a note at that start
+#     (so a (start, instrument_prefix, string) lookup tells us if a note is already there)
+#   - rests: (start, instrument_prefix) -> where the rest event is (stream, position)
+#   - ringing_until: instrument_prefix -> the latest start+duration of any note on that instrument
+# A note and a rest never share the same (start, instrument_prefix), and there is at most one rest there,
+# because inserting a rest is refused when anything is already there, and inserting a note removes the rest.
+# The events are kept in streams: one list per track voice (and one for the measure event),
+# each already in time order, so they can be merged instead of sorted.
+class MeasureOccupancy:
+    def __init__(self):
+        self.streams = []  # lists of events. Replaced rests are set to None
+        self.stream = None  # the stream new events are added to
+        self.dirty_streams = []  # streams that had a rest replaced
+        self.note_strings = {}
+        self.rests = {}
+        self.ringing_until = {}
+
+    # Start a new stream (a new track voice). Events added from now on go there
+    def new_stream(self):
+        self.stream = []
+        self.streams.append(self.stream)
+
+    # Events that don't take part in note/rest conflicts (measure, beatfx)
+    def append(self, event):
+        self.stream.append(event)
+
+    # I'm trying to insert a new note or rest (event) into this measure.
+    # If I'm inserting a note:
+    #   If there is a note on the same string there, return False
+    #   If there is a rest there, remove the rest, insert the note and return True
+    #   If there is nothing there, insert the note and return True
+    # If I'm inserting a rest:
+    #   If there's a note or rest there, or a note of this instrument is still playing, return False
+    #   If there's nothing there, insert the rest and return True
+    def insert(self, new_event, verbose=False):
+        assert new_event.type in [
+            "note",
+            "rest",
+        ], "Only notes or rests should call this function"
+        start = new_event.start
+        prefix = new_event.instrument_prefix
+        slot = (start, prefix)
+        strings = self.note_strings.get(slot)
+        if new_event.type == "rest":
+            if strings:
+                verbose and _LOGGER.debug(
+                    "I was trying to insert a rest. Ignore my rest because there's already a note."
+                )
+                return False
+            if slot in self.rests:
+                verbose and _LOGGER.debug(
+                    "I wanted to insert a rest, but there's already a rest here."
+                )
+                return False
+            if self.ringing_until.get(prefix, start) > start:
+                # note: this also counts notes (from another voice) that start later in the measure
+                verbose and _LOGGER.debug(
+                    "I was trying to insert a rest. There's already a note playing though."
+                )
+                return False
+            self.rests[slot] = (self.stream, len(self.stream))
+            self.stream.append(new_event)
+            return True
+        # inserting a note
+        string = new_event.string
+        if strings is None:
+            strings = self.note_strings[slot] = set()
+        elif string in strings:
+            verbose and _LOGGER.debug(
+                "There's already a note on this string. Ignore my note."
+            )
+            return False
+        rest = self.rests.pop(slot, None)
+        if rest is not None:
+            verbose and _LOGGER.debug("I want to insert a note here. Remove the rest")
+            stream, index = rest
+            stream[index] = None
+            self.dirty_streams.append(stream)
+        strings.add(string)
+        end = start + new_event.duration
+        if prefix not in self.ringing_until or end > self.ringing_until[prefix]:
+            self.ringing_until[prefix] = end
+        self.stream.append(new_event)
+        return True
+
+    # The streams of this measure in insertion order, without the rests that were replaced by notes
+    def streams_in_order(self):
+        if not self.dirty_streams:
+            return self.streams
+        dirty = set(id(stream) for stream in self.dirty_streams)
+        return [
+            (
+                [event for event in stream if event is not None]
+                if id(stream) in dirty
+                else stream
+            )
+            for stream in self.streams
+        ]
+
+    # The events of this measure in insertion order, without the rests that were replaced by notes
+    def events_in_order(self):
+        return [event for stream in self.streams_in_order() for event in stream]
+
+
+# Sort key of encoder events: time, then track (measure events use track -1 so they come first),
+# then beatfx after the notes/rests of the same beat
+def event_order_key(event):
+    return (event.start, event.track, event.type == "beatfx")
+
+
 # It's important to maintain the format of bfx:name(:params..)
 # Because we use that to resolve contradictory beatfx tokens
 
@@ -504,18 +726,63 @@ def convert_strings_for_pygp(strings, pitch_shift=0):
 def convert_to_nearest_supported_time(x):
     if x == 0:
         return 0
-    for i in range(1, len(supported_times)):
-        t = supported_times[i]
-        if t > x:
-            t_larger = t
-            t_smaller = supported_times[i - 1]
-            if t_larger - x < x - t_smaller:
-                return t_larger
-            else:
-                return t_smaller
-    # x is too large.
-    # return the max(?)
-    return 5760
+    # the first supported time larger than x (the smallest two are compared below it too)
+    i = max(1, bisect.bisect_right(supported_times, x))
+    if i == len(supported_times):
+        # x is too large.
+        # return the max(?)
+        return 5760
+    t_larger = supported_times[i]
+    t_smaller = supported_times[i - 1]
+    if t_larger - x < x - t_smaller:
+        return t_larger
+    else:
+        return t_smaller
+
+
+# tick duration -> (value, isDotted, tuplet enters, tuplet times, rounded time or None)
+# Filled as durations are seen, the decoder sees the same few over and over
+_DURATIONS = {}
+# model generated tokens can have any durations, don't remember more than this many
+_MAX_DURATIONS = 1 << 16
+
+
+def _resolve_duration(time):
+    try:
+        # Handy function for converting clock duration to its equivalent notelength/dotted/tuplet
+        # This function might fail if the model generates a weird time combination
+        return gp.Duration.fromTime(time), None
+    except Exception:
+        # It's a weird duration
+        # Instead round it to the nearest supported time
+        new_time = convert_to_nearest_supported_time(time)
+        return gp.Duration.fromTime(new_time), new_time
+
+
+def duration_from_time(time: int) -> Tuple[gp.Duration, Union[int, None]]:
+    """
+    Converts a tick duration to a Guitar Pro duration (note value, dotted, tuplet).
+
+    Durations that Guitar Pro can't represent are rounded to the nearest supported time.
+    Each distinct duration is only converted once, the result is a new Duration every time.
+
+    :param time: the duration in ticks, 960 per quarter note
+    :return: a tuple of the Duration and the time it was rounded to (None if it wasn't)
+    """
+    entry = _DURATIONS.get(time)
+    if entry is None:
+        duration, new_time = _resolve_duration(time)
+        entry = (
+            duration.value,
+            duration.isDotted,
+            duration.tuplet.enters,
+            duration.tuplet.times,
+            new_time,
+        )
+        if len(_DURATIONS) < _MAX_DURATIONS:
+            _DURATIONS[time] = entry
+    value, is_dotted, enters, times, new_time = entry
+    return gp.Duration(value, is_dotted, gp.Tuplet(enters, times)), new_time
 
 
 # take a list of bfx tokens and modify the beateffect
@@ -531,7 +798,7 @@ def tokens_to_beat_effect(effect, bfx_tokens):
         t = token.split(":")
         if t[0] != "bfx":
             # the first part of the token should be bfx, if it's not, it shouldn't be here, ignore it
-            print("This token shouldn't be here, it's not a BFX", token)
+            _LOGGER.warning("This token shouldn't be here, it's not a BFX: %s", token)
             continue
         if t[1] == "fade_in":
             effect.fadeIn = True
@@ -603,7 +870,7 @@ def tokens_to_note_effect(note, nfx_tokens):
         t = token.split(":")
         if t[0] != "nfx":
             # the first part of the token should be nfx, if it's not, it shouldn't be here, ignore it
-            print("This token shouldn't be here, it's not a NFX", token)
+            _LOGGER.warning("This token shouldn't be here, it's not a NFX: %s", token)
             continue
         if t[1] == "tie":
             note.type = gp.NoteType(2)
@@ -685,7 +952,6 @@ def tokens_to_note_effect(note, nfx_tokens):
         elif t[1] == "tremolo_picking":
             effect.tremoloPicking = gp.TremoloPickingEffect()
             effect.tremoloPicking.duration = gp.Duration.fromTime(int(t[2][8:]))
-            print(token)
         elif t[1] == "trill":
             effect.trill = gp.TrillEffect()
             effect.trill.fret = int(t[2][4:])
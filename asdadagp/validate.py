@@ -0,0 +1,314 @@
+from dataclasses import dataclass
+from typing import List, Optional
+
+import guitarpro as gp
+
+from .decoder import INSTRUMENTS, parse_token
+from .token_splitter import unsplit_fx
+from .utils import noteNumber
+
+# frets are written as signed bytes, Guitar Pro clamps the frets above 99 when it reads them
+MAX_FRET = 99
+
+_FRETS = range(MAX_FRET + 1)
+_BYTES = range(256)
+_POSITIVE = range(1, 1 << 31)
+
+
+def _values(enum) -> frozenset:
+    return frozenset(member.value for member in enum)
+
+
+# the fields of the effects that tokens_to_beat_effect and tokens_to_note_effect read, after
+# unsplit_fx joined their params: (name, prefix, allowed values or None for any integer)
+_EFFECT_FIELDS = {
+    "bfx:pick_stroke": (("direction", "", _values(gp.BeatStrokeDirection)),),
+    "bfx:slap_effect": (("slap", "", _values(gp.SlapEffect)),),
+    "bfx:stroke": (
+        ("direction", "", _values(gp.BeatStrokeDirection)),
+        ("value", "", None),
+    ),
+    "bfx:tremolo_bar": (("type", "type", _values(gp.BendType)),),
+    "bfx:tempo_change": (("tempo", "", _POSITIVE),),
+    "nfx:bend": (("type", "type", _values(gp.BendType)),),
+    "nfx:grace": (
+        ("fret", "fret", None),
+        ("duration", "duration", _BYTES),
+        ("dead", "dead", None),
+        ("beat", "beat", None),
+        ("transition", "transition", _values(gp.GraceEffectTransition)),
+    ),
+    "nfx:harmonic": (("type", "", range(1, 6)),),
+    "nfx:slide": (("slide", "", _values(gp.SlideType)),),
+    # the durations Guitar Pro stores: eighth, sixteenth and thirty-second notes
+    "nfx:tremolo_picking": (("duration", "duration", (480, 240, 120)),),
+    # sixteenth, thirty-second and sixty-fourth notes
+    "nfx:trill": (("fret", "fret", _FRETS), ("duration", "duration", (240, 120, 60))),
+}
+# the fields after the type of artificial (2) and tapped (3) harmonics
+_HARMONIC_FIELDS = {
+    2: (("pitch", "pitch", None), ("octave", "octave", _values(gp.Octave))),
+    3: (("fret", "fret", _BYTES),),
+}
+# the fields of each point of bends and tremolo bars, after the type
+_BEND_POINT_FIELDS = (("pos", "pos", None), ("val", "val", None), ("vib", "vib", None))
+
+
+@dataclass(frozen=True)
+class TokenError:
+    """
+    A problem found by `validate_tokens`.
+    """
+
+    # index of the token in the validated list, None if the problem isn't a single token
+    index: Optional[int]
+    # the token at index
+    token: Optional[str]
+    # index of the measure (0 is the first "new_measure"), None in the head
+    measure: Optional[int]
+    message: str
+
+    def __str__(self):
+        location = "head" if self.measure is None else "measure %s" % self.measure
+        if self.index is None:
+            return "%s: %s" % (location, self.message)
+        return "token %s (%s, %r): %s" % (
+            self.index,
+            location,
+            self.token,
+            self.message,
+        )
+
+
+def _check_int(token: str, name: str) -> bool:
+    t = token.split(":")
+    if len(t) != 2 or t[0] != name:
+        return False
+    try:
+        int(t[1])
+    except ValueError:
+        return False
+    return True
+
+
+def _check_tuning(name: str) -> bool:
+    try:
+        noteNumber(name)
+    except (ValueError, IndexError):
+        return False
+    return True
+
+
+def _read_fields(t: List[str], start: int, fields) -> Optional[List[int]]:
+    # the values of fields in t from index start, None if one is missing or not allowed
+    values = []
+    for i, (_, prefix, allowed) in enumerate(fields, start):
+        if i >= len(t) or not t[i].startswith(prefix):
+            return None
+        try:
+            value = int(t[i][len(prefix) :])
+        except ValueError:
+            return None
+        if allowed is not None and value not in allowed:
+            return None
+        values.append(value)
+    return values
+
+
+def _check_effect(token: str, params: tuple) -> Optional[str]:
+    # error message if the decoder can't read an effect and its params, None if it can
+    t = unsplit_fx({"token": token, "params": list(params)}, verbose=False).split(":")
+    name = ":".join(t[:2])
+    fields = _EFFECT_FIELDS.get(name)
+    if fields is None:
+        # no fields, or an effect the decoder ignores
+        return None
+    values = _read_fields(t, 2, fields)
+    if values is not None and name == "nfx:harmonic":
+        fields = fields + _HARMONIC_FIELDS.get(values[0], ())
+        values = _read_fields(t, 2, fields)
+    elif values is not None and name in ("nfx:bend", "bfx:tremolo_bar"):
+        if len(t) % 3 != 0:
+            values = None
+        else:
+            fields = fields + _BEND_POINT_FIELDS * ((len(t) - 3) // 3)
+            values = _read_fields(t, 2, fields)
+    if values is None:
+        expected = ":".join("%s<%s>" % (prefix, label) for label, prefix, _ in fields)
+        return "invalid effect, expected %s:%s" % (name, expected)
+    return None
+
+
+def _classify(token: str, note_tuning: bool):
+    # (TokenRecord or None if it can't be parsed, error message or None)
+    normalized = token
+    # add track prefix if the token preprocessing removed them
+    if token.startswith("note") or token.startswith("rest"):
+        normalized = "clean0:" + token
+    try:
+        record = parse_token(normalized)
+    except (ValueError, IndexError):
+        return None, "malformed note or wait token"
+    if record.kind == "other":
+        return record, "unknown token"
+    if record.kind == "wait" and record.value <= 0:
+        return record, "wait must be positive"
+    if record.kind != "note":
+        return record, None
+
+    if record.instrument not in INSTRUMENTS:
+        return record, "unknown instrument %s" % record.instrument
+    if not 1 <= record.string <= 7:
+        return record, "string %s out of range 1-7" % record.string
+    if record.fret < 0 and (record.fret < -2 or record.string not in (6, 7)):
+        message = "fret %s only allowed on drop tuned strings 6 and 7" % record.fret
+        return record, message
+    if record.fret > MAX_FRET:
+        return record, "fret %s above %s" % (record.fret, MAX_FRET)
+    if not note_tuning:
+        return record, None
+    # notes without a tuning are decoded with the tuning of their string (E standard if none)
+    t = normalized.split(":")
+    if len(t) > 4 and not _check_tuning(t[4]):
+        return record, "invalid note tuning %s" % t[4]
+    return record, None
+
+
+def validate_tokens(
+    tokens: List[str], max_errors: Optional[int] = None
+) -> List[TokenError]:
+    """
+    Checks that a token list can be decoded, without building the song.
+
+    Runs the checks of the decoder on the tokens of a token file (as written by the encoder
+    or generated by a model, with or without note tunings and "cleanX:" prefixes):
+        - the head: artist, downtune, tempo, the 6 string tunings or note tunings, start
+        - note tokens: a known instrument, strings 1-7, integer frets up to `MAX_FRET`, drop tuned
+          frets (-1, -2) only on strings 6 and 7, valid note tunings (strings without one get
+          their E standard tuning, like in the decoder)
+        - notes, rests and measure tokens are inside a measure, the song ends with "end"
+        - waits are positive integers, every measure has a duration
+        - params follow an effect (nfx/bfx), the fields of the effects that the decoder reads
+          are integers Guitar Pro can store (e.g. "bfx:tempo_change" has a positive tempo)
+
+    :param tokens: the tokens, e.g. the lines of a token file
+    :param max_errors: stop after this many errors, 1 is enough to reject a sample
+    :return: the errors found, an empty list if the tokens are valid
+    """
+    errors = []
+
+    def error(index, message, measure=None):
+        token = tokens[index] if index is not None else None
+        errors.append(TokenError(index, token, measure, message))
+        return max_errors is not None and len(errors) >= max_errors
+
+    ## HEAD
+    if len(tokens) > 3 and tokens[3] == "start":
+        # the tunings are in the note tokens
+        note_tuning = True
+        body_start = 4
+    elif len(tokens) > 9 and tokens[9] == "start":
+        note_tuning = False
+        body_start = 10
+        for i in range(3, 9):
+            if not _check_tuning(tokens[i]) and error(i, "invalid string tuning"):
+                return errors
+    else:
+        error(None, "no 'start' token after the head (expected at index 3 or 9)")
+        return errors
+    if len(tokens) < 3 or not _check_int(tokens[1], "downtune"):
+        if error(1 if len(tokens) > 1 else None, "expected downtune:<int>"):
+            return errors
+    if len(tokens) < 3 or not _check_int(tokens[2], "tempo"):
+        if error(2 if len(tokens) > 2 else None, "expected tempo:<int>"):
+            return errors
+    elif int(tokens[2].split(":")[1]) <= 0:
+        if error(2, "tempo must be positive"):
+            return errors
+
+    ## BODY
+    # the decoder's clock, to find the measures without duration
+    clock = 960
+    last_reported_duration = 480
+    last_reported_beat_clock = 480
+    # (index of the new_measure token, its clock) of each measure
+    measures = []
+    measure = None
+    # [index, token, params] of the effect being read, None if the last token isn't part of one
+    effect = None
+    end_index = None
+    # everything that only depends on the token itself is checked once per distinct token
+    classified = {}
+    checked_effects = {}
+
+    for i in range(body_start, len(tokens)):
+        token = tokens[i]
+        entry = classified.get(token)
+        if entry is None:
+            entry = classified[token] = _classify(token, note_tuning)
+        record, message = entry
+        kind = record.kind if record is not None else None
+
+        if effect is not None and kind != "param":
+            # the effect's params are complete
+            index, effect_token, params = effect
+            key = (effect_token, tuple(params))
+            effect_message = checked_effects.get(key, False)
+            if effect_message is False:
+                effect_message = checked_effects[key] = _check_effect(*key)
+            effect = None
+            if effect_message is not None and error(index, effect_message, measure):
+                return errors
+
+        if (kind == "end" or kind == "new_measure") and measure is not None:
+            if last_reported_beat_clock == clock:
+                if last_reported_duration == 0:
+                    last_reported_duration = 480
+                clock += last_reported_duration
+        if kind == "end":
+            end_index = i
+            break
+        if kind == "new_measure":
+            measure = len(measures)
+            measures.append((i, clock))
+            continue
+
+        if message is None:
+            if measure is None and kind in ("measure", "note", "rest"):
+                message = "%s token before the first new_measure" % kind
+            elif kind == "param" and effect is None:
+                message = "param token doesn't follow an effect"
+        if message is not None and error(i, message, measure):
+            return errors
+
+        if kind == "note" or kind == "rest":
+            if clock != last_reported_beat_clock:
+                last_reported_duration = clock - last_reported_beat_clock
+            last_reported_beat_clock = clock
+        elif kind == "nfx" or kind == "bfx":
+            effect = [i, token, []]
+        elif kind == "param":
+            if effect is not None:
+                effect[2].append(token)
+        elif kind == "wait":
+            if record.value > 0:
+                clock += record.value
+
+    if end_index is None:
+        if error(None, "no 'end' token, the last measure would be lost", measure):
+            return errors
+    elif end_index != len(tokens) - 1 and any(tokens[end_index + 1 :]):
+        if error(end_index + 1, "tokens after 'end'", measure):
+            return errors
+    if not measures:
+        if error(None, "no measures"):
+            return errors
+
+    for m, (i, start) in enumerate(measures):
+        end = measures[m + 1][1] if m + 1 < len(measures) else clock
+        if end - start <= 0 and error(i, "measure has no duration", m):
+            return errors
+
+    # strings without a note tuning are fine, the decoder gives them their E standard tuning
+    # (see `complete_string_tunings`)
+    return errors
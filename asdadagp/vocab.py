@@ -0,0 +1,168 @@
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Union
+
+UNK_TOKEN = "<unk>"
+UNK_POLICIES = ("unk", "error", "add")
+
+
+class Vocabulary:
+    """
+    Maps tokens to integer ids and back.
+
+    Id 0 is always the UNK token, the other tokens keep the id they were given when added,
+    so a saved vocabulary can be extended without changing the ids already in use.
+
+    `unk_policy` decides what `encode` does with a token that is not in the vocabulary:
+        - "unk": encode it as the UNK id
+        - "error": raise a KeyError
+        - "add": add it to the vocabulary with the next free id
+    """
+
+    def __init__(self, tokens: Iterable[str] = (), unk_policy: str = "unk"):
+        if unk_policy not in UNK_POLICIES:
+            raise ValueError(
+                f"unk_policy must be one of {UNK_POLICIES}, got {unk_policy!r}"
+            )
+        self.unk_policy = unk_policy
+        self._id_to_token: List[str] = [UNK_TOKEN]
+        self._token_to_id: Dict[str, int] = {UNK_TOKEN: 0}
+        for token in tokens:
+            self.add(token)
+
+    @classmethod
+    def from_corpus(
+        cls,
+        corpus: Iterable[Union[str, Iterable[str]]],
+        min_count: int = 1,
+        unk_policy: str = "unk",
+    ) -> "Vocabulary":
+        """
+        Builds a vocabulary from tokenized songs.
+
+        Tokens are numbered by decreasing frequency (ties in alphabetical order),
+        so the same corpus always gives the same ids.
+
+        :param corpus: token lists, or paths of token files written by `asdadagp_encode`
+        :param min_count: tokens seen fewer times than this are left out (and encoded as UNK)
+        :param unk_policy: see `Vocabulary`
+        """
+        counts = Counter()
+        for song in corpus:
+            if isinstance(song, str):
+                song = read_token_file(song)
+            counts.update(song)
+        counts.pop(UNK_TOKEN, None)
+        tokens = sorted(
+            (token for token, count in counts.items() if count >= min_count),
+            key=lambda token: (-counts[token], token),
+        )
+        return cls(tokens, unk_policy=unk_policy)
+
+    @classmethod
+    def load(cls, path: str, unk_policy: str = "unk") -> "Vocabulary":
+        """
+        Loads a vocabulary saved by `save`: one token per line, the id is the line number.
+        """
+        tokens = read_token_file(path)
+        if not tokens or tokens[0] != UNK_TOKEN:
+            raise ValueError(
+                f"{path} is not a vocabulary file (first line is not {UNK_TOKEN})"
+            )
+        return cls(tokens[1:], unk_policy=unk_policy)
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as f:
+            f.write("\n".join(self._id_to_token))
+
+    def add(self, token: str) -> int:
+        """Adds a token if it is new and returns its id."""
+        token_id = self._token_to_id.get(token)
+        if token_id is None:
+            token_id = len(self._id_to_token)
+            self._token_to_id[token] = token_id
+            self._id_to_token.append(token)
+        return token_id
+
+    @property
+    def unk_id(self) -> int:
+        return 0
+
+    @property
+    def typecode(self) -> str:
+        # 'H' (uint16) covers every vocabulary seen so far, 'I' is the fallback for bigger ones
+        return "H" if len(self._id_to_token) <= 1 << 16 else "I"
+
+    def __len__(self) -> int:
+        return len(self._id_to_token)
+
+    def __contains__(self, token: str) -> bool:
+        return token in self._token_to_id
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Vocabulary) and self._id_to_token == other._id_to_token
+
+    def token_to_id(self, token: str) -> int:
+        token_id = self._token_to_id.get(token)
+        if token_id is not None:
+            return token_id
+        if self.unk_policy == "unk":
+            return 0
+        if self.unk_policy == "add":
+            return self.add(token)
+        raise KeyError(f"token not in vocabulary: {token!r}")
+
+    def id_to_token(self, token_id: int) -> str:
+        return self._id_to_token[token_id]
+
+    def encode(self, tokens: Iterable[str], as_numpy: bool = False):
+        """
+        Converts tokens to ids.
+
+        :param tokens: any iterable of tokens, e.g. `iter_tokens(song, artist)`
+        :param as_numpy: return a numpy array instead of an `array.array` (requires numpy)
+        :return: an `array('H')` of ids (`array('I')` for vocabularies over 65536 tokens)
+        """
+        get = self._token_to_id.get
+        if self.unk_policy == "unk":
+            ids = array(self.typecode, [get(token, 0) for token in tokens])
+        else:
+            ids = [self.token_to_id(token) for token in tokens]
+            # with "add" the vocabulary may have grown while encoding
+            ids = array(self.typecode, ids)
+        if as_numpy:
+            import numpy as np
+
+            return np.frombuffer(ids, dtype=np.dtype(ids.typecode)).copy()
+        return ids
+
+    def decode(self, ids: Iterable[int]) -> List[str]:
+        """Converts ids (an array, numpy array or list) back to tokens."""
+        id_to_token = self._id_to_token
+        return [id_to_token[i] for i in ids]
+
+
+def read_token_file(path: str) -> List[str]:
+    # Token files are newline separated (see asdadagp_encode)
+    with open(path, "r") as f:
+        return f.read().split("\n")
+
+
+def save_ids(ids: array, path: str) -> None:
+    """
+    Writes token ids as raw native-endian integers, for loading with `load_ids` or `numpy.fromfile`.
+    """
+    with open(path, "wb") as f:
+        ids.tofile(f)
+
+
+def load_ids(path: str, typecode: str = "H") -> array:
+    """
+    Reads token ids written by `save_ids`.
+
+    :param typecode: the array typecode they were written with, `Vocabulary.typecode`
+    """
+    ids = array(typecode)
+    with open(path, "rb") as f:
+        ids.frombytes(f.read())
+    return ids
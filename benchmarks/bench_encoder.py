@@ -0,0 +1,92 @@
+"""
+Measures the time, memory and allocations of guitarpro2tokens.
+
+    python benchmarks/bench_encoder.py [FILE.gp5 ...] [--repeat N] [--source DIR]
+
+Defaults to the songs in asdadagp/examples. For each file it reports the number of tokens,
+the encode time (best of N), the peak memory traced by tracemalloc while encoding, and the
+number of memory blocks the encoder allocates for its per-measure records (events): the blocks
+allocated in encoder.py that are alive when a measure's tokens start, summed over the measures.
+--source imports asdadagp from another checkout (e.g. a git worktree of an older commit), to
+compare the numbers before and after a change.
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLES = os.path.join(ROOT, "asdadagp", "examples")
+
+
+def count_measure_blocks(song, iter_tokens, encoder_file):
+    # the events of a measure are built before its first token ("new_measure") is yielded
+    # and released after its last one, so each measure's blocks are counted once.
+    # The blocks alive at "start" (the song's setup) are alive for every measure, they are left out.
+    encoder_only = [tracemalloc.Filter(True, encoder_file)]
+
+    def encoder_blocks():
+        snapshot = tracemalloc.take_snapshot().filter_traces(encoder_only)
+        return sum(stat.count for stat in snapshot.statistics("filename"))
+
+    setup_blocks = 0
+    blocks = 0
+    tracemalloc.start()
+    try:
+        for token in iter_tokens(song, "Unknown"):
+            if token == "start":
+                setup_blocks = encoder_blocks()
+            elif token == "new_measure":
+                blocks += encoder_blocks() - setup_blocks
+    finally:
+        tracemalloc.stop()
+    return blocks
+
+
+def measure(path, repeat):
+    import guitarpro as gp
+
+    from asdadagp import encoder
+
+    song = gp.parse(path)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        tokens = encoder.guitarpro2tokens(song, "Unknown")
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    encoder.guitarpro2tokens(song, "Unknown")
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    blocks = count_measure_blocks(song, encoder.iter_tokens, encoder.__file__)
+    return len(tokens), best, peak, blocks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("files", nargs="*")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--source",
+        default=ROOT,
+        help="Checkout to import asdadagp from (default: this one)",
+    )
+    args = parser.parse_args()
+    sys.path.insert(0, os.path.abspath(args.source))
+    files = args.files or sorted(glob.glob(os.path.join(EXAMPLES, "*.gp5")))
+    print(f"{'file':40} {'tokens':>8} {'time ms':>9} {'peak KiB':>9} {'blocks':>8}")
+    for path in files:
+        n_tokens, best, peak, blocks = measure(path, args.repeat)
+        print(
+            f"{os.path.basename(path)[:40]:40} {n_tokens:8d} {best * 1000:9.1f} "
+            f"{peak / 1024:9.1f} {blocks:8d}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import os
+
+import guitarpro as gp
+import pytest
+from asdadagp.augment import Variant, augment
+from asdadagp.encoder import guitarpro2tokens
+
+DATA_FOLDER_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "data"
+)
+GP_PATH = os.path.join(DATA_FOLDER_PATH, "dyens-roland-la_bicyclette.gp4")
+
+
+def test_augment():
+    variants = [
+        Variant(),
+        Variant(note_tuning=True),
+        Variant(transpose=-2),
+        Variant(note_tuning=True, transpose=3, capo=2),
+        Variant(tracks=(1,)),
+    ]
+    outputs = augment(gp.parse(GP_PATH), "unknown", variants)
+
+    # each variant is the same as encoding an edited copy of the song
+    def encode(note_tuning=False, transpose=0, capo=0, tracks=None):
+        song = gp.parse(GP_PATH)
+        for track in song.tracks:
+            for string in track.strings:
+                string.value += transpose
+            track.offset += capo
+        if tracks is not None:
+            song.tracks = [song.tracks[t] for t in tracks]
+        return guitarpro2tokens(song, "unknown", note_tuning=note_tuning)
+
+    assert outputs[0] == encode()
+    assert outputs[1] == encode(note_tuning=True)
+    assert outputs[2] == encode(transpose=-2)
+    assert outputs[2][1] == "downtune:-2"
+    assert outputs[3] == encode(note_tuning=True, transpose=3, capo=2)
+    assert outputs[4] == encode(tracks=[1])
+
+    with pytest.raises(ValueError):
+        augment(gp.parse(GP_PATH), "unknown", [Variant(tracks=(5,))])
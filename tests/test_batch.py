@@ -0,0 +1,138 @@
+import os
+import time
+
+import guitarpro as gp
+from asdadagp import batch
+from asdadagp.batch import (
+    decode_directory,
+    encode_directory,
+    find_gp_files,
+    output_path_for,
+)
+
+DATA_FOLDER_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "data"
+)
+
+
+def test_find_gp_files():
+    base, files = find_gp_files(DATA_FOLDER_PATH)
+    assert base == DATA_FOLDER_PATH
+    assert len(files) == 4
+    base, files = find_gp_files(os.path.join(DATA_FOLDER_PATH, "*.gp4"))
+    assert base == DATA_FOLDER_PATH
+    assert [os.path.basename(f) for f in files] == [
+        "brower-leo-un_dia_de_noviembre.gp4",
+        "dyens-roland-la_bicyclette.gp4",
+    ]
+    assert output_path_for(
+        os.path.join("in", "album", "song.gp5"), "in", "out"
+    ) == os.path.join("out", "album", "song.txt")
+
+
+def test_encode_directory(tmp_path):
+    summary = encode_directory(
+        DATA_FOLDER_PATH,
+        str(tmp_path),
+        workers=2,
+        chunksize=1,
+        ordered=False,
+        maxtasksperchild=1,
+        summary_file=str(tmp_path / "summary.json"),
+    )
+    assert summary["total"] == 4
+    # blank.gp5 has no tracks and can't be encoded, the rest succeed
+    assert summary["failed"] == 1
+    assert os.path.exists(tmp_path / "summary.json")
+    for result in summary["files"]:
+        if result["error"]:
+            assert result["input"].endswith("blank.gp5")
+        else:
+            with open(result["output"]) as f:
+                tokens = f.read().split("\n")
+            assert tokens[0] == "Unknown"
+            assert tokens[-1] == "end"
+
+
+def test_encode_directory_measure_range(tmp_path):
+    summary = encode_directory(
+        os.path.join(DATA_FOLDER_PATH, "*.gp4"),
+        str(tmp_path),
+        workers=1,
+        start_measure=2,
+        end_measure=5,
+    )
+    assert summary["failed"] == 0
+    for result in summary["files"]:
+        with open(result["output"]) as f:
+            assert f.read().split("\n").count("new_measure") == 3
+
+
+def test_encode_directory_collisions(tmp_path):
+    source = tmp_path / "in"
+    source.mkdir()
+    with open(
+        os.path.join(DATA_FOLDER_PATH, "dyens-roland-la_bicyclette.gp4"), "rb"
+    ) as f:
+        data = f.read()
+    (source / "song.gp4").write_bytes(data)
+    (source / "song.gp5").write_bytes(data)
+    summary = encode_directory(str(source), str(tmp_path / "out"), workers=1)
+    assert summary["total"] == 2
+    assert summary["failed"] == 1
+    first, second = summary["files"]
+    assert first["input"].endswith("song.gp4") and first["error"] is None
+    assert second["input"].endswith("song.gp5") and second["output"] is None
+    assert "already written from" in second["error"]
+
+
+def test_decode_directory(tmp_path):
+    tokens_dir = tmp_path / "tokens"
+    encode_directory(
+        os.path.join(DATA_FOLDER_PATH, "*.gp4"), str(tokens_dir), workers=1
+    )
+    (tokens_dir / "broken.txt").write_text(
+        "\n".join(["a", "downtune:0", "tempo:120", "start", "new_measure"])
+        + "\nclean0:note:s1:fx\nwait:480\nend"
+    )
+    output_dir = tmp_path / "decoded"
+    summary = decode_directory(
+        str(tokens_dir), str(output_dir), workers=2, chunksize=1, maxtasksperchild=1
+    )
+    assert (summary["total"], summary["succeeded"], summary["failed"]) == (3, 2, 1)
+    for result in summary["files"]:
+        if result["error"]:
+            assert result["input"].endswith("broken.txt")
+            assert result["token_index"] == 5
+        else:
+            assert gp.parse(result["output"]).tracks
+    assert sorted(os.listdir(output_dir)) == [
+        "brower-leo-un_dia_de_noviembre.gp5",
+        "dyens-roland-la_bicyclette.gp5",
+    ]
+
+    # decoded files are skipped when the run is started again
+    summary = decode_directory(str(tokens_dir), str(output_dir), workers=1)
+    assert (summary["skipped"], summary["failed"]) == (2, 1)
+
+    summary = decode_directory(
+        str(tokens_dir), str(tmp_path / "midi"), extension=".mid", workers=1
+    )
+    assert summary["succeeded"] == 2
+    with open(summary["files"][1]["output"], "rb") as f:
+        assert f.read(4) == b"MThd"
+
+
+def test_decode_timeout(tmp_path, monkeypatch):
+    def slow_decode(input_file, output_file):
+        time.sleep(5)
+
+    monkeypatch.setattr(batch, "asdadagp_decode", slow_decode)
+    (tmp_path / "song.txt").write_text("a\ndowntune:0\ntempo:120\nstart\nend")
+    start = time.monotonic()
+    summary = decode_directory(
+        str(tmp_path), str(tmp_path / "out"), workers=1, timeout=1
+    )
+    assert time.monotonic() - start < 4
+    assert summary["files"][0]["error"].startswith("DecodeTimeout")
+    assert not os.path.exists(tmp_path / "out" / "song.gp5")
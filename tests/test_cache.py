@@ -0,0 +1,75 @@
+import os
+
+from asdadagp import cache as cache_module
+from asdadagp.cache import EncodeCache, cache_key
+from asdadagp.encoder import asdadagp_encode
+
+DATA_FOLDER_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "data"
+)
+
+
+def test_cache_key():
+    key = cache_key(b"gp", False, "Unknown")
+    assert key == cache_key(b"gp", False, "Unknown")
+    assert key != cache_key(b"gp", True, "Unknown")
+    assert key != cache_key(b"gp", False, "John Doe")
+    assert key != cache_key(b"gp2", False, "Unknown")
+
+
+def test_cache_key_tokenizer(monkeypatch):
+    key = cache_key(b"gp", False, "Unknown")
+    assert len(cache_module.tokenizer_fingerprint()) == 64
+    # a tokenizer change gives new keys
+    monkeypatch.setattr(cache_module, "tokenizer_fingerprint", lambda: "changed")
+    assert key != cache_key(b"gp", False, "Unknown")
+
+
+def test_cache_eviction(tmp_path):
+    cache = EncodeCache(str(tmp_path / "cache"), max_bytes=25)
+    token_file = tmp_path / "tokens.txt"
+    token_file.write_text("0123456789")  # 10 bytes
+    for key in ["aa1", "bb2", "cc3"]:
+        cache.put(key, str(token_file))
+    # 30 bytes > 25, the least recently used entry is gone
+    assert cache.total_bytes == 20
+    assert not cache.get("aa1", str(tmp_path / "out.txt"))
+    # a hit makes bb2 the most recently used, so cc3 is evicted next
+    assert cache.get("bb2", str(tmp_path / "out.txt"))
+    cache.put("dd4", str(token_file))
+    assert not os.path.exists(cache.path("cc3"))
+    assert os.path.exists(cache.path("bb2"))
+    # a new cache object finds the entries on disk
+    assert EncodeCache(str(tmp_path / "cache")).total_bytes == 20
+
+
+def test_cache_shared_by_processes(tmp_path):
+    # two caches on the same directory, like the workers of encode-dir
+    first = EncodeCache(str(tmp_path / "cache"), max_bytes=25)
+    second = EncodeCache(str(tmp_path / "cache"), max_bytes=25)
+    token_file = tmp_path / "tokens.txt"
+    token_file.write_text("0123456789")  # 10 bytes
+    first.put("aa1", str(token_file))
+    second.put("bb2", str(token_file))
+    first.put("cc3", str(token_file))
+    second.put("dd4", str(token_file))
+    # the entries of both count towards the limit
+    assert first.total_bytes == second.total_bytes == 20
+    assert not os.path.exists(first.path("aa1"))
+    assert not os.path.exists(first.path("bb2"))
+
+
+def test_encode_with_cache(tmp_path):
+    gp_path = os.path.join(DATA_FOLDER_PATH, "brower-leo-un_dia_de_noviembre.gp4")
+    cache = EncodeCache(str(tmp_path / "cache"))
+    uncached = tmp_path / "uncached.txt"
+    first = tmp_path / "first.txt"
+    second = tmp_path / "second.txt"
+    asdadagp_encode(gp_path, str(uncached), verbose=False)
+    asdadagp_encode(gp_path, str(first), cache=cache, verbose=False)
+    asdadagp_encode(gp_path, str(second), cache=cache, verbose=False)
+    assert (cache.misses, cache.hits) == (1, 1)
+    assert uncached.read_text() == first.read_text() == second.read_text()
+    # different encoder options are a different entry
+    asdadagp_encode(gp_path, str(second), note_tuning=True, cache=cache, verbose=False)
+    assert cache.misses == 2
@@ -1,9 +1,17 @@
+import logging
 import os
 
 import guitarpro as gp
 import pytest
-from asdadagp.decoder import tokens2guitarpro
-from asdadagp.encoder import guitarpro2tokens
+from asdadagp.decoder import (
+    SCRIPTS_PATH,
+    IncrementalDecoder,
+    new_blank_song,
+    parse_token,
+    string_fret_offsets,
+    tokens2guitarpro,
+)
+from asdadagp.encoder import asdadagp_encode, guitarpro2tokens
 from asdadagp.processor import pre_decoding_processing, tracks_check
 
 DATA_FOLDER_PATH = os.path.join(
@@ -78,3 +86,142 @@ def test_encode_decode(gp_path):
     for note_tuning in [True, False]:
         for verbose in [True, False]:
             actual_test(read_song, note_tuning, verbose)
+
+
+def test_logging(gp_path, tmp_path, capsys, caplog):
+    # nothing is printed by default, verbose output goes to the package logger
+    token_file = str(tmp_path / "tokens.txt")
+    asdadagp_encode(gp_path, token_file)
+    with open(token_file) as f:
+        tokens, tunings = pre_decoding_processing(f.read().split("\n"))
+    tokens2guitarpro(tokens, tunings=tunings)
+    assert capsys.readouterr().out == ""
+    assert not caplog.records
+
+    with caplog.at_level(logging.DEBUG, logger="asdadagp"):
+        tokens2guitarpro(tokens, verbose=True, tunings=tunings)
+    assert capsys.readouterr().out == ""
+    assert any(r.name == "asdadagp.decoder" for r in caplog.records)
+
+
+def test_blank_template(gp_path):
+    # every decoded song starts from its own copy of blank.gp5
+    blank = gp.parse(os.path.join(SCRIPTS_PATH, "blank.gp5"))
+    assert new_blank_song() == blank
+    assert new_blank_song() is not new_blank_song()
+
+    tokens, tunings = pre_decoding_processing(
+        guitarpro2tokens(gp.parse(gp_path), "Unknown")
+    )
+    song1 = tokens2guitarpro(tokens, tunings=tunings)
+    song2 = tokens2guitarpro(tokens, tunings=tunings)
+    assert song1 == song2
+    assert song1.tracks[0].measures[0] is not song2.tracks[0].measures[0]
+    assert new_blank_song() == blank
+
+
+def test_parse_token():
+    note = parse_token("clean0:note:s6:f-2")
+    assert (note.kind, note.instrument, note.string, note.fret) == (
+        "note",
+        "clean0",
+        6,
+        -2,
+    )
+    assert parse_token("clean1:rest").instrument == "clean1"
+    assert parse_token("wait:480").value == 480
+    assert parse_token("measure:repeat_close:2").value == "repeat_close"
+    assert parse_token("nfx:bend:type1").kind == "nfx"
+    assert parse_token("param:100").kind == "param"
+    assert parse_token("new_measure").kind == "new_measure"
+    assert parse_token("something").kind == "other"
+    # as written by the processor, without track prefix and with the string tuning
+    note = parse_token("note:s6:f3:D3")
+    assert (note.instrument, note.string, note.fret, note.value) == (
+        "clean0",
+        6,
+        3,
+        "D3",
+    )
+    assert parse_token("rest").instrument == "clean0"
+
+    # drop tuned frets are only allowed on the low strings
+    tokens = ["a", "downtune:0", "tempo:120", "start", "new_measure"]
+    with pytest.raises(AssertionError, match="Drop tuning"):
+        tokens2guitarpro(tokens + ["clean0:note:s2:f-2", "wait:480", "end"])
+
+
+def test_string_fret_offsets():
+    drop = string_fret_offsets("clean0", {"strings": 6, "drop_tuning": True})
+    assert drop[1] == (1, 0)
+    assert drop[6] == (6, 2)
+    assert drop[7] == (7, 2)
+    standard = string_fret_offsets("clean0", {"strings": 7, "drop_tuning": False})
+    assert all(offset == 0 for _, offset in standard)
+    bass = string_fret_offsets("bass", {"strings": 4, "drop_tuning": True})
+    assert bass[5] == (4, 2)
+    assert bass[2] == (1, 0)
+
+
+def test_same_string_notes():
+    # only the first note on a string is kept, the drop tuned fret moves up 2 frets
+    tokens = ["a", "downtune:0", "tempo:120", "start", "new_measure"]
+    tokens += ["clean0:note:s6:f-2", "clean0:note:s6:f3", "clean0:note:s1:f0"]
+    tokens += ["clean0:note:s1:f5", "clean0:note:s2:f1", "wait:3840", "end"]
+    beat = tokens2guitarpro(tokens).tracks[0].measures[0].voices[0].beats[0]
+    assert [(n.string, n.value) for n in beat.notes] == [(6, 0), (1, 0), (2, 1)]
+
+
+@pytest.mark.parametrize("note_tuning", [False, True])
+def test_decode_raw_tokens(gp_path, note_tuning):
+    # the encoder's tokens decode the same without pre_decoding_processing
+    tokens = guitarpro2tokens(gp.parse(gp_path), "Unknown", note_tuning=note_tuning)
+    song = tokens2guitarpro(tokens)
+    processed, tunings = pre_decoding_processing(tokens)
+    expected = tokens2guitarpro(processed, tunings=tunings)
+    assert song.tracks == expected.tracks
+    assert song.measureHeaders == expected.measureHeaders
+    with pytest.raises(ValueError, match="start"):
+        tokens2guitarpro(tokens[:3] + tokens[4:])
+
+
+def test_decode_missing_string_tuning():
+    # a sample that never plays string 1 keeps the tunings of the other strings
+    path = os.path.join(DATA_FOLDER_PATH, "bensusan_pierre-dame_lombarde.gp5")
+    tokens = guitarpro2tokens(gp.parse(path), "Unknown", note_tuning=True)
+    tokens = [t for t in tokens if ":s1:" not in t]
+    song = tokens2guitarpro(tokens)
+    processed, tunings = pre_decoding_processing(tokens)
+    assert (
+        song.tracks[0].strings
+        == tokens2guitarpro(processed, tunings=tunings).tracks[0].strings
+    )
+    assert tunings[1:] == ["A3", "G3", "D3", "A2", "D2"]
+
+
+@pytest.mark.parametrize("note_tuning", [False, True])
+def test_incremental_decoder(gp_path, note_tuning):
+    tokens = guitarpro2tokens(gp.parse(gp_path), "Unknown", note_tuning=note_tuning)
+    processed, tunings = pre_decoding_processing(tokens)
+    expected = tokens2guitarpro(processed, tunings=tunings)
+
+    decoder = IncrementalDecoder()
+    completed = 0
+    for i, token in enumerate(tokens):
+        measure = decoder.feed(token)
+        if measure is not None:
+            completed += 1
+            # a measure is emitted as soon as the next one starts
+            assert token in ("new_measure", "end")
+        if completed == 3 and measure is not None:
+            # the song so far, without reading the prefix again
+            assert len(decoder.song().measureHeaders) == 3
+    assert decoder.finished
+    assert decoder.close() is None
+    assert completed == tokens.count("new_measure")
+
+    song = decoder.song()
+    assert decoder.artist == "Unknown"
+    assert song.artist == expected.artist
+    assert song.tracks == expected.tracks
+    assert song.measureHeaders == expected.measureHeaders
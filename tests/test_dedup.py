@@ -0,0 +1,96 @@
+import os
+
+import guitarpro as gp
+from asdadagp.dedup import (
+    SignatureStore,
+    find_duplicate_clusters,
+    find_duplicates,
+    minhash,
+    similarity,
+    song_signature,
+)
+from asdadagp.encoder import guitarpro2tokens
+
+DATA_FOLDER_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "data"
+)
+
+
+def write_corpus(folder):
+    # two songs, a re-upload of the first with a few notes changed, and a copy of the second
+    songs = {}
+    for name in [
+        "brower-leo-un_dia_de_noviembre.gp4",
+        "dyens-roland-la_bicyclette.gp4",
+    ]:
+        songs[name] = guitarpro2tokens(
+            gp.parse(os.path.join(DATA_FOLDER_PATH, name)), ""
+        )
+    edited = list(songs["brower-leo-un_dia_de_noviembre.gp4"])
+    notes = [i for i, token in enumerate(edited) if ":note:" in token]
+    for i in notes[::100]:
+        edited[i] = "clean0:note:s1:f12"
+    songs["brower-edit"] = edited
+    songs["dyens-copy"] = songs["dyens-roland-la_bicyclette.gp4"]
+    paths = {}
+    for name, tokens in songs.items():
+        paths[name] = str(folder / (name + ".txt"))
+        with open(paths[name], "w") as f:
+            f.write("\n".join(tokens))
+    return songs, paths
+
+
+def test_signatures(tmp_path):
+    songs, paths = write_corpus(tmp_path)
+    brower = song_signature(songs["brower-leo-un_dia_de_noviembre.gp4"])
+    assert similarity(brower, song_signature(songs["brower-edit"])) > 0.7
+    assert similarity(brower, song_signature(songs["dyens-copy"])) < 0.1
+
+    clusters = find_duplicate_clusters(
+        [(name, song_signature(tokens)) for name, tokens in songs.items()],
+        threshold=0.7,
+    )
+    assert clusters == [
+        ["brower-edit", "brower-leo-un_dia_de_noviembre.gp4"],
+        ["dyens-copy", "dyens-roland-la_bicyclette.gp4"],
+    ]
+
+
+def test_find_duplicates_incremental(tmp_path):
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    songs, paths = write_corpus(corpus)
+    db_path = str(tmp_path / "signatures.sqlite")
+
+    summary = find_duplicates(str(corpus), db_path, threshold=0.7, workers=1)
+    assert summary["added"] == 4
+    assert len(summary["clusters"]) == 2
+
+    # only the new file is signed
+    with open(str(corpus / "another-copy.txt"), "w") as f:
+        f.write("\n".join(songs["dyens-copy"]))
+    summary = find_duplicates(str(corpus), db_path, threshold=0.7, workers=1)
+    assert (summary["added"], summary["unchanged"]) == (1, 4)
+    assert len(summary["clusters"][0]) == 3
+
+    with SignatureStore(db_path) as store:
+        assert len(store) == 5
+
+
+def test_empty_songs(tmp_path):
+    corpus = tmp_path / "corpus"
+    corpus.mkdir()
+    empty = ["a", "downtune:0", "tempo:120", "start", "end"]
+    for name in ["empty1.txt", "empty2.txt"]:
+        (corpus / name).write_text("\n".join(empty))
+    assert song_signature(empty) == minhash(set())
+    assert find_duplicate_clusters([("a", minhash(set())), ("b", minhash(set()))]) == []
+
+    summary = find_duplicates(
+        str(corpus), str(tmp_path / "signatures.sqlite"), workers=1
+    )
+    assert (summary["added"], summary["empty"]) == (2, 2)
+    assert summary["clusters"] == []
+    with SignatureStore(str(tmp_path / "signatures.sqlite")) as store:
+        assert len(store) == 2
+        assert list(store.signatures()) == []
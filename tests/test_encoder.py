@@ -1,7 +1,8 @@
 import os
 
 import guitarpro as gp
-from asdadagp.encoder import guitarpro2tokens
+import pytest
+from asdadagp.encoder import asdadagp_encode, guitarpro2tokens, iter_tokens
 
 DATA_FOLDER_PATH = os.path.join(
     os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "data"
@@ -61,3 +62,74 @@ def test_strings_tokens():
         ), f"Expected {expected_tuning} at position {i}, got {actual_tuning}"
 
     assert tokens_without_tuning[9] == "start"
+
+
+def test_iter_tokens(tmp_path):
+    gp_path = os.path.join(DATA_FOLDER_PATH, "dyens-roland-la_bicyclette.gp4")
+    song = gp.parse(gp_path)
+    tokens = guitarpro2tokens(song, "unknown")
+
+    stream = iter_tokens(song, "unknown")
+    # the head comes out before any measure is built
+    assert [next(stream) for _ in range(10)] == tokens[:10]
+    assert tokens[10:] == list(stream)
+
+    # asdadagp_encode writes the stream straight to the file
+    output_file = tmp_path / "tokens.txt"
+    asdadagp_encode(gp_path, str(output_file), artist_token="unknown", verbose=False)
+    assert output_file.read_text() == "\n".join(tokens)
+
+
+def test_instrument_change_rejected():
+    song = gp.parse(
+        os.path.join(DATA_FOLDER_PATH, "brower-leo-un_dia_de_noviembre.gp4")
+    )
+    beat = song.tracks[0].measures[-1].voices[0].beats[0]
+    beat.effect.mixTableChange = gp.MixTableChange(instrument=gp.MixTableItem(value=30))
+    with pytest.raises(AssertionError, match="Instrument Change Not Supported"):
+        guitarpro2tokens(song, "unknown")
+    # before the head is yielded, and outside of the encoded range too
+    with pytest.raises(AssertionError, match="Instrument Change Not Supported"):
+        next(iter_tokens(song, "unknown", start_measure=0, end_measure=1))
+    # after the cheaper checks of the tracks and the range
+    with pytest.raises(ValueError, match="Invalid measure range"):
+        guitarpro2tokens(song, "unknown", start_measure=5, end_measure=2)
+
+
+def test_measure_range():
+    gp_path = os.path.join(DATA_FOLDER_PATH, "brower-leo-un_dia_de_noviembre.gp4")
+    song = gp.parse(gp_path)
+    tokens = guitarpro2tokens(song, "unknown")
+    start = tokens.index("start")
+    measure_starts = [i for i, token in enumerate(tokens) if token == "new_measure"]
+
+    # the body of a range is the same as in the whole song, up to the range's last wait
+    part = guitarpro2tokens(song, "unknown", start_measure=10, end_measure=20)
+    assert part[: start + 1] == tokens[: start + 1]
+    assert part[start + 1 : -2] == tokens[measure_starts[10] : measure_starts[20] - 1]
+    assert part[-1] == "end"
+    assert guitarpro2tokens(song, "unknown", start_measure=10)[start + 1 :] == (
+        tokens[measure_starts[10] :]
+    )
+
+    # a beat of the measure before the range that overflows into it is carried in
+    measures = song.tracks[0].measures
+    beat = measures[9].voices[0].beats[-1]
+    beat.start = measures[10].start + 480
+    tokens = guitarpro2tokens(song, "unknown")
+    measure_starts = [i for i, token in enumerate(tokens) if token == "new_measure"]
+    part = guitarpro2tokens(song, "unknown", start_measure=10)
+    assert part[start + 1 :] == tokens[measure_starts[10] :]
+    assert part != guitarpro2tokens(gp.parse(gp_path), "unknown", start_measure=10)
+    song = gp.parse(gp_path)
+
+    # the head tempo is the tempo at the start of the range
+    # (a tempo change in the first measure of the range is a bfx:tempo_change token of the body)
+    beat = song.tracks[0].measures[5].voices[0].beats[0]
+    beat.effect.mixTableChange = gp.MixTableChange(tempo=gp.MixTableItem(value=150))
+    assert guitarpro2tokens(song, "unknown", start_measure=5)[2] == tokens[2]
+    assert "bfx:tempo_change:150" in guitarpro2tokens(song, "unknown", start_measure=5)
+    assert guitarpro2tokens(song, "unknown", start_measure=6)[2] == "tempo:150"
+
+    with pytest.raises(ValueError):
+        guitarpro2tokens(song, "unknown", start_measure=20, end_measure=10)
@@ -0,0 +1,135 @@
+import os
+import struct
+
+import guitarpro as gp
+from asdadagp.decoder import asdadagp_decode, tokens2guitarpro
+from asdadagp.encoder import guitarpro2tokens
+from asdadagp.midi import tokens2midi
+from asdadagp.processor import pre_decoding_processing
+
+DATA_FOLDER_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "data"
+)
+
+
+def read_midi(data):
+    # (division, [[(tick, status, data1, data2 or meta payload)]]) of a format 1 file
+    assert data[:4] == b"MThd"
+    _, fmt, ntracks, division = struct.unpack(">IHHH", data[4:14])
+    assert fmt == 1
+    tracks = []
+    i = 14
+    for _ in range(ntracks):
+        assert data[i : i + 4] == b"MTrk"
+        end = i + 8 + struct.unpack(">I", data[i + 4 : i + 8])[0]
+        i += 8
+        tick = 0
+        events = []
+        while i < end:
+            delta = 0
+            while True:
+                byte = data[i]
+                i += 1
+                delta = (delta << 7) | (byte & 0x7F)
+                if byte < 0x80:
+                    break
+            tick += delta
+            status = data[i]
+            if status == 0xFF:
+                kind, length = data[i + 1], data[i + 2]
+                events.append((tick, status, kind, data[i + 3 : i + 3 + length]))
+                i += 3 + length
+            elif status & 0xF0 == 0xC0:
+                events.append((tick, status, data[i + 1], None))
+                i += 2
+            else:
+                events.append((tick, status, data[i + 1], data[i + 2]))
+                i += 3
+        tracks.append(events)
+    return division, tracks
+
+
+def test_midi_matches_decoded_song():
+    song = gp.parse(os.path.join(DATA_FOLDER_PATH, "dyens-roland-la_bicyclette.gp4"))
+    tokens, tunings = pre_decoding_processing(guitarpro2tokens(song, "Unknown"))
+    decoded = tokens2guitarpro(tokens, tunings=tunings)
+
+    division, tracks = read_midi(tokens2midi(tokens, tunings=tunings))
+    assert division == 960
+    assert len(tracks) == 1 + len(decoded.tracks)
+    tempo = (60000000 // decoded.tempo).to_bytes(3, "big")
+    assert [e for e in tracks[0] if e[2] == 0x51] == [(0, 0xFF, 0x51, tempo)]
+
+    for track, events in zip(decoded.tracks, tracks[1:]):
+        # [start tick, end tick, pitch], tied notes extend the note before them on the string
+        expected = []
+        ringing = {}
+        for measure in track.measures:
+            for beat in measure.voices[0].beats:
+                end = beat.start + beat.duration.time - 960
+                for note in beat.notes:
+                    if note.type == gp.NoteType.normal:
+                        pitch = track.strings[note.string - 1].value + note.value
+                        ringing[note.string] = [beat.start - 960, end, pitch]
+                        expected.append(ringing[note.string])
+                    elif note.type == gp.NoteType.tie and note.string in ringing:
+                        ringing[note.string][1] = end
+        note_ons = sorted((e[0], e[2]) for e in events if e[1] & 0xF0 == 0x90)
+        note_offs = sorted((e[0], e[2]) for e in events if e[1] & 0xF0 == 0x80)
+        assert note_ons == sorted((start, pitch) for start, _, pitch in expected)
+        assert note_offs == sorted((end, pitch) for _, end, pitch in expected)
+
+
+def test_tied_note():
+    tokens = ["a", "downtune:0", "tempo:120", "start", "new_measure"]
+    tokens += ["clean0:note:s1:f0", "wait:960", "clean0:note:s2:f1", "wait:960"]
+    tokens += ["clean0:note:s1:f0", "nfx:tie", "wait:1920", "end"]
+    tunings = ["E4", "B3", "G3", "D3", "A2", "E2"]
+    _, tracks = read_midi(tokens2midi(tokens, tunings=tunings))
+    notes = [
+        (e[0], e[1] & 0xF0, e[2]) for e in tracks[1] if e[1] & 0xF0 in (0x80, 0x90)
+    ]
+    # the tie extends E4 to the end of the measure, C4 rings until the tied beat
+    assert notes == [(0, 0x90, 64), (960, 0x90, 60), (1920, 0x80, 60), (3840, 0x80, 64)]
+
+
+def test_overlapping_notes_of_one_pitch():
+    # E4 on string 1, tied twice, and E4 on string 2 for the second beat only
+    tokens = ["a", "downtune:0", "tempo:120", "start", "new_measure"]
+    tokens += ["clean0:note:s1:f0", "wait:960"]
+    tokens += ["clean0:note:s1:f0", "nfx:tie", "clean0:note:s2:f5", "wait:960"]
+    tokens += ["clean0:note:s1:f0", "nfx:tie", "wait:960", "end"]
+    tunings = ["E4", "B3", "G3", "D3", "A2", "E2"]
+    _, tracks = read_midi(tokens2midi(tokens, tunings=tunings))
+    notes = [
+        (e[0], e[1] & 0xF0, e[2]) for e in tracks[1] if e[1] & 0xF0 in (0x80, 0x90)
+    ]
+    # the end of the string 2 note doesn't cut the string 1 note short
+    assert notes == [(0, 0x90, 64), (960, 0x90, 64), (2880, 0x80, 64)]
+
+
+def test_tempo_out_of_range():
+    tokens = ["a", "downtune:0", "tempo:0", "start", "new_measure"]
+    tokens += ["clean0:note:s1:f0", "wait:3840", "new_measure"]
+    tokens += ["clean0:note:s1:f0", "bfx:tempo_change:3", "wait:3840", "end"]
+    tunings = ["E4", "B3", "G3", "D3", "A2", "E2"]
+    _, tracks = read_midi(tokens2midi(tokens, tunings=tunings))
+    tempos = [(e[0], int.from_bytes(e[3], "big")) for e in tracks[0] if e[2] == 0x51]
+    assert tempos == [(0, 0xFFFFFF), (3840, 0xFFFFFF)]
+
+
+def test_tempo_change(tmp_path):
+    tokens = ["a", "downtune:0", "tempo:120", "start", "new_measure"]
+    tokens += ["clean0:note:s1:f0", "wait:3840", "new_measure"]
+    tokens += ["clean0:note:s2:f1", "bfx:tempo_change:90", "wait:3840", "end"]
+    tunings = ["E4", "B3", "G3", "D3", "A2", "E2"]
+    _, tracks = read_midi(tokens2midi(tokens, tunings=tunings))
+    tempos = [(e[0], int.from_bytes(e[3], "big")) for e in tracks[0] if e[2] == 0x51]
+    assert tempos == [(0, 500000), (3840, 666666)]
+    # E4 and C4
+    assert [(e[0], e[2]) for e in tracks[1] if e[1] == 0x90] == [(0, 64), (3840, 60)]
+
+    token_file = tmp_path / "tokens.txt"
+    token_file.write_text("\n".join(tokens[:3] + tunings + tokens[3:]))
+    asdadagp_decode(str(token_file), str(tmp_path / "out.mid"))
+    assert (tmp_path / "out.mid").read_bytes() == tokens2midi(tokens, tunings=tunings)
@@ -1,3 +1,4 @@
+import logging
 import os
 from typing import List
 
@@ -5,8 +6,14 @@ import guitarpro as gp
 import pytest
 from asdadagp.encoder import guitarpro2tokens
 from asdadagp.processor import (
+    MeasureView,
+    TokenDocument,
+    TokenMeasure,
     get_string_tunings,
+    index_measures,
     measures_playing_order,
+    pre_decoding_processing,
+    read_token_header,
     repeat_related_measure_indices,
     split_tokens_to_measures,
     tokens_to_measures,
@@ -98,6 +105,44 @@ def test_get_string_tunings(celtic_tuning_gp_path, multi_tracks_gp_path):
     )
 
 
+def test_read_token_header(repeat_bars_tokens, caplog):
+    header = read_token_header(repeat_bars_tokens)
+    assert (header.artist, header.downtune, header.body_start) == ("unknown", 0, 4)
+    assert header.note_tuning
+    assert header.tunings == ("E4", "B3", "G3", "D3", "A2", "E2")
+
+    # a string without notes gets its E standard tuning, downtuned like the song
+    tokens = ["a", "downtune:-2", "tempo:90", "start", "new_measure"]
+    tokens += ["clean0:note:s%s:f0:%s" % (s, t) for s, t in [(1, "D4"), (6, "D2")]]
+    tokens += ["wait:480", "end"]
+    with caplog.at_level(logging.WARNING):
+        header = read_token_header(tokens)
+    assert header.tunings == ("D4", "A3", "F3", "C3", "G2", "D2")
+    assert "No note on string 2" in caplog.text
+
+    # a string keeps the tuning of its first note
+    tokens = tokens[:5] + ["clean0:note:s1:f0:E4"] + tokens[5:]
+    assert read_token_header(tokens).tunings[0] == "E4"
+
+    with pytest.raises(ValueError, match="start"):
+        read_token_header(tokens[:3] + tokens[4:])
+
+
+def test_token_document(repeat_bars_tokens):
+    document = TokenDocument(repeat_bars_tokens)
+    assert document.header is document.header
+    assert get_string_tunings(document) == get_string_tunings(repeat_bars_tokens)
+    assert pre_decoding_processing(document) == pre_decoding_processing(
+        repeat_bars_tokens
+    )
+    assert tracks_check(document) == tracks_check(repeat_bars_tokens)
+    assert len(tokens_to_measures(document)) == 77
+    assert document.index("new_measure", 5) == repeat_bars_tokens.index(
+        "new_measure", 5
+    )
+    assert list(index_measures(document)) == list(index_measures(repeat_bars_tokens))
+
+
 def test_extra_track_merge(multi_track_tokens):
     sound_notes = [
         token
@@ -173,6 +218,39 @@ def test_measures(repeat_bars_tokens):
     assert len(play_order_tokens) == 122
 
 
+def test_measure_views(repeat_bars_tokens):
+    measures = tokens_to_measures(repeat_bars_tokens)
+    # the same measures as splitting the tokens into lists
+    split = split_tokens_to_measures(repeat_bars_tokens[:-1])[1:]
+    for measure, tokens in zip(measures, split):
+        assert isinstance(measure.tokens, MeasureView)
+        assert measure.tokens.source is repeat_bars_tokens
+        assert measure.tokens == [t for t in tokens if not t.startswith("measure:")]
+    assert measures[1] == TokenMeasure(list(measures[1].tokens), True, False, False)
+
+    view = measures[0].tokens
+    assert view[-1] == list(view)[-1]
+    assert view[1:3] == list(view)[1:3]
+    assert isinstance(view[1:3], MeasureView)
+    with pytest.raises(IndexError):
+        view[len(view)]
+
+    index = index_measures(repeat_bars_tokens)
+    assert len(index) == 77
+    assert index[-1] == measures[-1]
+
+    # measure tokens after the notes are left out too, that measure is copied
+    tokens = ["a", "downtune:0", "tempo:90", "start", "new_measure", "new_measure"]
+    tokens += ["measure:repeat_open", "note:s1:f0", "measure:repeat_close:2"]
+    tokens += ["wait:480", "new_measure", "note:s1:f2", "wait:480", "end"]
+    measures = tokens_to_measures(tokens)
+    assert measures == [
+        TokenMeasure(["note:s1:f0", "wait:480"], True, True, False),
+        TokenMeasure(["note:s1:f2", "wait:480"], False, False, False),
+    ]
+    assert isinstance(measures[0].tokens, list)
+
+
 def test_alternative_endings():
     """Test how the system handles repeat structures with alternative endings."""
 
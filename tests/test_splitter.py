@@ -1,7 +1,9 @@
 from asdadagp.token_splitter import (
+    binarization,
     split_bend_token,
     split_grace_token,
     split_rare_token,
+    split_tokens,
     split_trill_token,
     split_wait_token,
     unsplit_bend_fx,
@@ -32,6 +34,52 @@ def test_wait_token():
     ]
 
 
+def test_binarization():
+    def reference(n):
+        # the original DadaGP implementation
+        l = []
+        for i in range(1, 20):
+            p = 2**i
+            r = n % p
+            n -= r
+            if r > 0:
+                l.append(r)
+        l.reverse()
+        return l
+
+    for n in list(range(-5, 70000, 7)) + [2**19 + 5, 2**20 + 2**15 + 3]:
+        assert binarization(n) == reference(n)
+
+
+def test_split_tokens():
+    tokens = [
+        "wait:480",
+        "wait:121",
+        "wait:121",
+        "wait:40000",
+        "clean0:note:s1:f2",
+        "nfx:trill:fret3:duration240",
+        "nfx:grace:fret4:duration128:dead0:beat0:transition1",
+        "nfx:bend:type1:pos0:val0:vib0:pos6:val4:vib0:pos12:val4:vib0",
+        "bfx:tremolo_bar:type6:pos0:val0:vib0:pos6:val-4:vib0:pos12:val0:vib0",
+        "nfx:trill",
+        "bfx:stroke:down",
+        "end",
+    ]
+    expected = [t for token in tokens for t in split_rare_token(token)]
+    assert split_tokens(tokens) == expected
+    assert expected[:7] == [
+        "wait:480",
+        "wait:64",
+        "wait:32",
+        "wait:16",
+        "wait:8",
+        "wait:1",
+        "wait:64",
+    ]
+    assert "nfx:trill" in expected and "bfx:stroke:down" in expected
+
+
 def test_bend_token():
     assert split_bend_token(
         "nfx:bend:type5:pos0:val4:vib0:pos2:val4:vib0:pos4:val0:vib0:pos8:val0:vib0:pos12:val0:vib0"
@@ -1,13 +1,20 @@
 import os
+import random
 from fractions import Fraction
 
 import guitarpro as gp
 from asdadagp.utils import (
+    EncoderEvent,
+    MeasureOccupancy,
+    TrackContext,
     convert_strings_for_pygp,
     convert_to_nearest_supported_time,
     diff,
+    duration_from_time,
+    get_fret,
     guitar_downtunage,
     noteNumber,
+    oops_theres_a_note_here,
 )
 
 DATA_FOLDER_PATH = os.path.join(
@@ -48,6 +55,17 @@ def test_time_support():
     )  ## if duration is too large, use the max supported duration
 
 
+def test_duration_from_time():
+    duration, new_time = duration_from_time(1440)
+    assert duration == gp.Duration.fromTime(1440)  # dotted quarter
+    assert new_time is None
+    # a duration Guitar Pro can't represent is rounded
+    duration, new_time = duration_from_time(1000)
+    assert (duration, new_time) == (gp.Duration.fromTime(960), 960)
+    # conversions are remembered but each beat gets its own Duration
+    assert duration_from_time(1000)[0] is not duration
+
+
 def test_load_score():
     blankgp5 = gp.parse(os.path.join(DATA_FOLDER_PATH, "blank.gp5"))
     blankgp5.tracks = []
@@ -60,3 +78,53 @@ def test_load_score():
     new_track.strings = convert_strings_for_pygp(strings, -2)
     # print(new_track.strings)
     assert new_track.strings[0].value == 74
+
+
+def test_measure_occupancy_matches_linear_scan():
+    # The index must accept/reject exactly like oops_theres_a_note_here
+    rng = random.Random(0)
+    for _ in range(200):
+        events = [{"type": "measure", "track": -1, "start": 960, "tokens": []}]
+        occupancy = MeasureOccupancy()
+        occupancy.new_stream()
+        occupancy.append(EncoderEvent(**events[0]))
+        for _ in range(rng.randint(1, 40)):
+            if rng.random() < 0.2:
+                # next voice
+                occupancy.new_stream()
+            event = {
+                "type": rng.choice(["note", "note", "rest"]),
+                "track": 0,
+                "instrument_prefix": rng.choice(["clean0", "clean1"]),
+                "start": 960 + 240 * rng.randint(0, 7),
+                "duration": rng.choice([240, 480, 960]),
+                "string": rng.randint(1, 6),
+            }
+            if event["type"] == "rest":
+                del event["string"]
+            expected = oops_theres_a_note_here(event, events)
+            if expected:
+                events.append(event)
+            assert occupancy.insert(EncoderEvent(**event)) == expected
+        placed = [
+            {
+                name: getattr(e, name)
+                for name in e.__slots__
+                if getattr(e, name) is not None
+            }
+            for e in occupancy.events_in_order()
+        ]
+        assert placed == events
+
+
+def test_track_context_fret():
+    for name in ["bensusan_pierre-dame_lombarde.gp5", "dyens-roland-la_bicyclette.gp4"]:
+        song = gp.parse(os.path.join(DATA_FOLDER_PATH, name))
+        for track in song.tracks:
+            context = TrackContext(track, "clean0")
+            assert context.strings == [str(s) for s in track.strings]
+            for measure in track.measures:
+                for voice in measure.voices:
+                    for beat in voice.beats:
+                        for note in beat.notes:
+                            assert context.fret(note) == get_fret(note, track, 0)
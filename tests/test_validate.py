@@ -0,0 +1,125 @@
+import os
+
+import guitarpro as gp
+import pytest
+from asdadagp.decoder import tokens2guitarpro
+from asdadagp.encoder import guitarpro2tokens
+from asdadagp.processor import tracks_check
+from asdadagp.validate import validate_tokens
+
+DATA_FOLDER_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "data"
+)
+
+EXAMPLES_FOLDER_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "asdadagp", "examples"
+)
+
+HEAD = ["a", "downtune:0", "tempo:120", "E5", "B4", "G4", "D4", "A3", "E3", "start"]
+
+
+@pytest.mark.parametrize("note_tuning", [False, True])
+def test_encoded_tokens_are_valid(note_tuning):
+    for name in [
+        "brower-leo-un_dia_de_noviembre.gp4",
+        "dyens-roland-la_bicyclette.gp4",
+    ]:
+        song = gp.parse(os.path.join(DATA_FOLDER_PATH, name))
+        tokens = guitarpro2tokens(song, "Unknown", note_tuning=note_tuning)
+        assert validate_tokens(tokens) == []
+        # without the "cleanX:" prefixes
+        assert validate_tokens(tracks_check(tokens, merge_track=True)) == []
+
+
+def test_example_files_are_valid():
+    # the example token files that decode, some have no note on every string
+    for name in [
+        "ed_sheeran_photograph.txt",
+        "ed_sheeran_supermarket_flowers.txt",
+        "ed_sheeran_supermarket_flowers_merge_tracks.txt",
+        "maroon5_payphone.txt",
+        "merge_rest_test.txt",
+        "repeat_measure_test.txt",
+        "test_measure_splitting.txt",
+    ]:
+        with open(os.path.join(EXAMPLES_FOLDER_PATH, name)) as f:
+            tokens = f.read().split("\n")
+        assert validate_tokens(tokens) == [], name
+        tokens2guitarpro(tokens)
+
+
+def test_invalid_tokens():
+    tokens = HEAD + [
+        "clean0:note:s1:f0",  # 10
+        "new_measure",
+        "clean0:note:s8:f0",  # 12
+        "clean0:note:s2:f-2",  # 13
+        "param:1",  # 14
+        "clean2:note:s1:f0",  # 15
+        "nfx:bend:type1",
+        "param:1",
+        "wait:480",
+        "new_measure",  # 19
+        "new_measure",
+        "note:s6:f-1",
+        "wait:x",  # 22
+        "wait:480",
+        "end",
+    ]
+    errors = validate_tokens(tokens)
+    assert [(e.index, e.measure) for e in errors] == [
+        (10, None),
+        (12, 0),
+        (13, 0),
+        (14, 0),
+        (15, 0),
+        (22, 2),
+        (19, 1),
+    ]
+    assert errors[1].token == "clean0:note:s8:f0"
+    assert "new_measure" in errors[0].message
+    assert "no duration" in errors[-1].message
+
+    assert validate_tokens(tokens, max_errors=1) == errors[:1]
+
+
+def test_invalid_head_and_end():
+    assert validate_tokens(["a", "downtune:0", "tempo:120"])[0].index is None
+    errors = validate_tokens(["a", "downtune:x", "tempo:120", "start", "new_measure"])
+    assert [e.message for e in errors] == [
+        "expected downtune:<int>",
+        "no 'end' token, the last measure would be lost",
+        "measure has no duration",
+    ]
+    # a note tuning the decoder can't read
+    errors = validate_tokens(
+        ["a", "downtune:0", "tempo:120", "start", "new_measure"]
+        + ["clean0:note:s1:f0:X9", "clean0:note:s2:f0", "wait:480", "end"]
+    )
+    assert [(e.index, e.message) for e in errors] == [(5, "invalid note tuning X9")]
+
+
+def test_invalid_effects_and_frets(tmp_path):
+    valid = [
+        "clean0:note:s1:f12",
+        "nfx:grace:fret3",
+        "param:duration32:dead0:beat0:transition1",
+        "nfx:harmonic:3:fret24",
+        "bfx:tempo_change:90",
+        "wait:480",
+    ]
+    tokens = HEAD + ["new_measure"] + valid + ["end"]
+    assert validate_tokens(tokens) == []
+    # the valid tokens can be written
+    gp.write(tokens2guitarpro(tokens), str(tmp_path / "valid.gp5"))
+
+    tokens = ["a", "downtune:0", "tempo:0"] + HEAD[3:] + ["new_measure"]
+    tokens += ["clean0:note:s1:f999", "bfx:tempo_change", "wait:480"]  # 11, 12
+    tokens += ["clean0:note:s2:f0", "nfx:grace:fret3"]  # 15
+    tokens += ["param:duration32:dead0:beat0:transition9", "wait:480"]
+    tokens += ["clean0:note:s3:f0", "nfx:harmonic:2:pitch3", "wait:480", "end"]  # 19
+    errors = validate_tokens(tokens)
+    assert [e.index for e in errors] == [2, 11, 12, 15, 19]
+    assert errors[0].message == "tempo must be positive"
+    assert errors[1].message == "fret 999 above 99"
+    assert errors[2].message == "invalid effect, expected bfx:tempo_change:<tempo>"
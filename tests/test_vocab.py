@@ -0,0 +1,60 @@
+import os
+from array import array
+
+import guitarpro as gp
+import pytest
+from asdadagp.decoder import ids2guitarpro
+from asdadagp.encoder import guitarpro2ids, guitarpro2tokens
+from asdadagp.vocab import UNK_TOKEN, Vocabulary, load_ids, save_ids
+
+DATA_FOLDER_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "data"
+)
+
+
+def test_vocabulary_ids(tmp_path):
+    vocab = Vocabulary.from_corpus([["a", "b", "b"], ["c", "b", "a"]])
+    # most frequent first, ties in alphabetical order
+    assert [vocab.id_to_token(i) for i in range(len(vocab))] == [
+        UNK_TOKEN,
+        "b",
+        "a",
+        "c",
+    ]
+
+    ids = vocab.encode(["a", "d", "c"])
+    assert ids == array("H", [2, 0, 3])
+    assert vocab.decode(ids) == ["a", UNK_TOKEN, "c"]
+
+    path = str(tmp_path / "vocab.txt")
+    vocab.save(path)
+    loaded = Vocabulary.load(path)
+    assert loaded == vocab
+
+    # extending keeps the existing ids
+    loaded.unk_policy = "add"
+    assert list(loaded.encode(["d", "a"])) == [4, 2]
+
+    loaded.unk_policy = "error"
+    with pytest.raises(KeyError):
+        loaded.encode(["e"])
+
+
+def test_ids_round_trip(tmp_path):
+    song = gp.parse(
+        os.path.join(DATA_FOLDER_PATH, "brower-leo-un_dia_de_noviembre.gp4")
+    )
+    for note_tuning in [True, False]:
+        tokens = guitarpro2tokens(song, "unknown", note_tuning=note_tuning)
+        vocab = Vocabulary.from_corpus([tokens])
+        ids = guitarpro2ids(song, vocab, "unknown", note_tuning=note_tuning)
+        assert vocab.decode(ids) == tokens
+
+        path = str(tmp_path / "ids.bin")
+        save_ids(ids, path)
+        assert load_ids(path, vocab.typecode) == ids
+
+        decoded_song = ids2guitarpro(ids, vocab)
+        assert (
+            guitarpro2tokens(decoded_song, "unknown", note_tuning=note_tuning) == tokens
+        )